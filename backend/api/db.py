@@ -0,0 +1,115 @@
+"""Запросы к базе, которых нет в ORM."""
+from django.db import connections, router
+from django.db.models import Model
+
+
+def insert_ignore(model, **values):
+    """Вставляет строку одним INSERT ... ON CONFLICT DO NOTHING.
+
+    Возвращает первичный ключ новой строки или None, если такая строка
+    уже есть (нарушено бы уникальное ограничение). В отличие от exists()
+    и create() параллельный запрос не получает IntegrityError: проверку
+    и вставку делает сама база. Сигналы post_save не отправляются.
+    """
+    inserted = insert_ignore_many(model, [values])
+    return inserted[0] if inserted else None
+
+
+def insert_ignore_many(model, rows, returning='pk'):
+    """Вставляет строки rows (словари значений полей) одним INSERT ...
+    ON CONFLICT DO NOTHING, см. insert_ignore.
+
+    Возвращает список значений поля returning только у действительно
+    вставленных строк: при параллельных запросах каждая новая строка
+    попадает в ответ только одному из них.
+    """
+    if not rows:
+        return []
+    connection = connections[router.db_for_write(model)]
+    opts = model._meta
+    fields = [
+        field for field in opts.concrete_fields if not field.primary_key
+    ]
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(field.column) for field in fields)
+    placeholders = ', '.join(['%s'] * len(fields))
+    params = []
+    for values in rows:
+        instance = model(**values)
+        params.extend(
+            field.get_db_prep_save(
+                field.pre_save(instance, True), connection
+            )
+            for field in fields
+        )
+    column = (
+        opts.pk if returning == 'pk' else opts.get_field(returning)
+    ).column
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {quote(opts.db_table)} ({columns}) VALUES '
+            + ', '.join([f'({placeholders})'] * len(rows))
+            + f' ON CONFLICT DO NOTHING RETURNING {quote(column)}',
+            params
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def delete_returning(model, returning='pk', **filters):
+    """Удаляет строки одним DELETE ... RETURNING.
+
+    Фильтры — поле=значение или поле__in=значения, объединяются по И.
+    Возвращает список значений поля returning удалённых строк: при
+    параллельных запросах каждая строка попадает в ответ только одному
+    из них. Сигналы и каскадное удаление не выполняются.
+    """
+    connection = connections[router.db_for_write(model)]
+    opts = model._meta
+    quote = connection.ops.quote_name
+    conditions, params = [], []
+    for lookup, value in filters.items():
+        name, _, operator = lookup.partition('__')
+        if operator not in ('', 'in'):
+            raise ValueError(f'Неподдерживаемый фильтр: {lookup}')
+        field = opts.pk if name == 'pk' else opts.get_field(name)
+        values = [
+            field.get_db_prep_value(
+                item.pk if isinstance(item, Model) else item, connection
+            )
+            for item in (value if operator else [value])
+        ]
+        if not values:
+            return []
+        placeholders = ', '.join(['%s'] * len(values))
+        conditions.append(
+            f'{quote(field.column)} IN ({placeholders})' if operator
+            else f'{quote(field.column)} = %s'
+        )
+        params.extend(values)
+    column = (
+        opts.pk if returning == 'pk' else opts.get_field(returning)
+    ).column
+    where = ' AND '.join(conditions) or '1 = 1'
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {quote(opts.db_table)} WHERE {where} '
+            f'RETURNING {quote(column)}',
+            params
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def lock_table(model):
+    """Блокирует таблицу модели от записи до конца транзакции.
+
+    Чтение не блокируется. На SQLite запись и так одна на всю базу,
+    там блокировка не нужна.
+    """
+    connection = connections[router.db_for_write(model)]
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'LOCK TABLE {connection.ops.quote_name(model._meta.db_table)} '
+            'IN EXCLUSIVE MODE'
+        )
@@ -1,21 +1,55 @@
+from django.db.models import Exists, OuterRef
+from django_filters import fields
 from django_filters import rest_framework as filters
 
-from recipes.models import Ingredient, Recipe
+from recipes import cache as recipe_cache
+from recipes.models import Favorite, Recipe, ShoppingCart
 
 
-class IngredientFilter(filters.FilterSet):
-    """Фильтр для поиска ингредиентов по названию."""
-    name = filters.CharFilter(field_name='name', lookup_expr='istartswith')
+def get_tag_choices():
+    return [(slug, slug) for slug in recipe_cache.get_tag_ids()]
 
-    class Meta:
-        model = Ingredient
-        fields = ('name',)
+
+class TagSlugField(fields.MultipleChoiceField):
+    """Поле слагов тегов: слаги, которых нет в кэше, ищутся в базе."""
+
+    def validate(self, value):
+        # Выбор перечитывается при проверке и увидит добавленные теги.
+        if value:
+            recipe_cache.get_tag_ids(slugs=value)
+        super().validate(value)
+
+
+class TagSlugFilter(filters.MultipleChoiceFilter):
+    """Фильтр рецептов по любому из слагов тегов.
+
+    Слаги сверяются со словарём тегов из кэша (recipes.cache), а
+    рецепты отбираются подзапросом EXISTS по таблице связи: без JOIN
+    с тегами, повторов строк и DISTINCT.
+    """
+    field_class = TagSlugField
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('choices', get_tag_choices)
+        kwargs.setdefault('distinct', False)
+        super().__init__(*args, **kwargs)
+
+    def filter(self, qs, value):
+        if not value:
+            return qs
+        tag_ids = recipe_cache.get_tag_ids(slugs=value)
+        return qs.filter(Exists(
+            Recipe.tags.through.objects.filter(
+                recipe=OuterRef('pk'),
+                tag_id__in=[tag_ids[slug] for slug in value],
+            )
+        ))
 
 
 class RecipeFilter(filters.FilterSet):
     """Фильтр для рецептов."""
     author = filters.NumberFilter(field_name='author__id')
-    tags = filters.AllValuesMultipleFilter(field_name='tags__slug')
+    tags = TagSlugFilter()
     is_favorited = filters.BooleanFilter(method='filter_is_favorited')
     is_in_shopping_cart = filters.BooleanFilter(
         method='filter_is_in_shopping_cart'
@@ -28,11 +62,15 @@ class RecipeFilter(filters.FilterSet):
     def filter_is_favorited(self, queryset, name, value):
         user = self.request.user
         if value and user.is_authenticated:
-            return queryset.filter(favorited_by__user=user)
+            return queryset.filter(Exists(Favorite.objects.filter(
+                user=user, recipe=OuterRef('pk')
+            )))
         return queryset
 
     def filter_is_in_shopping_cart(self, queryset, name, value):
         user = self.request.user
         if value and user.is_authenticated:
-            return queryset.filter(in_shopping_carts__user=user)
+            return queryset.filter(Exists(ShoppingCart.objects.filter(
+                user=user, recipe=OuterRef('pk')
+            )))
         return queryset
@@ -0,0 +1,310 @@
+"""Приём загруженных изображений и их уменьшенные версии.
+
+Изображения из base64 (StreamingBase64ImageField) декодируются кусками
+во временный файл, без копии всего файла в памяти. Размер в пикселях
+проверяется по заголовку до полного декодирования (защита от
+«декомпрессионных бомб»), слишком большие изображения уменьшаются до
+IMAGE_MAX_SIDE по большей стороне.
+
+После сохранения рецепта или аватара вне цикла запроса строятся версии
+thumbnail, card и full, вписанные в размеры RENDITIONS, в WebP (или JPEG,
+если Pillow собран без WebP). Имена файлов версий хранятся в JSON-поле
+модели (<поле>_renditions) вместе с именем исходного файла в ключе
+source. Пока версии не готовы или устарели после замены изображения,
+вместо них отдаётся оригинал.
+
+Версии строятся в пуле потоков процесса после фиксации транзакции
+(IMAGE_RENDITIONS_ASYNC=False — сразу, в том же потоке). Если процесс
+завершится раньше, недостроенные версии достроит команда
+build_image_renditions.
+"""
+import binascii
+import contextlib
+import io
+import logging
+import os
+import tempfile
+import uuid
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import UploadedFile
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps, features
+
+logger = logging.getLogger(__name__)
+
+RENDITIONS = {
+    'thumbnail': (160, 160),
+    'card': (480, 480),
+    'full': (1200, 1200),
+}
+QUALITY = 80
+
+# Форматы, которые принимаются при загрузке, и расширения файлов.
+UPLOAD_FORMATS = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif', 'WEBP': 'webp'}
+# Символов base64 в куске: кратно 4, около 256 КБ после декодирования.
+BASE64_CHUNK = 4 * 64 * 1024
+BASE64_MARKER = ';base64,'
+
+_executor = None
+
+
+class ImageUploadError(ValueError):
+    """Загруженные данные не являются допустимым изображением."""
+
+
+def get_max_pixels():
+    return getattr(settings, 'IMAGE_MAX_PIXELS', 40_000_000)
+
+
+def get_max_side():
+    return getattr(settings, 'IMAGE_MAX_SIDE', 2560)
+
+
+def decode_base64_to_file(data, file, chunk_size=BASE64_CHUNK):
+    """Декодирует base64 (можно с заголовком data:) в file кусками.
+
+    Строка не копируется целиком: срезы берутся по смещениям, пробелы
+    внутри куска отбрасываются, остаток до кратного 4 переносится в
+    следующий кусок. Возвращает число записанных байт.
+    """
+    start = data.find(BASE64_MARKER, 0, 256)
+    start = 0 if start < 0 else start + len(BASE64_MARKER)
+    size = 0
+    rest = ''
+    for offset in range(start, len(data), chunk_size):
+        chunk = rest + ''.join(data[offset:offset + chunk_size].split())
+        cut = len(chunk) - len(chunk) % 4
+        chunk, rest = chunk[:cut], chunk[cut:]
+        try:
+            decoded = binascii.a2b_base64(
+                chunk.encode('ascii'), strict_mode=True
+            )
+        except (binascii.Error, UnicodeEncodeError):
+            raise ImageUploadError('Неверные данные base64.')
+        file.write(decoded)
+        size += len(decoded)
+    if rest:
+        raise ImageUploadError('Неверные данные base64.')
+    return size
+
+
+def _remove_file(path):
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(path)
+
+
+class IngestedImageFile(UploadedFile):
+    """Изображение во временном файле на диске.
+
+    FileSystemStorage перемещает такой файл на место, не копируя
+    (temporary_file_path). Если файл не сохранён, он удаляется, когда
+    объект больше не нужен.
+    """
+
+    def __init__(self, extension, content_type):
+        file = tempfile.NamedTemporaryFile(
+            suffix='.upload', delete=False,
+            dir=settings.FILE_UPLOAD_TEMP_DIR,
+        )
+        super().__init__(
+            file, f'{uuid.uuid4()}.{extension}', content_type, 0
+        )
+        weakref.finalize(self, _remove_file, file.name)
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def _downscale(image, max_side):
+    """Уменьшенная копия изображения во временном файле того же формата.
+
+    Для JPEG draft() декодирует сразу в уменьшенном масштабе, поэтому
+    полный растр исходника в память не попадает.
+    """
+    image_format = image.format
+    image.draft('RGB', (max_side, max_side))
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail((max_side, max_side), Image.LANCZOS)
+    file = IngestedImageFile(
+        UPLOAD_FORMATS[image_format], Image.MIME[image_format]
+    )
+    image.save(file, image_format, quality=90)
+    file.size = file.tell()
+    file.seek(0)
+    return file
+
+
+INVALID_IMAGE_MESSAGE = (
+    'Загрузите правильное изображение. Файл, который вы загрузили, '
+    'поврежден или не является изображением.'
+)
+
+
+def _check_header(file):
+    """Открывает изображение, читая только заголовок, и проверяет формат
+    и число пикселей."""
+    try:
+        image = Image.open(file)
+    except (Image.DecompressionBombError, OSError):
+        raise ImageUploadError(INVALID_IMAGE_MESSAGE)
+    if image.format not in UPLOAD_FORMATS:
+        raise ImageUploadError('Неподдерживаемый формат изображения.')
+    width, height = image.size
+    if width * height > get_max_pixels():
+        raise ImageUploadError(
+            f'Слишком большое изображение: {width}×{height} пикселей.'
+        )
+    return image
+
+
+def ingest_base64(data):
+    """Изображение из строки base64 в виде временного загруженного файла.
+
+    Проверяет формат и число пикселей по заголовку, уменьшает
+    изображения больше IMAGE_MAX_SIDE. Ошибки — ImageUploadError.
+    """
+    file = IngestedImageFile('upload', None)
+    try:
+        file.size = decode_base64_to_file(data, file)
+        file.seek(0)
+        with _check_header(file) as image:
+            image_format = image.format
+            max_side = get_max_side()
+            if max(image.size) > max_side:
+                downscaled = _downscale(image, max_side)
+                file.close()
+                return downscaled
+            image.verify()
+    except ImageUploadError:
+        file.close()
+        raise
+    except Exception:
+        file.close()
+        raise ImageUploadError(INVALID_IMAGE_MESSAGE)
+    file.seek(0)
+    file.name = f'{uuid.uuid4()}.{UPLOAD_FORMATS[image_format]}'
+    file.content_type = Image.MIME[image_format]
+    return file
+
+
+def get_format():
+    """Формат и расширение файлов версий."""
+    if features.check('webp'):
+        return 'WEBP', 'webp'
+    return 'JPEG', 'jpg'
+
+
+def renditions_field(field):
+    return f'{field}_renditions'
+
+
+def is_ready(field_file, renditions):
+    return bool(field_file) and renditions.get('source') == field_file.name
+
+
+def rendition_urls(field_file, renditions, build_url):
+    """Ссылки на версии изображения; оригинал — пока версии не готовы."""
+    if not field_file:
+        return None
+    names = renditions if is_ready(field_file, renditions) else {}
+    original = build_url(field_file.url)
+    return {
+        name: (
+            build_url(field_file.storage.url(names[name]))
+            if name in names else original
+        )
+        for name in RENDITIONS
+    }
+
+
+def _render(image, size, image_format):
+    copy = image.copy()
+    copy.thumbnail(size, Image.LANCZOS)
+    if image_format == 'JPEG' and copy.mode != 'RGB':
+        copy = copy.convert('RGB')
+    buffer = io.BytesIO()
+    copy.save(buffer, image_format, quality=QUALITY, method=4)
+    return buffer.getvalue()
+
+
+def make_renditions(field_file):
+    """Строит и сохраняет версии файла; возвращает значение JSON-поля."""
+    image_format, extension = get_format()
+    storage = field_file.storage
+    directory, filename = os.path.split(field_file.name)
+    stem = os.path.splitext(filename)[0]
+    with field_file.open('rb') as file, Image.open(file) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'A' in image.getbands()
+                                  else 'RGB')
+        renditions = {'source': field_file.name}
+        for name, size in RENDITIONS.items():
+            path = os.path.join(
+                directory, 'renditions', f'{stem}.{name}.{extension}'
+            )
+            renditions[name] = storage.save(
+                path, ContentFile(_render(image, size, image_format))
+            )
+    return renditions
+
+
+def update_renditions(model, pk, field):
+    """Строит версии изображения field объекта model с ключом pk.
+
+    JSON-поле обновляется, только если изображение не сменилось за время
+    обработки. Возвращает True, если версии записаны.
+    """
+    instance = model.objects.filter(pk=pk).only(
+        field, renditions_field(field)
+    ).first()
+    if instance is None:
+        return False
+    field_file = getattr(instance, field)
+    if not field_file or is_ready(
+        field_file, getattr(instance, renditions_field(field))
+    ):
+        return False
+    if not field_file.storage.exists(field_file.name):
+        logger.warning('Файл %s не найден', field_file.name)
+        return False
+    renditions = make_renditions(field_file)
+    return bool(
+        model.objects.filter(pk=pk, **{field: field_file.name}).update(
+            **{renditions_field(field): renditions}
+        )
+    )
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='renditions'
+        )
+    return _executor
+
+
+def _run(job, *args):
+    close_old_connections()
+    try:
+        job(*args)
+    except Exception:
+        logger.exception('Не удалось построить версии изображения')
+    finally:
+        close_old_connections()
+
+
+def schedule(job, *args):
+    """Запускает job(*args) после фиксации транзакции вне запроса."""
+    def submit():
+        if getattr(settings, 'IMAGE_RENDITIONS_ASYNC', True):
+            _get_executor().submit(_run, job, *args)
+        else:
+            job(*args)
+
+    transaction.on_commit(submit, robust=True)
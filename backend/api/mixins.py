@@ -0,0 +1,63 @@
+import hashlib
+
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+
+class ConditionalGetMixin:
+    """Условные GET-запросы для list и retrieve.
+
+    Вьюсет описывает состояние ответа в get_conditional_state() — это
+    должно быть дешевле, чем сам ответ. Если клиент прислал совпадающий
+    If-None-Match или If-Modified-Since, возвращается 304 без выборки
+    и сериализации данных.
+    """
+    # Заголовки запроса, от которых зависит тело ответа.
+    conditional_vary = ()
+
+    def get_conditional_state(self, request, *args, **kwargs):
+        """Возвращает пару (части ETag, время изменения) или None.
+
+        Время изменения можно не указывать (None), если по нему нельзя
+        однозначно судить о свежести ответа.
+        """
+        return None
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(
+            super().list, request, *args, **kwargs
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(
+            super().retrieve, request, *args, **kwargs
+        )
+
+    def conditional_response(self, respond, request, *args, **kwargs):
+        state = self.get_conditional_state(request, *args, **kwargs)
+        if state is None:
+            return respond(request, *args, **kwargs)
+        parts, last_modified = state
+        parts = (
+            self.__class__.__name__, self.action,
+            request.get_host(), request.META.get('QUERY_STRING', ''),
+            *parts,
+        )
+        etag = quote_etag(
+            hashlib.md5(repr(parts).encode()).hexdigest()
+        )
+        timestamp = (
+            int(last_modified.timestamp()) if last_modified else None
+        )
+        response = get_conditional_response(
+            request, etag=etag, last_modified=timestamp
+        )
+        if response is None:
+            response = respond(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response.headers['ETag'] = etag
+            if timestamp is not None:
+                response.headers['Last-Modified'] = http_date(timestamp)
+        if self.conditional_vary:
+            patch_vary_headers(response, self.conditional_vary)
+        return response
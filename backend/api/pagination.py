@@ -1,7 +1,167 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (
+    Cursor, CursorPagination, PageNumberPagination, _reverse_ordering
+)
+
+
+class KeysetCursorPagination(CursorPagination):
+    """Курсорная пагинация по всем полям ordering (последнее уникально).
+
+    CursorPagination из DRF кладёт в курсор только первое поле, а строки
+    с одинаковым значением пропускает через OFFSET. Здесь позиция —
+    значения всех полей, и страница выбирается условием «после позиции»
+    (f1 < v1 OR f1 = v1 AND f2 < v2 ...) без OFFSET.
+    """
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor.reverse
+        ordering = (
+            _reverse_ordering(self.ordering) if reverse else self.ordering
+        )
+        queryset = queryset.order_by(*ordering)
+        if self.cursor is not None:
+            try:
+                queryset = queryset.filter(
+                    self.get_after(ordering, self.cursor.position)
+                )
+            except (TypeError, ValueError, ValidationError):
+                raise NotFound(self.invalid_cursor_message)
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        has_more = len(results) > len(self.page)
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = self.cursor is not None
+        if (self.has_previous or self.has_next) and self.template:
+            self.display_page_controls = True
+        return self.page
+
+    def get_after(self, ordering, position):
+        """Условие «строка идёт после position в порядке ordering»."""
+        condition = Q()
+        equal = {}
+        for field, value in zip(ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
+
+    def get_position(self, instance):
+        return [
+            str(
+                instance[name] if isinstance(instance, dict)
+                else getattr(instance, name)
+            )
+            for name in (field.lstrip('-') for field in self.ordering)
+        ]
+
+    def get_link(self, item, reverse):
+        position = (
+            self.get_position(item) if item is not None
+            else self.cursor.position
+        )
+        return self.encode_cursor(
+            Cursor(offset=0, reverse=reverse, position=json.dumps(position))
+        )
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.get_link(self.page[-1] if self.page else None, False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        return self.get_link(self.page[0] if self.page else None, True)
+
+    def decode_cursor(self, request):
+        cursor = super().decode_cursor(request)
+        if cursor is None:
+            return None
+        try:
+            position = json.loads(cursor.position)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if (
+            not isinstance(position, list)
+            or len(position) != len(self.ordering)
+            or not all(isinstance(value, str) for value in position)
+        ):
+            raise NotFound(self.invalid_cursor_message)
+        return cursor._replace(position=position)
+
+
+class RecipeCursorPagination(KeysetCursorPagination):
+    """Курсорная пагинация ленты рецептов по (pub_date, id)."""
+    page_size = 6
+    page_size_query_param = 'limit'
+    ordering = ('-pub_date', '-id')
+
+
+class SubscriptionCursorPagination(KeysetCursorPagination):
+    """Курсорная пагинация пользователей по имени пользователя."""
+    page_size = 6
+    page_size_query_param = 'limit'
+    ordering = ('username',)
 
 
 class CustomPagination(PageNumberPagination):
-    """Кастомная пагинация с указанием количества объектов на странице."""
+    """Кастомная пагинация с указанием количества объектов на странице.
+
+    По умолчанию работает постранично (page/limit). Если задан
+    cursor_pagination_class, то с параметром ?pagination=cursor (или при
+    наличии ?cursor=) страница выбирается по ключу без OFFSET и COUNT(*).
+    """
     page_size = 6
     page_size_query_param = 'limit'
+    mode_query_param = 'pagination'
+    cursor_pagination_class = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_paginator = None
+        if self.use_cursor(request):
+            self.cursor_paginator = self.cursor_pagination_class()
+            return self.cursor_paginator.paginate_queryset(
+                queryset, request, view
+            )
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def use_cursor(self, request):
+        if self.cursor_pagination_class is None:
+            return False
+        params = request.query_params
+        return (
+            params.get(self.mode_query_param) == 'cursor'
+            or self.cursor_pagination_class.cursor_query_param in params
+        )
+
+
+class RecipePagination(CustomPagination):
+    """Пагинация рецептов с опциональным курсорным режимом."""
+    cursor_pagination_class = RecipeCursorPagination
+
+
+class UserPagination(CustomPagination):
+    """Пагинация пользователей и подписок с опциональным курсорным
+    режимом."""
+    cursor_pagination_class = SubscriptionCursorPagination
@@ -0,0 +1,92 @@
+"""Форматы выгрузки списка покупок (?format=txt|csv|json).
+
+Рендерер выбирается только по ?format= (FormatParamNegotiation), а
+строки отдаются по одной через stream() в StreamingHttpResponse, без
+сборки файла целиком.
+Строка списка — кортеж (название, единица измерения, количество).
+"""
+import csv
+import io
+import json
+
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import BaseRenderer
+
+
+class FormatParamNegotiation(DefaultContentNegotiation):
+    """Выбор рендерера только по ?format=, без заголовка Accept.
+
+    Без параметра — первый рендерер: клиенты, которые по привычке шлют
+    Accept: application/json, получают файл в формате по умолчанию.
+    Неизвестный формат — 404, как в DRF.
+    """
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        format_query = format_suffix or request.query_params.get(
+            self.settings.URL_FORMAT_OVERRIDE
+        )
+        if format_query:
+            renderers = self.filter_renderers(renderers, format_query)
+        return renderers[0], renderers[0].media_type
+
+
+class ShoppingListRenderer(BaseRenderer):
+    """Базовый рендерер списка покупок."""
+    charset = 'utf-8'
+
+    def stream(self, rows):
+        """Части файла для списка rows."""
+        raise NotImplementedError
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if not isinstance(data, list):
+            # Ошибки (например, 401) отдаются как JSON.
+            return json.dumps(data, ensure_ascii=False).encode()
+        return ''.join(self.stream(data)).encode()
+
+
+class ShoppingListTextRenderer(ShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, rows):
+        yield 'Список покупок:\n\n'
+        for number, (name, unit, amount) in enumerate(rows, 1):
+            yield f'{number}. {name} ({unit}) — {amount}\n'
+
+
+class ShoppingListCSVRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+    header = ('name', 'measurement_unit', 'amount')
+
+    def stream(self, rows):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in (self.header, *rows):
+            writer.writerow(row)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+
+class ShoppingListJSONRenderer(ShoppingListRenderer):
+    media_type = 'application/json'
+    format = 'json'
+
+    def stream(self, rows):
+        yield '['
+        for number, (name, unit, amount) in enumerate(rows):
+            item = json.dumps(
+                {'name': name, 'measurement_unit': unit, 'amount': amount},
+                ensure_ascii=False
+            )
+            yield f',{item}' if number else item
+        yield ']'
+
+
+SHOPPING_LIST_RENDERERS = (
+    ShoppingListTextRenderer,
+    ShoppingListCSVRenderer,
+    ShoppingListJSONRenderer,
+)
@@ -9,3 +9,105 @@
 #     RecipeCreateUpdateSerializer, RecipeMinifiedSerializer,
 #     TagSerializer, ShortLinkSerializer
 # )
+
+from rest_framework import serializers
+
+from api import images
+
+FIELDS_QUERY_PARAM = 'fields'
+OMIT_QUERY_PARAM = 'omit'
+
+
+def parse_field_names(request, param):
+    """Множество имён из параметра запроса через запятую или None."""
+    if request is None:
+        return None
+    value = getattr(request, 'query_params', request.GET).get(param)
+    if not value:
+        return None
+    return {name.strip() for name in value.split(',') if name.strip()}
+
+
+class SparseFieldsetMixin:
+    """Выбор полей ответа параметрами ?fields= и ?omit=.
+
+    Действует только на корневой сериализатор ответа (или на элементы
+    корневого списка) и только для безопасных методов: вложенные
+    сериализаторы и входные данные не меняются. Неизвестные имена
+    полей игнорируются, порядок полей остаётся прежним.
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+        self._is_sparse = False
+        if not self.is_response_root():
+            return fields
+        request = self.context.get('request')
+        selected = parse_field_names(request, FIELDS_QUERY_PARAM)
+        omitted = parse_field_names(request, OMIT_QUERY_PARAM) or set()
+        kept = {
+            name: field for name, field in fields.items()
+            if (selected is None or name in selected)
+            and name not in omitted
+        }
+        self._is_sparse = len(kept) < len(fields)
+        return kept
+
+    def is_response_root(self):
+        request = self.context.get('request')
+        if request is None or request.method not in ('GET', 'HEAD'):
+            return False
+        parent = self.parent
+        if isinstance(parent, serializers.ListSerializer):
+            parent = parent.parent
+        return parent is None
+
+    def get_sparse_fieldset(self):
+        """Кортеж полей ответа, если часть полей исключена, иначе None.
+
+        По нему вьюсеты и сериализаторы пропускают загрузку данных для
+        исключённых полей.
+        """
+        fields = tuple(self.fields)
+        return fields if self._is_sparse else None
+
+
+class ImageRenditionsField(serializers.ReadOnlyField):
+    """Ссылки на уменьшенные версии изображения image_field (api.images).
+
+    Пока версии не построены, все ссылки ведут на оригинал.
+    """
+
+    def __init__(self, image_field, **kwargs):
+        self.image_field = image_field
+        kwargs['source'] = '*'
+        super().__init__(**kwargs)
+
+    def to_representation(self, instance):
+        request = self.context.get('request')
+        return images.rendition_urls(
+            getattr(instance, self.image_field),
+            getattr(instance, images.renditions_field(self.image_field)),
+            request.build_absolute_uri if request else str,
+        )
+
+
+class StreamingBase64ImageField(serializers.ImageField):
+    """Изображение в base64, декодируемое кусками во временный файл.
+
+    Замена Base64ImageField: не держит в памяти декодированную копию
+    файла, проверяет размер по заголовку и уменьшает слишком большие
+    изображения (api.images.ingest_base64). В ответе — ссылка на файл.
+    """
+
+    def to_internal_value(self, data):
+        if data in ('', None):
+            return None
+        if not isinstance(data, str):
+            raise serializers.ValidationError(
+                'Ожидается изображение в виде строки base64.'
+            )
+        try:
+            return images.ingest_base64(data)
+        except images.ImageUploadError as error:
+            raise serializers.ValidationError(str(error))
@@ -0,0 +1,47 @@
+"""Хранилище медиафайлов с именами по содержимому.
+
+Файл сохраняется под именем <каталог upload_to>/<sha256>.<расширение>,
+поэтому одинаковые файлы записываются один раз, а имя никогда не
+указывает на другое содержимое (nginx отдаёт /media/ с долгим кэшем).
+
+Один файл может принадлежать нескольким записям, поэтому delete() файлы
+не удаляет: это делает команда collect_media, которая стирает файлы, на
+которые больше не ссылаются Recipe.image, User.avatar и их версии.
+"""
+import hashlib
+import os
+
+from django.core.files.storage import FileSystemStorage
+
+# Длина хэша в имени файла (шестнадцатеричных символов).
+HASH_LENGTH = 32
+
+
+def content_hash(content):
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()[:HASH_LENGTH]
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """FileSystemStorage с дедупликацией по хэшу содержимого."""
+
+    def _save(self, name, content):
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        name = os.path.join(directory, content_hash(content) + extension)
+        if self.exists(name):
+            # Обновляем время изменения, чтобы collect_media не удалил
+            # файл-сироту, на который сейчас снова сошлётся запись.
+            os.utime(self.path(name))
+            return name
+        return super()._save(name, content)
+
+    def delete(self, name):
+        """Ничего не делает: файл может быть нужен другим записям."""
+
+    def purge(self, name):
+        """Удаляет файл с диска (для collect_media)."""
+        super().delete(name)
@@ -0,0 +1,349 @@
+import base64
+import binascii
+import io
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from PIL import Image
+from rest_framework import serializers
+from rest_framework.test import APIClient
+
+from api import images
+from api.db import delete_returning, insert_ignore, insert_ignore_many
+from api.serializers.base import StreamingBase64ImageField
+from recipes import counters
+from recipes.models import Favorite, Recipe, ShoppingCart
+from users.models import Subscription, User
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def encode_image(size, image_format='PNG', header=True):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, 'teal').save(buffer, image_format)
+    encoded = base64.b64encode(buffer.getvalue()).decode()
+    if header:
+        return f'data:{Image.MIME[image_format]};base64,{encoded}'
+    return encoded
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, IMAGE_RENDITIONS_ASYNC=False)
+class StreamingImageFieldTests(TestCase):
+    """Приём изображений в base64 через временный файл."""
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def ingest(self, data):
+        file = StreamingBase64ImageField().to_internal_value(data)
+        self.addCleanup(file.close)
+        return file
+
+    def test_chunked_decoding(self):
+        raw = bytes(range(256)) * 50
+        encoded = base64.b64encode(raw).decode()
+        wrapped = '\n'.join(
+            encoded[i:i + 76] for i in range(0, len(encoded), 76)
+        )
+        for data in (encoded, wrapped, f'data:x/y;base64,{wrapped}'):
+            file = io.BytesIO()
+            size = images.decode_base64_to_file(data, file, chunk_size=100)
+            self.assertEqual(size, len(raw))
+            self.assertEqual(file.getvalue(), raw)
+        with self.assertRaises(images.ImageUploadError):
+            images.decode_base64_to_file(encoded[:-1], io.BytesIO())
+        with self.assertRaises(images.ImageUploadError):
+            images.decode_base64_to_file('абвг', io.BytesIO())
+
+    def test_valid_image_kept_as_is(self):
+        data = encode_image((40, 20), 'JPEG', header=False)
+        file = self.ingest(data)
+        self.assertTrue(file.name.endswith('.jpg'))
+        self.assertEqual(file.content_type, 'image/jpeg')
+        self.assertEqual(file.read(), binascii.a2b_base64(data))
+
+    @override_settings(IMAGE_MAX_SIDE=100)
+    def test_oversized_image_downscaled(self):
+        file = self.ingest(encode_image((400, 200)))
+        with Image.open(file.temporary_file_path()) as image:
+            self.assertEqual(image.format, 'PNG')
+            self.assertEqual(image.size, (100, 50))
+
+    @override_settings(IMAGE_MAX_PIXELS=10_000)
+    def test_too_many_pixels_rejected(self):
+        with self.assertRaisesMessage(
+            serializers.ValidationError, '200×200'
+        ):
+            self.ingest(encode_image((200, 200)))
+
+    def test_invalid_data_rejected(self):
+        for data in ('не base64', base64.b64encode(b'text').decode(), 5):
+            with self.assertRaises(serializers.ValidationError):
+                self.ingest(data)
+
+    def test_avatar_upload(self):
+        user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pass'
+        )
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.put(
+            '/api/users/me/avatar/',
+            {'avatar': encode_image((30, 30))}, format='json'
+        )
+        self.assertEqual(response.status_code, 200, response.data)
+        user.refresh_from_db()
+        self.assertTrue(user.avatar.name.endswith('.png'))
+        with Image.open(user.avatar.path) as image:
+            self.assertEqual(image.size, (30, 30))
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, IMAGE_RENDITIONS_ASYNC=False)
+class ContentAddressedStorageTests(TestCase):
+    """Имена файлов по содержимому и удаление файлов без ссылок."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='author', email='author@example.com', password='pass'
+        )
+
+    def setUp(self):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def create_recipe(self, content):
+        recipe = Recipe(
+            author=self.user, name='Рецепт', text='Текст', cooking_time=5
+        )
+        recipe.image.save('image.PNG', ContentFile(content), save=False)
+        recipe.save()
+        return recipe
+
+    def test_identical_files_stored_once(self):
+        first = self.create_recipe(b'same')
+        second = self.create_recipe(b'same')
+        third = self.create_recipe(b'other')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertNotEqual(first.image.name, third.image.name)
+        self.assertRegex(
+            first.image.name, r'^recipes/images/[0-9a-f]{32}\.png$'
+        )
+        self.assertEqual(
+            len(default_storage.listdir('recipes/images')[1]), 2
+        )
+
+    def test_delete_keeps_shared_file(self):
+        first = self.create_recipe(b'same')
+        second = self.create_recipe(b'same')
+        first.image.delete(save=True)
+        self.assertTrue(default_storage.exists(second.image.name))
+
+    def age(self, name):
+        os.utime(default_storage.path(name), (0, 0))
+
+    def test_collect_media(self):
+        kept = self.create_recipe(b'kept')
+        replaced = self.create_recipe(b'old')
+        old_name = replaced.image.name
+        renditions = {
+            'source': kept.image.name,
+            **{
+                name: default_storage.save(
+                    f'recipes/images/renditions/{name}.webp',
+                    ContentFile(name.encode())
+                )
+                for name in images.RENDITIONS
+            }
+        }
+        Recipe.objects.filter(pk=kept.pk).update(image_renditions=renditions)
+        replaced.image.save('new.png', ContentFile(b'new'))
+        fresh = default_storage.save('users/fresh.png', ContentFile(b'x'))
+        for name in (old_name, kept.image.name, *renditions.values()):
+            self.age(name)
+        out = io.StringIO()
+        call_command('collect_media', '--dry-run', stdout=out)
+        self.assertIn(old_name, out.getvalue())
+        self.assertTrue(default_storage.exists(old_name))
+        call_command('collect_media', stdout=io.StringIO())
+        self.assertFalse(default_storage.exists(old_name))
+        for name in (kept.image.name, replaced.image.name, fresh,
+                     *renditions.values()):
+            self.assertTrue(default_storage.exists(name), name)
+
+
+class InsertIgnoreTests(TestCase):
+    """Вставка без ошибки на уникальном ограничении."""
+
+    def test_returns_id_once(self):
+        user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pass'
+        )
+        author = User.objects.create_user(
+            username='author', email='author@example.com', password='pass'
+        )
+        pk = insert_ignore(Subscription, user=user, author=author)
+        self.assertEqual(Subscription.objects.get().pk, pk)
+        self.assertIsNone(
+            insert_ignore(Subscription, user=user, author=author)
+        )
+        self.assertEqual(Subscription.objects.count(), 1)
+
+    def test_many_returns_inserted_only(self):
+        user, *authors = (
+            User.objects.create_user(
+                username=name, email=f'{name}@example.com', password='pass'
+            )
+            for name in ('reader', 'first', 'second')
+        )
+        Subscription.objects.create(user=user, author=authors[0])
+        self.assertEqual(
+            insert_ignore_many(
+                Subscription,
+                [{'user': user, 'author': author} for author in authors],
+                returning='author_id'
+            ),
+            [authors[1].pk]
+        )
+        self.assertEqual(insert_ignore_many(Subscription, []), [])
+        self.assertEqual(Subscription.objects.count(), 2)
+
+
+class DeleteReturningTests(TestCase):
+    """Удаление, возвращающее удалённые строки."""
+
+    def test_returns_deleted_rows_once(self):
+        user, *authors = (
+            User.objects.create_user(
+                username=name, email=f'{name}@example.com', password='pass'
+            )
+            for name in ('reader', 'first', 'second', 'third')
+        )
+        for author in authors:
+            Subscription.objects.create(user=user, author=author)
+        ids = [author.pk for author in authors[:2]]
+        self.assertCountEqual(
+            delete_returning(
+                Subscription, returning='author_id', user=user,
+                author_id__in=[*ids, 0]
+            ),
+            ids
+        )
+        self.assertEqual(
+            delete_returning(Subscription, user=user, author_id__in=ids), []
+        )
+        self.assertEqual(delete_returning(Subscription, author_id__in=[]), [])
+        pk = Subscription.objects.get().pk
+        self.assertEqual(delete_returning(Subscription, pk__in={pk}), [pk])
+        Subscription.objects.create(user=user, author=authors[2])
+        self.assertEqual(
+            list(Subscription.objects.values_list('author_id', flat=True)),
+            [authors[2].pk]
+        )
+
+
+@unittest.skipUnless(
+    connection.vendor == 'postgresql', 'нужен PostgreSQL'
+)
+@override_settings(IMAGE_RENDITIONS_ASYNC=False)
+class ConcurrentToggleTests(TransactionTestCase):
+    """Параллельные одинаковые запросы не падают на уникальных
+    ограничениях избранного, списка покупок и подписок."""
+    THREADS = 8
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pass'
+        )
+        self.author = User.objects.create_user(
+            username='author', email='author@example.com', password='pass'
+        )
+        self.recipe = Recipe.objects.create(
+            author=self.author, name='Рецепт', text='Текст', cooking_time=5,
+            image='recipes/images/image.png',
+        )
+
+    def fire(self, method, url, data=None):
+        """Ответы на THREADS одновременных запросов (или имена
+        исключений)."""
+        barrier = threading.Barrier(self.THREADS)
+        results = []
+
+        def request():
+            client = APIClient()
+            client.force_authenticate(self.user)
+            barrier.wait()
+            try:
+                results.append(
+                    getattr(client, method)(url, data, format='json')
+                )
+            except Exception as error:
+                results.append(type(error).__name__)
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=request) for _ in range(self.THREADS)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def statuses(self, method, url):
+        return sorted(
+            (
+                getattr(result, 'status_code', result)
+                for result in self.fire(method, url)
+            ),
+            key=str
+        )
+
+    def assertToggles(self, url, model, **lookup):
+        losers = [400] * (self.THREADS - 1)
+        self.assertEqual(self.statuses('post', url), [201, *losers])
+        self.assertEqual(model.objects.filter(**lookup).count(), 1)
+        self.assertEqual(self.statuses('delete', url), [204, *losers])
+        self.assertFalse(model.objects.filter(**lookup).exists())
+
+    def test_favorite(self):
+        self.assertToggles(
+            f'/api/recipes/{self.recipe.id}/favorite/', Favorite,
+            user=self.user, recipe=self.recipe
+        )
+
+    def test_shopping_cart(self):
+        self.assertToggles(
+            f'/api/recipes/{self.recipe.id}/shopping_cart/', ShoppingCart,
+            user=self.user, recipe=self.recipe
+        )
+
+    def test_subscribe(self):
+        self.assertToggles(
+            f'/api/users/{self.author.id}/subscribe/', Subscription,
+            user=self.user, author=self.author
+        )
+
+    def test_batch_counts_each_recipe_once(self):
+        data = {'recipes': [self.recipe.id]}
+        for method, done in (('post', 'added'), ('delete', 'removed')):
+            statuses = [
+                item['status']
+                for response in self.fire(
+                    method, '/api/recipes/favorite/', data
+                )
+                for item in response.data['results']
+            ]
+            self.assertEqual(statuses.count(done), 1, statuses)
+            counters.flush()
+            self.assertEqual(counters.find_mismatches(), [])
@@ -3,5 +3,7 @@
 python manage.py migrate
 python manage.py collectstatic --no-input
 python manage.py import_ingredients
+python manage.py build_catalog_snapshots
+python manage.py build_image_renditions
 
 exec "$@"
\ No newline at end of file
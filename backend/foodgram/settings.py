@@ -91,6 +91,50 @@ else:
         }
     }
 
+# Cache
+# Версии записей кэша рецептов и отметки, из которых строятся ETag
+# списка рецептов, сбрасываются сигналами в процессе, изменившем данные.
+# При нескольких процессах gunicorn нужен общий бэкенд
+# (CACHE_BACKEND/CACHE_LOCATION), например Redis или memcached.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'foodgram'),
+    }
+}
+
+RECIPE_CACHE_ENABLED = os.getenv('RECIPE_CACHE_ENABLED', 'True') == 'True'
+RECIPE_CACHE_TIMEOUT = int(os.getenv('RECIPE_CACHE_TIMEOUT', 60 * 60))
+RECIPE_FAST_SERIALIZER = (
+    os.getenv('RECIPE_FAST_SERIALIZER', 'True') == 'True'
+)
+RECIPE_SQL_JSON = os.getenv('RECIPE_SQL_JSON', 'False') == 'True'
+# Не чаще чем раз в столько секунд приращения счётчиков переносятся
+# в строки рецептов и пользователей (0 — после каждой транзакции).
+COUNTER_FLUSH_INTERVAL = int(os.getenv('COUNTER_FLUSH_INTERVAL', 10))
+# Наибольшее число результатов /api/ingredients/?search=.
+INGREDIENT_SEARCH_LIMIT = int(os.getenv('INGREDIENT_SEARCH_LIMIT', 20))
+# Не чаще чем раз в столько секунд индекс ингредиентов в памяти
+# сверяется с базой (изменения из других процессов).
+INGREDIENT_INDEX_CHECK_INTERVAL = int(
+    os.getenv('INGREDIENT_INDEX_CHECK_INTERVAL', 60)
+)
+# Каталог для файлов-снимков справочников, которые отдаёт nginx
+# (см. recipes.catalog_snapshots). Пусто — файлы не пишутся.
+CATALOG_SNAPSHOT_ROOT = os.getenv('CATALOG_SNAPSHOT_ROOT')
+# Строить уменьшенные версии изображений в фоновом потоке (api.images);
+# False — сразу после фиксации транзакции в том же потоке.
+IMAGE_RENDITIONS_ASYNC = (
+    os.getenv('IMAGE_RENDITIONS_ASYNC', 'True') == 'True'
+)
+# Загружаемые изображения: больше IMAGE_MAX_PIXELS пикселей
+# отклоняются, больше IMAGE_MAX_SIDE по большей стороне — уменьшаются.
+IMAGE_MAX_PIXELS = int(os.getenv('IMAGE_MAX_PIXELS', 40_000_000))
+IMAGE_MAX_SIDE = int(os.getenv('IMAGE_MAX_SIDE', 2560))
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -129,6 +173,17 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Медиафайлы именуются по хэшу содержимого (api.storage); файлы без
+# ссылок удаляет команда collect_media.
+STORAGES = {
+    'default': {
+        'BACKEND': 'api.storage.ContentAddressedStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -1,6 +1,5 @@
 from django.contrib import admin
 from django.contrib.auth.models import Group
-from django.db.models import Count
 
 from recipes.models import (
     Ingredient, Recipe, RecipeIngredient, Tag, Favorite, ShoppingCart
@@ -17,20 +16,14 @@ class RecipeIngredientInline(admin.TabularInline):
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
     """Админка для рецептов."""
-    list_display = ('id', 'name', 'author', 'favorites_count')
+    list_display = (
+        'id', 'name', 'author', 'favorites_count', 'in_carts_count'
+    )
     list_filter = ('author', 'name', 'tags')
     search_fields = ('name', 'author__username', 'author__email')
+    readonly_fields = ('favorites_count', 'in_carts_count')
     inlines = (RecipeIngredientInline,)
 
-    def get_queryset(self, request):
-        queryset = super().get_queryset(request)
-        return queryset.annotate(favorites_count=Count('favorited_by'))
-
-    def favorites_count(self, obj):
-        return obj.favorites_count
-
-    favorites_count.short_description = 'Количество добавлений в избранное'
-
 
 @admin.register(Ingredient)
 class IngredientAdmin(admin.ModelAdmin):
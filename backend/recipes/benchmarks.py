@@ -0,0 +1,102 @@
+"""Общие помощники для команд-бенчмарков (bench_*).
+
+Бенчмарки создают синтетические данные внутри транзакции и откатывают
+её в конце, поэтому их можно запускать на рабочей копии базы.
+"""
+import contextlib
+import random
+import time
+
+from django.contrib.auth.models import AnonymousUser
+from django.db import transaction
+from django.test import RequestFactory
+from rest_framework.request import Request
+
+from recipes import counters
+from recipes.models import (
+    CounterDelta, Ingredient, Recipe, RecipeIngredient, Tag
+)
+from users.models import User
+
+
+class Rollback(Exception):
+    """Прерывает транзакцию бенчмарка."""
+
+
+@contextlib.contextmanager
+def rolled_back():
+    """Выполняет блок в транзакции, которая всегда откатывается."""
+    try:
+        with transaction.atomic():
+            yield
+            raise Rollback
+    except Rollback:
+        pass
+
+
+def create_dataset(recipes=500, authors=20, tags=8, ingredients=200,
+                   per_recipe=8, seed=0):
+    """Создаёт авторов, теги, ингредиенты и рецепты пакетными запросами.
+
+    Возвращает список авторов.
+    """
+    rnd = random.Random(seed)
+    prefix = f'bench{rnd.randrange(10 ** 9)}'
+    author_objs = User.objects.bulk_create(
+        User(
+            username=f'{prefix}_{i}', email=f'{prefix}_{i}@example.com',
+            first_name='Автор', last_name=str(i),
+            avatar=f'users/{prefix}_{i}.png' if i % 2 else None,
+        )
+        for i in range(authors)
+    )
+    tag_objs = Tag.objects.bulk_create(
+        Tag(name=f'{prefix} {i}', color=f'#{i:06X}'[:7],
+            slug=f'{prefix}-{i}')
+        for i in range(tags)
+    )
+    ingredient_objs = Ingredient.objects.bulk_create(
+        Ingredient(name=f'{prefix} ингредиент {i}', measurement_unit='г')
+        for i in range(ingredients)
+    )
+    recipe_objs = Recipe.objects.bulk_create(
+        Recipe(
+            author=rnd.choice(author_objs), name=f'Рецепт {i}',
+            text='Описание рецепта. ' * 20, cooking_time=rnd.randint(1, 120),
+            image=f'recipes/images/{prefix}_{i}.png',
+        )
+        for i in range(recipes)
+    )
+    # bulk_create не отправляет сигналы, счётчик обновляется явно.
+    counters.add(
+        CounterDelta.USER_RECIPES, [recipe.author_id for recipe in recipe_objs]
+    )
+    Recipe.tags.through.objects.bulk_create(
+        Recipe.tags.through(recipe_id=recipe.id, tag_id=tag.id)
+        for recipe in recipe_objs
+        for tag in rnd.sample(tag_objs, k=rnd.randint(1, min(3, tags)))
+    )
+    RecipeIngredient.objects.bulk_create(
+        RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                         amount=rnd.randint(1, 500))
+        for recipe in recipe_objs
+        for ingredient in rnd.sample(ingredient_objs, k=per_recipe)
+    )
+    return author_objs
+
+
+def make_request(path='/api/recipes/', user=None):
+    """GET-запрос DRF для контекста сериализаторов."""
+    request = Request(RequestFactory().get(path, HTTP_HOST='localhost'))
+    request.user = user or AnonymousUser()
+    return request
+
+
+def measure(func, repeat=5):
+    """Лучшее время выполнения func() из repeat попыток, в секундах."""
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best
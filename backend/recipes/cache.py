@@ -0,0 +1,214 @@
+"""Кэш пользователь-независимой части представления рецептов.
+
+Запись кэша адресуется id рецепта и его версией. Версия — случайный
+токен, который сигналы из recipes.signals удаляют после фиксации
+транзакции: следующий запрос получает новый токен, а старые записи
+больше не читаются и со временем вытесняются самим кэшем.
+
+Вместе с версиями сбрасывается отметка списка рецептов (RECIPES_STAMP),
+а изменение избранного, корзины и подписок пользователя сбрасывает его
+отметку (touch_user_state). Из этих отметок строятся ETag и
+Last-Modified списка рецептов без запросов к базе.
+"""
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from recipes.models import Tag
+
+VERSION_KEY = 'recipe:version:{}'
+DATA_KEY = 'recipe:repr:{}:{}:{}:{}'
+HITS_KEY = 'recipe:repr:hits'
+MISSES_KEY = 'recipe:repr:misses'
+CATALOG_KEY = 'catalog:stamp:{}'
+TAG_IDS_KEY = 'catalog:tags:ids:{}'
+# Отметки (см. get_catalog_stamp) списка рецептов и состояния
+# пользователя.
+RECIPES_STAMP = 'recipes'
+USER_STATE_STAMP = 'user-state:{}'
+
+
+def is_enabled():
+    return getattr(settings, 'RECIPE_CACHE_ENABLED', True)
+
+
+def get_namespace(request):
+    """Часть ключа, зависящая от адреса сайта.
+
+    Ссылки на изображения в представлении абсолютные, поэтому записи
+    для разных хостов хранятся раздельно.
+    """
+    if request is None:
+        return ''
+    base_url = request.build_absolute_uri('/')
+    return hashlib.md5(base_url.encode()).hexdigest()[:12]
+
+
+def invalidate(recipe_ids):
+    """Сбрасывает версии рецептов и отметку списка рецептов после
+    фиксации текущей транзакции."""
+    keys = [VERSION_KEY.format(pk) for pk in set(recipe_ids)]
+    if keys:
+        keys.append(CATALOG_KEY.format(RECIPES_STAMP))
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def touch_user_state(user_ids):
+    """Сбрасывает отметки избранного, корзины и подписок пользователей
+    после фиксации текущей транзакции."""
+    keys = [
+        CATALOG_KEY.format(USER_STATE_STAMP.format(pk))
+        for pk in set(user_ids)
+    ]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def get_user_state(user):
+    """Токен отметки избранного, корзины и подписок пользователя."""
+    if not user.is_authenticated:
+        return None
+    token, _ = get_catalog_stamp(USER_STATE_STAMP.format(user.pk))
+    return token
+
+
+def _get_versions(recipe_ids):
+    version_keys = {pk: VERSION_KEY.format(pk) for pk in recipe_ids}
+    stored = cache.get_many(version_keys.values())
+    versions = {}
+    new_versions = {}
+    for pk, key in version_keys.items():
+        if key in stored:
+            versions[pk] = stored[key]
+        else:
+            versions[pk] = new_versions[key] = uuid.uuid4().hex
+    if new_versions:
+        cache.set_many(new_versions, timeout=None)
+    return versions
+
+
+def get_many(recipes, build, namespace=''):
+    """Возвращает общие представления рецептов в порядке recipes.
+
+    build(missing) вызывается один раз со списком рецептов, которых нет
+    в кэше, и должен вернуть их представления в том же порядке.
+    """
+    versions = _get_versions({recipe.pk for recipe in recipes})
+    # updated_at в ключе не даёт запросу, прочитавшему строку до
+    # фиксации чужой транзакции, записать устаревшие данные под новой
+    # версией.
+    data_keys = [
+        DATA_KEY.format(
+            recipe.pk, versions[recipe.pk],
+            recipe.updated_at.timestamp(), namespace
+        )
+        for recipe in recipes
+    ]
+    cached = cache.get_many(data_keys)
+    missing = [
+        (key, recipe) for key, recipe in zip(data_keys, recipes)
+        if key not in cached
+    ]
+    if missing:
+        built = build([recipe for _, recipe in missing])
+        fresh = {key: data for (key, _), data in zip(missing, built)}
+        cache.set_many(
+            fresh, timeout=getattr(settings, 'RECIPE_CACHE_TIMEOUT', 3600)
+        )
+        cached.update(fresh)
+    _count(HITS_KEY, len(recipes) - len(missing))
+    _count(MISSES_KEY, len(missing))
+    return [cached[key] for key in data_keys]
+
+
+def _count(key, value):
+    if not value:
+        return
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key, value)
+    except ValueError:
+        cache.set(key, value, timeout=None)
+
+
+def get_stats():
+    """Счётчики попаданий и промахов кэша с момента последнего сброса."""
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': hits / total if total else 0.0,
+    }
+
+
+def reset_stats():
+    cache.delete_many([HITS_KEY, MISSES_KEY])
+
+
+def get_catalog_stamp(name):
+    """Отметка изменения справочника (тегов, ингредиентов), списка
+    рецептов или состояния пользователя.
+
+    Возвращает пару (токен, время изменения). После очистки кэша
+    отметка создаётся заново с текущим временем.
+    """
+    key = CATALOG_KEY.format(name)
+    stamp = cache.get(key)
+    if stamp is None:
+        stamp = (uuid.uuid4().hex, timezone.now())
+        if not cache.add(key, stamp, timeout=None):
+            stamp = cache.get(key, stamp)
+    return stamp
+
+
+def touch_catalog(name):
+    """Сбрасывает отметку справочника после фиксации транзакции."""
+    key = CATALOG_KEY.format(name)
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+def reset_catalog(name):
+    """Сбрасывает отметку справочника сразу, например когда изменение
+    уже зафиксировано другим процессом."""
+    cache.delete(CATALOG_KEY.format(name))
+
+
+def get_tag_ids(slugs=(), ids=()):
+    """Словарь слаг -> id для всех тегов.
+
+    Хранится в кэше под текущей отметкой справочника тегов, поэтому
+    после изменения тегов перечитывается из базы. Отметку, сброшенную
+    в кэше другого процесса, здесь не видно: если каких-то из slugs или
+    ids в словаре нет, они ищутся в базе одним запросом, и найденные
+    теги добавляются в словарь.
+    """
+    token, _ = get_catalog_stamp('tags')
+    key = TAG_IDS_KEY.format(token)
+    tag_ids = cache.get(key)
+    if tag_ids is None:
+        tag_ids = dict(Tag.objects.values_list('slug', 'id'))
+    else:
+        missing_slugs = set(slugs) - tag_ids.keys()
+        missing_ids = set(ids) - set(tag_ids.values())
+        if not missing_slugs and not missing_ids:
+            return tag_ids
+        found = dict(
+            Tag.objects.filter(
+                Q(slug__in=missing_slugs) | Q(id__in=missing_ids)
+            ).values_list('slug', 'id')
+        )
+        if not found:
+            return tag_ids
+        tag_ids = {**tag_ids, **found}
+    cache.set(
+        key, tag_ids,
+        timeout=getattr(settings, 'RECIPE_CACHE_TIMEOUT', 3600)
+    )
+    return tag_ids
@@ -0,0 +1,102 @@
+"""Готовые снимки справочников ингредиентов и тегов.
+
+Полный список без фильтров (/api/ingredients/, /api/tags/) меняется
+редко, поэтому отдаётся заранее отрендеренным JSON и его gzip-версией,
+без сериализации в DRF. Снимок строится один раз на отметку справочника
+(recipes.cache.get_catalog_stamp), хранится в общем кэше и в памяти
+процесса; ETag — хэш содержимого, одинаковый во всех процессах.
+
+Если задан CATALOG_SNAPSHOT_ROOT, снимки после каждого изменения
+справочника записываются туда файлами <name>.json и <name>.json.gz,
+которые nginx отдаёт сам (infra/nginx.conf). Команда
+build_catalog_snapshots записывает их при запуске контейнера.
+"""
+import collections
+import gzip
+import hashlib
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from recipes import cache as recipe_cache
+from recipes import ingredient_index
+from recipes.models import Tag
+from recipes.serializers.recipe_serializers import TagSerializer
+
+CATALOGS = ('ingredients', 'tags')
+SNAPSHOT_KEY = 'catalog:snapshot:{}:{}'
+
+Snapshot = collections.namedtuple('Snapshot', 'token body gzipped etag')
+
+_snapshots = {}
+
+
+def render(name):
+    """JSON полного справочника в том же виде, что и ответ DRF."""
+    if name == 'ingredients':
+        data = ingredient_index.search()
+    else:
+        data = TagSerializer(Tag.objects.all(), many=True).data
+    return JSONRenderer().render(data)
+
+
+def build(name, token):
+    body = render(name)
+    return Snapshot(
+        token=token,
+        body=body,
+        gzipped=gzip.compress(body, compresslevel=9, mtime=0),
+        etag=hashlib.sha256(body).hexdigest()[:32],
+    )
+
+
+def get_snapshot(name):
+    """Актуальный снимок справочника name."""
+    token, _ = recipe_cache.get_catalog_stamp(name)
+    snapshot = _snapshots.get(name)
+    if snapshot is not None and snapshot.token == token:
+        return snapshot
+    key = SNAPSHOT_KEY.format(name, token)
+    snapshot = cache.get(key)
+    if snapshot is None:
+        snapshot = build(name, token)
+        cache.set(
+            key, snapshot,
+            timeout=getattr(settings, 'RECIPE_CACHE_TIMEOUT', 3600)
+        )
+    _snapshots[name] = snapshot
+    return snapshot
+
+
+def _write(path, content):
+    directory = os.path.dirname(path)
+    with tempfile.NamedTemporaryFile(dir=directory, delete=False) as file:
+        file.write(content)
+    os.chmod(file.name, 0o644)
+    os.replace(file.name, path)
+
+
+def write_files(name, root=None):
+    """Записывает снимок в root (по умолчанию CATALOG_SNAPSHOT_ROOT).
+
+    Файлы заменяются атомарно, gzip-версия — первой, чтобы nginx не
+    отдал её старой при новом JSON. Возвращает путь к JSON.
+    """
+    root = root or settings.CATALOG_SNAPSHOT_ROOT
+    os.makedirs(root, exist_ok=True)
+    snapshot = get_snapshot(name)
+    path = os.path.join(root, f'{name}.json')
+    _write(f'{path}.gz', snapshot.gzipped)
+    _write(path, snapshot.body)
+    return path
+
+
+def refresh_files(name):
+    """Перезаписывает файлы снимка после фиксации транзакции, если
+    задан CATALOG_SNAPSHOT_ROOT."""
+    if getattr(settings, 'CATALOG_SNAPSHOT_ROOT', None):
+        transaction.on_commit(lambda: write_files(name), robust=True)
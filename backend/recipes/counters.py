@@ -0,0 +1,161 @@
+"""Денормализованные счётчики популярности.
+
+Recipe.favorites_count, Recipe.in_carts_count и User.recipes_count не
+обновляются на месте при каждом добавлении: изменение записывается
+отдельной строкой в CounterDelta (только INSERT, без блокировки строки
+рецепта), а flush() периодически суммирует приращения и переносит их
+в строки одним UPDATE на группу объектов.
+
+Перенос запускается после фиксации транзакции не чаще раза в
+COUNTER_FLUSH_INTERVAL секунд; приращения, записанные позже в том же
+интервале, переносит периодический flush_counters --every (сервис
+counters в infra/docker-compose.yml). rebuild_counters пересчитывает
+счётчики по исходным таблицам. Счётчик не опускается ниже нуля, чтобы
+ошибочное отрицательное приращение не останавливало перенос остальных.
+Сигналы в recipes.signals покрывают сохранение и удаление через ORM;
+bulk_create и сырой SQL должны вызывать add() сами.
+
+Между переносами счётчики отстают, поэтому они годятся для админки и
+сортировки по популярности, но не для ответов API: там число считается
+точно (count_of).
+"""
+import collections
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models.functions import Coalesce, Greatest
+
+from api.db import lock_table
+from recipes.models import CounterDelta, Favorite, Recipe, ShoppingCart
+from users.models import User
+
+FLUSH_KEY = 'counters:flush'
+FLUSH_BATCH_SIZE = 500
+
+
+def get_counters():
+    """Счётчик -> (модель, поле, исходная модель, поле связи в ней)."""
+    return {
+        CounterDelta.RECIPE_FAVORITES: (
+            Recipe, 'favorites_count', Favorite, 'recipe'
+        ),
+        CounterDelta.RECIPE_IN_CARTS: (
+            Recipe, 'in_carts_count', ShoppingCart, 'recipe'
+        ),
+        CounterDelta.USER_RECIPES: (
+            User, 'recipes_count', Recipe, 'author'
+        ),
+    }
+
+
+def add(counter, object_ids, delta=1):
+    """Записывает приращение счётчика для каждого из object_ids."""
+    object_ids = list(object_ids)
+    if not object_ids:
+        return
+    CounterDelta.objects.bulk_create(
+        CounterDelta(counter=counter, object_id=object_id, delta=delta)
+        for object_id in object_ids
+    )
+    # Ошибка переноса не должна превращать уже зафиксированный запрос
+    # в ошибку: приращения останутся до следующего переноса.
+    transaction.on_commit(flush_if_due, robust=True)
+
+
+def flush_if_due():
+    """Переносит приращения, если с прошлого переноса прошло
+    COUNTER_FLUSH_INTERVAL секунд."""
+    interval = getattr(settings, 'COUNTER_FLUSH_INTERVAL', 10)
+    if interval and not cache.add(FLUSH_KEY, True, timeout=interval):
+        return
+    flush()
+
+
+def flush(batch_size=FLUSH_BATCH_SIZE):
+    """Переносит все накопленные приращения в счётчики.
+
+    Каждая пачка обрабатывается в своей транзакции: строки приращений
+    блокируются, суммируются, применяются и удаляются. Параллельный
+    перенос ждёт блокировки и не применит их повторно. Возвращает число
+    обработанных приращений.
+    """
+    processed = 0
+    while True:
+        with transaction.atomic():
+            rows = list(
+                CounterDelta.objects.select_for_update().order_by('id')
+                .values_list('id', 'counter', 'object_id', 'delta')
+                [:batch_size]
+            )
+            _apply(rows)
+            CounterDelta.objects.filter(
+                id__in=[row[0] for row in rows]
+            ).delete()
+        processed += len(rows)
+        if len(rows) < batch_size:
+            return processed
+
+
+def _apply(rows):
+    totals = collections.Counter()
+    for _, counter, object_id, delta in rows:
+        totals[counter, object_id] += delta
+    groups = collections.defaultdict(list)
+    for (counter, object_id), delta in totals.items():
+        if delta:
+            groups[counter, delta].append(object_id)
+    counters = get_counters()
+    for (counter, delta), object_ids in groups.items():
+        model, field, _, _ = counters[counter]
+        value = models.F(field) + delta
+        if delta < 0:
+            value = Greatest(value, 0)
+        model.objects.filter(pk__in=object_ids).update(**{field: value})
+
+
+def count_of(source, field):
+    """Выражение с фактическим значением счётчика для строки модели."""
+    return Coalesce(models.Subquery(
+        source.objects.filter(**{field: models.OuterRef('pk')}).order_by()
+        .values(field).annotate(total=models.Count('pk')).values('total')
+    ), 0)
+
+
+def find_mismatches():
+    """Список (счётчик, id, сохранено, фактически) для расхождений."""
+    mismatches = []
+    for counter, (model, field, source, source_field) in (
+        get_counters().items()
+    ):
+        rows = model.objects.order_by().annotate(
+            actual=count_of(source, source_field)
+        ).exclude(**{field: models.F('actual')}).values_list(
+            'pk', field, 'actual'
+        )
+        mismatches.extend((counter, *row) for row in rows)
+    return mismatches
+
+
+def rebuild():
+    """Переносит приращения и исправляет расхождения с исходными
+    таблицами. Возвращает исправленные расхождения.
+
+    Таблица приращений блокируется до конца пересчёта: транзакции,
+    которые ещё не записали приращение, ждут, и их изменения не попадут
+    в пересчёт и не будут учтены дважды.
+    """
+    with transaction.atomic():
+        lock_table(CounterDelta)
+        flush()
+        mismatches = find_mismatches()
+        object_ids = collections.defaultdict(list)
+        for counter, object_id, _, _ in mismatches:
+            object_ids[counter].append(object_id)
+        counters = get_counters()
+        for counter, ids in object_ids.items():
+            model, field, source, source_field = counters[counter]
+            model.objects.filter(pk__in=ids).update(
+                **{field: count_of(source, source_field)}
+            )
+    return mismatches
@@ -0,0 +1,134 @@
+"""Потоковый импорт справочника ингредиентов.
+
+Файл читается построчно (CSV, JSON Lines) или по кускам (JSON-массив),
+строки собираются в пачки по batch_size. Для пачки одним запросом
+выбираются уже существующие пары (название, единица) в виде кортежей,
+новые добавляются bulk_create с ignore_conflicts по ограничению
+unique_ingredient_unit, так что параллельный импорт не падает на
+дубликатах. Память ограничена размером пачки, а не файла.
+"""
+import csv
+import hashlib
+import json
+import os
+
+from recipes.models import Ingredient
+
+FORMATS = ('json', 'jsonl', 'csv')
+BATCH_SIZE = 1000
+READ_SIZE = 64 * 1024
+
+NAME_LENGTH = Ingredient._meta.get_field('name').max_length
+UNIT_LENGTH = Ingredient._meta.get_field('measurement_unit').max_length
+
+
+class ImportFormatError(ValueError):
+    """Файл не удалось разобрать."""
+
+
+def guess_format(path):
+    extension = os.path.splitext(path)[1].lstrip('.').lower()
+    if extension == 'ndjson':
+        return 'jsonl'
+    if extension not in FORMATS:
+        raise ImportFormatError(f'Неизвестный формат файла: {path}')
+    return extension
+
+
+def file_checksum(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(READ_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def iter_json_array(file, read_size=READ_SIZE):
+    """Элементы JSON-массива верхнего уровня без загрузки файла целиком."""
+    decoder = json.JSONDecoder()
+    buffer = file.read(read_size).lstrip()
+    if not buffer.startswith('['):
+        raise ImportFormatError('Ожидался JSON-массив')
+    position = 1
+    eof = False
+    while True:
+        while position < len(buffer) and buffer[position] in ' \t\r\n,':
+            position += 1
+        if position < len(buffer) and buffer[position] == ']':
+            return
+        try:
+            item, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError as error:
+            if eof:
+                raise ImportFormatError(f'Ошибка JSON: {error}')
+            end = None
+        if end is None or (end == len(buffer) and not eof):
+            # Элемент может быть не дочитан: добавляем следующий кусок.
+            chunk = file.read(read_size)
+            eof = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+        yield item
+        position = end
+
+
+def iter_jsonl(file):
+    for number, line in enumerate(file, 1):
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as error:
+                raise ImportFormatError(f'Строка {number}: {error}')
+
+
+def iter_csv(file):
+    """Строки «название,единица»; строка заголовка пропускается."""
+    for row in csv.reader(file):
+        if len(row) < 2 or (row[0], row[1]) == ('name', 'measurement_unit'):
+            continue
+        yield {'name': row[0], 'measurement_unit': row[1]}
+
+
+READERS = {'json': iter_json_array, 'jsonl': iter_jsonl, 'csv': iter_csv}
+
+
+def iter_rows(file, file_format):
+    """Пары (название, единица) из файла; неполные записи пропускаются."""
+    for item in READERS[file_format](file):
+        if not isinstance(item, dict):
+            continue
+        name = str(item.get('name') or '').strip()
+        unit = str(item.get('measurement_unit') or '').strip()
+        if name and unit:
+            yield name[:NAME_LENGTH], unit[:UNIT_LENGTH]
+
+
+def iter_batches(rows, batch_size=BATCH_SIZE):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def import_batch(rows):
+    """Добавляет отсутствующие ингредиенты из пачки. Возвращает число
+    добавленных (без учёта строк, вставленных параллельно)."""
+    rows = dict.fromkeys(rows)
+    existing = set(
+        Ingredient.objects.filter(
+            name__in={name for name, _ in rows}
+        ).values_list('name', 'measurement_unit')
+    )
+    new = [row for row in rows if row not in existing]
+    if new:
+        Ingredient.objects.bulk_create(
+            (Ingredient(name=name, measurement_unit=unit)
+             for name, unit in new),
+            ignore_conflicts=True,
+        )
+    return len(new)
@@ -0,0 +1,99 @@
+"""Индекс ингредиентов в памяти процесса для автодополнения.
+
+Справочник ингредиентов небольшой и почти не меняется, поэтому
+/api/ingredients/?name= отвечает из отсортированного списка названий в
+casefold без запросов к базе: диапазон совпадений по префиксу находится
+двоичным поиском, а результаты уже хранятся в виде словарей
+IngredientSerializer.
+
+Индекс строится при первом обращении в каждом процессе и перестраивается,
+когда меняется отметка справочника ингредиентов в общем кэше
+(recipes.cache.get_catalog_stamp). Её сбрасывают сигналы при изменении
+ингредиентов; код, пишущий в обход сигналов (bulk_create), должен
+вызвать recipes.cache.touch_catalog('ingredients') сам.
+
+Кэш по умолчанию свой у каждого процесса, поэтому отметку, сброшенную
+в другом процессе (import_ingredients через docker exec), сервер не
+увидит. На этот случай не чаще раза в INGREDIENT_INDEX_CHECK_INTERVAL
+секунд число строк и наибольший id справочника сверяются с индексом;
+при расхождении отметка сбрасывается и индекс перестраивается.
+"""
+import bisect
+import time
+
+from django.conf import settings
+from django.db.models import Count, Max
+
+from recipes import cache as recipe_cache
+from recipes.models import Ingredient
+
+# Больше любого символа, которым может продолжаться префикс.
+PREFIX_END = '\U0010ffff'
+
+# (токен отметки, ключи casefold по возрастанию, номера строк для
+# ключей, представления ингредиентов в порядке Ingredient.Meta.ordering).
+_index = None
+# (число строк и наибольший id справочника, время сверки по time.monotonic).
+_checked = None
+
+
+def _build(token):
+    global _checked
+    items = list(
+        Ingredient.objects.values('id', 'name', 'measurement_unit')
+    )
+    _checked = (
+        (len(items), max((item['id'] for item in items), default=None)),
+        time.monotonic()
+    )
+    entries = sorted(
+        (item['name'].casefold(), rank) for rank, item in enumerate(items)
+    )
+    keys = [key for key, _ in entries]
+    ranks = [rank for _, rank in entries]
+    return token, keys, ranks, items
+
+
+def _changed_elsewhere():
+    """Изменился ли справочник с последней сверки; сверяет не чаще раза
+    в INGREDIENT_INDEX_CHECK_INTERVAL секунд."""
+    global _checked
+    now = time.monotonic()
+    fingerprint, checked_at = _checked
+    if now - checked_at < getattr(
+        settings, 'INGREDIENT_INDEX_CHECK_INTERVAL', 60
+    ):
+        return False
+    current = tuple(
+        Ingredient.objects.aggregate(
+            count=Count('id'), last_id=Max('id')
+        ).values()
+    )
+    _checked = (current, now)
+    return current != fingerprint
+
+
+def get_index():
+    global _index
+    token, _ = recipe_cache.get_catalog_stamp('ingredients')
+    index = _index
+    if index is not None and index[0] == token and _changed_elsewhere():
+        # Отметка сброшена в кэше другого процесса: сбрасываем её и здесь,
+        # чтобы сменились и ETag ответов.
+        recipe_cache.reset_catalog('ingredients')
+        token, _ = recipe_cache.get_catalog_stamp('ingredients')
+    if index is None or index[0] != token:
+        index = _index = _build(token)
+    return index
+
+
+def search(prefix=''):
+    """Ингредиенты, название которых начинается с prefix без учёта
+    регистра, в том же порядке, что и в базе."""
+    _, keys, ranks, items = get_index()
+    prefix = (prefix or '').casefold()
+    if not prefix:
+        return list(items)
+    start = bisect.bisect_left(keys, prefix)
+    end = bisect.bisect_left(keys, prefix + PREFIX_END, start)
+    return [items[rank] for rank in sorted(ranks[start:end])]
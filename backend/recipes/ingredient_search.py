@@ -0,0 +1,106 @@
+"""Поиск ингредиентов по части названия и с опечатками (?search=).
+
+Результаты ранжируются: сначала названия, начинающиеся с запроса, затем
+содержащие его, затем похожие (опечатки), и обрезаются до
+INGREDIENT_SEARCH_LIMIT.
+
+На PostgreSQL поиск идёт в базе: вхождение проверяется через
+UPPER(name) LIKE, похожесть — оператором pg_trgm `<%` (word similarity),
+оба условия используют GIN-индекс с gin_trgm_ops из миграции
+0006_ingredient_name_trgm. На остальных базах тот же порядок
+воспроизводится по индексу в памяти (recipes.ingredient_index) и difflib.
+"""
+import difflib
+
+from django.conf import settings
+from django.db import connection, models
+from django.db.models.functions import Cast, Upper
+
+from recipes import ingredient_index
+from recipes.models import Ingredient
+
+# Порог difflib.SequenceMatcher.ratio() для похожих слов. Он выше
+# pg_trgm.word_similarity_threshold (0.6): ratio мягче триграмм и иначе
+# находит слова с общим началом («вареники» для «варенье»).
+FUZZY_CUTOFF = 0.75
+PREFIX, SUBSTRING, FUZZY = range(3)
+
+
+class WordSimilar(models.Func):
+    """`запрос <% название`: в названии есть слово, похожее на запрос."""
+    template = '%(expressions)s'
+    arg_joiner = ' <%% '
+    output_field = models.BooleanField()
+
+
+class WordSimilarity(models.Func):
+    function = 'word_similarity'
+    output_field = models.FloatField()
+
+
+def get_limit():
+    return getattr(settings, 'INGREDIENT_SEARCH_LIMIT', 20)
+
+
+def filter_queryset(queryset, query):
+    """Ранжированный поиск в базе (только PostgreSQL: pg_trgm)."""
+    rank = models.Case(
+        models.When(name__istartswith=query, then=models.Value(PREFIX)),
+        models.When(name__icontains=query, then=models.Value(SUBSTRING)),
+        default=models.Value(FUZZY),
+    )
+    expressions = (
+        Upper(models.Value(query, output_field=models.TextField())),
+        Upper(Cast('name', output_field=models.TextField())),
+    )
+    return queryset.filter(
+        models.Q(name__icontains=query)
+        | models.Q(WordSimilar(*expressions))
+    ).annotate(
+        search_rank=rank, similarity=WordSimilarity(*expressions)
+    ).order_by('search_rank', '-similarity', 'name')
+
+
+def search(query, limit=None):
+    """Представления найденных ингредиентов, не больше limit."""
+    limit = limit or get_limit()
+    query = query.strip()
+    if not query:
+        return []
+    if connection.vendor == 'postgresql':
+        return list(
+            filter_queryset(Ingredient.objects.all(), query).values(
+                'id', 'name', 'measurement_unit'
+            )[:limit]
+        )
+    return _search_in_memory(query.casefold(), limit)
+
+
+def _fuzzy_score(matcher, key):
+    best = 0
+    for word in (*key.split(), key):
+        matcher.set_seq1(word)
+        if (
+            matcher.real_quick_ratio() >= FUZZY_CUTOFF
+            and matcher.quick_ratio() >= FUZZY_CUTOFF
+        ):
+            best = max(best, matcher.ratio())
+    return best
+
+
+def _search_in_memory(query, limit):
+    _, keys, ranks, items = ingredient_index.get_index()
+    matcher = difflib.SequenceMatcher(autojunk=False)
+    matcher.set_seq2(query)
+    found = []
+    for key, rank in zip(keys, ranks):
+        if key.startswith(query):
+            found.append((PREFIX, 0, rank))
+        elif query in key:
+            found.append((SUBSTRING, 0, rank))
+        else:
+            score = _fuzzy_score(matcher, key)
+            if score >= FUZZY_CUTOFF:
+                found.append((FUZZY, -score, rank))
+    found.sort()
+    return [items[rank] for _, _, rank in found[:limit]]
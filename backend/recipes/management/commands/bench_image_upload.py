@@ -0,0 +1,67 @@
+import base64
+import io
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+from drf_extra_fields.fields import Base64ImageField
+from PIL import Image
+
+from api.serializers.base import StreamingBase64ImageField
+
+
+def make_payload(width, height, image_format):
+    """Изображение-шум в виде строки data: base64."""
+    image = Image.effect_noise((width, height), 64).convert('RGB')
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, quality=90)
+    encoded = base64.b64encode(buffer.getvalue()).decode()
+    mime = Image.MIME[image_format]
+    return f'data:{mime};base64,{encoded}', buffer.tell()
+
+
+def run(field, payload):
+    """Время и пик памяти Python-кучи при разборе payload полем field."""
+    tracemalloc.start()
+    started = time.perf_counter()
+    file = field.to_internal_value(payload)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    size = Image.open(file).size
+    file.close()
+    return elapsed, peak, size
+
+
+class Command(BaseCommand):
+    """Команда для сравнения памяти при приёме изображений в base64."""
+    help = (
+        'Сравнивает пик памяти и время приёма изображения через '
+        'Base64ImageField и StreamingBase64ImageField'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--width', type=int, default=6000)
+        parser.add_argument('--height', type=int, default=4000)
+        parser.add_argument(
+            '--format', default='JPEG', choices=('JPEG', 'PNG', 'WEBP')
+        )
+
+    def handle(self, *args, **options):
+        payload, size = make_payload(
+            options['width'], options['height'], options['format']
+        )
+        self.stdout.write(
+            f'Файл {size / 2 ** 20:.1f} МБ, base64 '
+            f'{len(payload) / 2 ** 20:.1f} МБ'
+        )
+        fields = (
+            ('Base64ImageField', Base64ImageField()),
+            ('StreamingBase64ImageField', StreamingBase64ImageField()),
+        )
+        for label, field in fields:
+            elapsed, peak, (width, height) = run(field, payload)
+            self.stdout.write(
+                f'{label:28} {elapsed * 1000:8.1f} мс  '
+                f'пик {peak / 2 ** 20:7.1f} МБ  {width}×{height}'
+            )
@@ -0,0 +1,106 @@
+import random
+
+from django.core.management.base import BaseCommand
+from django.http import QueryDict
+
+from api.filters.filters import RecipeFilter
+from recipes import counters
+from recipes.benchmarks import (
+    create_dataset, make_request, measure, rolled_back
+)
+from recipes.models import CounterDelta, Favorite, Recipe, Tag
+
+PAGE_SIZE = 6
+
+
+def legacy_queryset(params, user):
+    """Фильтрация как у прежнего AllValuesMultipleFilter: запрос всех
+    слагов, JOIN с тегами и DISTINCT."""
+    queryset = Recipe.objects.all()
+    slugs = params.getlist('tags')
+    if slugs:
+        list(Tag.objects.order_by().values_list('slug', flat=True).distinct())
+        queryset = queryset.filter(tags__slug__in=slugs).distinct()
+    if 'author' in params:
+        queryset = queryset.filter(author__id=params['author'])
+    if params.get('is_favorited') == 'true':
+        queryset = queryset.filter(favorited_by__user=user)
+    return queryset
+
+
+class Command(BaseCommand):
+    """Команда для сравнения скорости фильтрации рецептов."""
+    help = (
+        'Сравнивает фильтрацию рецептов по нескольким тегам через JOIN '
+        'и DISTINCT с фильтрацией через EXISTS (RecipeFilter)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=5000)
+        parser.add_argument('--tags', type=int, default=12)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        with rolled_back():
+            authors = create_dataset(
+                recipes=options['recipes'], tags=options['tags'],
+                per_recipe=2,
+            )
+            user = authors[0]
+            recipe_ids = list(Recipe.objects.values_list('id', flat=True))
+            favorites = Favorite.objects.bulk_create(
+                Favorite(user=user, recipe_id=recipe_id)
+                for recipe_id in random.Random(0).sample(
+                    recipe_ids, k=len(recipe_ids) // 3
+                )
+            )
+            counters.add(
+                CounterDelta.RECIPE_FAVORITES,
+                [favorite.recipe_id for favorite in favorites]
+            )
+            slugs = list(
+                Tag.objects.filter(
+                    slug__startswith='bench'
+                ).values_list('slug', flat=True)
+            )
+            request = make_request(user=user)
+            for label, query in self.get_cases(slugs, authors[1].id):
+                self.run_case(label, QueryDict(query), request, options)
+
+    def get_cases(self, slugs, author_id):
+        tags = '&'.join(f'tags={slug}' for slug in slugs[:3])
+        return (
+            ('1 тег', f'tags={slugs[0]}'),
+            ('3 тега', tags),
+            (f'{len(slugs)} тегов', '&'.join(f'tags={s}' for s in slugs)),
+            ('3 тега + автор', f'{tags}&author={author_id}'),
+            ('3 тега + избранное', f'{tags}&is_favorited=true'),
+        )
+
+    def run_case(self, label, params, request, options):
+        def run(get_queryset):
+            def page():
+                queryset = get_queryset()
+                return (
+                    queryset.count(),
+                    list(queryset.values_list('id', flat=True)[:PAGE_SIZE]),
+                )
+            return measure(page, options['repeat']), page()
+
+        legacy_time, legacy_page = run(
+            lambda: legacy_queryset(params, request.user)
+        )
+        exists_time, exists_page = run(
+            lambda: RecipeFilter(
+                params, queryset=Recipe.objects.all(), request=request
+            ).qs
+        )
+        status = (
+            self.style.SUCCESS('совпадает') if legacy_page == exists_page
+            else self.style.ERROR('различается!')
+        )
+        self.stdout.write(
+            f'{label:20} JOIN+DISTINCT {legacy_time * 1000:8.2f} мс  '
+            f'EXISTS {exists_time * 1000:8.2f} мс  '
+            f'x{legacy_time / exists_time:.1f}  {status}'
+        )
@@ -0,0 +1,78 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory, override_settings
+
+from recipes import sql_json
+from recipes.benchmarks import create_dataset, measure, rolled_back
+from recipes.views.recipe_views import RecipeViewSet
+
+MODES = (
+    ('DRF', {'RECIPE_FAST_SERIALIZER': False, 'RECIPE_SQL_JSON': False}),
+    ('Быстрый', {'RECIPE_FAST_SERIALIZER': True, 'RECIPE_SQL_JSON': False}),
+    ('SQL JSON', {'RECIPE_SQL_JSON': True}),
+)
+
+
+def render(response):
+    # Ответ SQL JSON — обычный HttpResponse, рендерить нечего.
+    if hasattr(response, 'render'):
+        response.render()
+    return response
+
+
+class Command(BaseCommand):
+    """Команда для сравнения скорости выдачи страниц рецептов."""
+    help = (
+        'Сравнивает число страниц /api/recipes/ в секунду при сериализации '
+        'в Python и при сборке JSON в PostgreSQL (RECIPE_SQL_JSON)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=500)
+        parser.add_argument('--limit', type=int, default=50)
+        parser.add_argument('--pages', type=int, default=5)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        view = RecipeViewSet.as_view({'get': 'list'})
+        factory = RequestFactory()
+        requests = [
+            factory.get(
+                '/api/recipes/',
+                {'limit': options['limit'], 'page': page},
+                HTTP_HOST='localhost',
+            )
+            for page in range(1, options['pages'] + 1)
+        ]
+        results = {}
+        with rolled_back():
+            create_dataset(recipes=options['recipes'])
+            for name, overrides in MODES:
+                with override_settings(RECIPE_CACHE_ENABLED=False,
+                                       **overrides):
+                    if name == 'SQL JSON' and not sql_json.is_enabled():
+                        self.stdout.write(
+                            f'{name}: недоступен (нужен PostgreSQL)'
+                        )
+                        continue
+
+                    def fetch():
+                        return [
+                            render(view(request)).content
+                            for request in requests
+                        ]
+
+                    results[name] = (
+                        measure(fetch, options['repeat']),
+                        [json.loads(body) for body in fetch()],
+                    )
+        for name, (elapsed, _) in results.items():
+            self.stdout.write(
+                f'{name + ":":10}{len(requests) / elapsed:10.1f} страниц/с'
+            )
+        bodies = [body for _, body in results.values()]
+        if all(body == bodies[0] for body in bodies):
+            self.stdout.write(self.style.SUCCESS('Вывод совпадает'))
+        else:
+            self.stdout.write(self.style.ERROR('Вывод различается!'))
@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from rest_framework.renderers import JSONRenderer
+
+from recipes.benchmarks import (
+    create_dataset, make_request, measure, rolled_back
+)
+from recipes.models import Recipe
+from recipes.serializers.recipe_serializers import RecipeListSerializer
+
+
+class Command(BaseCommand):
+    """Команда для сравнения скорости сериализации рецептов."""
+    help = (
+        'Сравнивает скорость RecipeListSerializer на полях DRF '
+        'и на быстром пути (recipes.serializers.fast_serializers)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=500)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        count = options['recipes']
+        with rolled_back():
+            create_dataset(recipes=count)
+            recipes = list(
+                Recipe.objects.with_related().with_user_flags(None)
+                .order_by('-id')[:count]
+            )
+            request = make_request()
+            results = {}
+            for fast in (False, True):
+                with override_settings(
+                    RECIPE_CACHE_ENABLED=False, RECIPE_FAST_SERIALIZER=fast
+                ):
+                    def serialize():
+                        return RecipeListSerializer(
+                            recipes, many=True, context={'request': request}
+                        ).data
+
+                    results[fast] = (
+                        measure(serialize, options['repeat']),
+                        JSONRenderer().render(serialize()),
+                    )
+        (drf_time, drf_body), (fast_time, fast_body) = (
+            results[False], results[True]
+        )
+        self.stdout.write(
+            f'DRF:     {count / drf_time:10.0f} рецептов/с\n'
+            f'Быстрый: {count / fast_time:10.0f} рецептов/с\n'
+            f'Ускорение: {drf_time / fast_time:.1f}x'
+        )
+        if drf_body == fast_body:
+            self.stdout.write(self.style.SUCCESS('Вывод совпадает'))
+        else:
+            self.stdout.write(self.style.ERROR('Вывод различается!'))
@@ -0,0 +1,110 @@
+import collections
+import threading
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import RequestFactory
+from rest_framework.test import force_authenticate
+
+from recipes.models import Recipe
+from recipes.views.recipe_views import RecipeViewSet
+from users.models import User
+from users.views.user_views import CustomUserViewSet
+
+
+class Command(BaseCommand):
+    """Команда для проверки добавления и удаления под параллельной
+    нагрузкой."""
+    help = (
+        'Одновременно отправляет одинаковые POST и DELETE на favorite, '
+        'shopping_cart и subscribe из нескольких потоков и считает коды '
+        'ответов и необработанные ошибки. Данные создаются в базе и '
+        'удаляются в конце; имеет смысл на PostgreSQL'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--rounds', type=int, default=20)
+
+    def handle(self, *args, **options):
+        prefix = f'bench{uuid.uuid4().hex[:8]}'
+        user, author = (
+            User.objects.create_user(
+                username=f'{prefix}_{name}',
+                email=f'{prefix}_{name}@example.com',
+            )
+            for name in ('user', 'author')
+        )
+        recipe = Recipe.objects.create(
+            author=author, name=f'{prefix} рецепт', text='Описание',
+            cooking_time=5,
+        )
+        targets = (
+            ('favorite', RecipeViewSet, 'pk', recipe.pk),
+            ('shopping_cart', RecipeViewSet, 'pk', recipe.pk),
+            ('subscribe', CustomUserViewSet, 'id', author.pk),
+        )
+        try:
+            for name, viewset, lookup, pk in targets:
+                view = viewset.as_view({'post': name, 'delete': name})
+                results, elapsed = self.run_target(
+                    view, user, {lookup: pk}, options
+                )
+                self.report(name, results, elapsed)
+        finally:
+            User.objects.filter(pk__in=(user.pk, author.pk)).delete()
+
+    def run_target(self, view, user, kwargs, options):
+        """Раунды одновременных POST, затем DELETE; возвращает счётчик
+        (метод, итог) и время в секундах."""
+        threads = options['threads']
+        barrier = threading.Barrier(threads)
+        results = collections.Counter()
+        lock = threading.Lock()
+        factory = RequestFactory()
+
+        def worker():
+            try:
+                for _ in range(options['rounds']):
+                    for method in ('post', 'delete'):
+                        request = getattr(factory, method)(
+                            '/', HTTP_HOST='localhost'
+                        )
+                        force_authenticate(request, user)
+                        barrier.wait()
+                        try:
+                            outcome = view(request, **kwargs).status_code
+                        except Exception as error:
+                            outcome = type(error).__name__
+                        with lock:
+                            results[method.upper(), outcome] += 1
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        started = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        return results, time.perf_counter() - started
+
+    def report(self, name, results, elapsed):
+        errors = sum(
+            count for (_, outcome), count in results.items()
+            if not isinstance(outcome, int) or outcome >= 500
+        )
+        outcomes = ', '.join(
+            f'{method} {outcome}×{count}'
+            for (method, outcome), count in sorted(
+                results.items(), key=lambda item: str(item[0])
+            )
+        )
+        self.stdout.write(
+            f'{name + ":":15}{sum(results.values()) / elapsed:8.1f} '
+            f'запросов/с; {outcomes}'
+        )
+        style = self.style.ERROR if errors else self.style.SUCCESS
+        self.stdout.write(style(f'{"":15}ошибок: {errors}'))
@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes import catalog_snapshots
+
+
+class Command(BaseCommand):
+    """Команда для записи снимков справочников в файлы для nginx."""
+    help = (
+        'Записывает снимки ингредиентов и тегов (JSON и .json.gz) '
+        'в CATALOG_SNAPSHOT_ROOT или в каталог --output'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output')
+
+    def handle(self, *args, **options):
+        root = options['output'] or settings.CATALOG_SNAPSHOT_ROOT
+        if not root:
+            raise CommandError(
+                'Не задан CATALOG_SNAPSHOT_ROOT и не указан --output'
+            )
+        for name in catalog_snapshots.CATALOGS:
+            path = catalog_snapshots.write_files(name, root)
+            snapshot = catalog_snapshots.get_snapshot(name)
+            self.stdout.write(
+                f'{path}: {len(snapshot.body)} байт, '
+                f'gzip {len(snapshot.gzipped)} байт, '
+                f'ETag {snapshot.etag}'
+            )
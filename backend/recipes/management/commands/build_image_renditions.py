@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from api import images
+from recipes import signals
+from recipes.models import Recipe
+from users.models import User
+
+
+class Command(BaseCommand):
+    """Команда для построения недостающих версий изображений."""
+    help = (
+        'Строит уменьшенные версии изображений рецептов и аватаров, '
+        'которые ещё не построены или устарели'
+    )
+
+    def handle(self, *args, **options):
+        targets = (
+            ('рецептов', Recipe, 'image', signals.build_recipe_image),
+            ('аватаров', User, 'avatar', signals.build_avatar),
+        )
+        for label, model, field, build in targets:
+            built = 0
+            rows = model.objects.exclude(**{f'{field}__isnull': True}).exclude(
+                **{field: ''}
+            ).only(field, images.renditions_field(field)).iterator()
+            for instance in rows:
+                if images.is_ready(
+                    getattr(instance, field),
+                    getattr(instance, images.renditions_field(field))
+                ):
+                    continue
+                build(instance.pk)
+                built += 1
+            self.stdout.write(
+                self.style.SUCCESS(f'Обработано {label}: {built}')
+            )
@@ -0,0 +1,93 @@
+import datetime
+import os
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from api import images
+from recipes.models import Recipe
+from users.models import User
+
+# Модели и поля с изображениями, ссылки на которые нужно сохранить.
+MEDIA_FIELDS = ((Recipe, 'image'), (User, 'avatar'))
+
+
+def get_referenced():
+    """Имена файлов, на которые ссылаются записи и их версии."""
+    referenced = set()
+    for model, field in MEDIA_FIELDS:
+        rows = model.objects.exclude(**{f'{field}__isnull': True}).exclude(
+            **{field: ''}
+        ).values_list(field, images.renditions_field(field))
+        for name, renditions in rows.iterator():
+            referenced.add(name)
+            if renditions.get('source') == name:
+                referenced.update(
+                    renditions[rendition] for rendition in images.RENDITIONS
+                )
+    return referenced
+
+
+def walk(directory):
+    """Все файлы каталога хранилища, включая подкаталоги."""
+    if not default_storage.exists(directory):
+        return
+    subdirectories, files = default_storage.listdir(directory)
+    for name in files:
+        yield os.path.join(directory, name)
+    for subdirectory in subdirectories:
+        yield from walk(os.path.join(directory, subdirectory))
+
+
+class Command(BaseCommand):
+    """Команда для удаления медиафайлов, на которые нет ссылок."""
+    help = (
+        'Удаляет изображения рецептов и аватары (и их версии), на которые '
+        'больше не ссылаются записи'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать, что будет удалено'
+        )
+        parser.add_argument(
+            '--min-age', type=int, default=60 * 60,
+            help='Не трогать файлы моложе стольких секунд: они могут '
+                 'принадлежать ещё не сохранённым записям'
+        )
+
+    def handle(self, *args, **options):
+        if not hasattr(default_storage, 'purge'):
+            raise CommandError(
+                'Хранилище по умолчанию не поддерживает сборку мусора'
+            )
+        referenced = get_referenced()
+        threshold = timezone.now() - datetime.timedelta(
+            seconds=options['min_age']
+        )
+        removed = freed = 0
+        for directory in self.get_directories():
+            for name in walk(directory):
+                if name in referenced or (
+                    default_storage.get_modified_time(name) > threshold
+                ):
+                    continue
+                freed += default_storage.size(name)
+                removed += 1
+                if options['dry_run']:
+                    self.stdout.write(name)
+                else:
+                    default_storage.purge(name)
+        verb = 'Будет удалено' if options['dry_run'] else 'Удалено'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} файлов: {removed}, {freed / 2 ** 20:.1f} МБ'
+        ))
+
+    @staticmethod
+    def get_directories():
+        return [
+            model._meta.get_field(field).upload_to.rstrip('/')
+            for model, field in MEDIA_FIELDS
+        ]
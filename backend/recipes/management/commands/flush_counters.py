@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from recipes import counters
+
+
+class Command(BaseCommand):
+    """Команда для переноса накопленных приращений счётчиков."""
+    help = (
+        'Переносит накопленные приращения счётчиков популярности '
+        'в строки рецептов и пользователей; с --every повторяет перенос '
+        'каждые N секунд, пока её не остановят'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--every', type=int, default=0, metavar='N',
+            help='Переносить каждые N секунд (0 — один раз)'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            processed = counters.flush()
+            if not options['every']:
+                break
+            if processed:
+                self.stdout.write(f'Перенесено приращений: {processed}')
+            time.sleep(options['every'])
+        self.stdout.write(
+            self.style.SUCCESS(f'Перенесено приращений: {processed}')
+        )
@@ -1,105 +1,117 @@
-import json
 import os
+import time
 
 from django.conf import settings
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 
-from recipes.models import Ingredient
+from recipes import cache as recipe_cache
+from recipes import catalog_snapshots
+from recipes import ingredient_import
+from recipes.models import IngredientImport
 
 
 class Command(BaseCommand):
-    """Команда для импорта ингредиентов из JSON-файла."""
-    help = 'Импорт ингредиентов из JSON-файла'
+    """Команда для импорта ингредиентов из JSON, JSON Lines или CSV."""
+    help = (
+        'Потоковый импорт ингредиентов пачками. Повторный импорт того же '
+        'файла пропускается, если не указан --force'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?',
+            help='Файл с ингредиентами; по умолчанию data/ingredients.json '
+                 'или data/ingredients.csv'
+        )
+        parser.add_argument(
+            '--format', choices=ingredient_import.FORMATS,
+            help='Формат файла; по умолчанию — по расширению'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=ingredient_import.BATCH_SIZE
+        )
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Импортировать, даже если файл уже импортирован'
+        )
 
     def handle(self, *args, **options):
         """Основной метод команды."""
-        data_path = self._find_ingredients_file()
-        if not data_path:
+        self.verbosity = options['verbosity']
+        path = options['path'] or self._find_ingredients_file()
+        if not os.path.exists(path):
+            raise CommandError(f'Файл не найден: {path}')
+        checksum = ingredient_import.file_checksum(path)
+        last = IngredientImport.objects.first()
+        if not options['force'] and last and last.checksum == checksum:
+            self.stdout.write(
+                self.style.WARNING(
+                    f'{path} уже импортирован {last.imported_at:%d.%m.%Y}'
+                )
+            )
             return
         try:
-            ingredients_data = self._load_json_file(data_path)
-            if ingredients_data is None:
-                return
-            self._import_ingredients(ingredients_data)
-        except Exception as e:
-            self.stdout.write(
-                self.style.ERROR(f'Произошла ошибка: {e}')
+            file_format = (
+                options['format'] or ingredient_import.guess_format(path)
+            )
+            rows, created = self._import_file(
+                path, file_format, options['batch_size']
             )
+        except ingredient_import.ImportFormatError as error:
+            raise CommandError(f'Ошибка в файле {path}: {error}')
+        IngredientImport.objects.create(
+            checksum=checksum, source=os.path.basename(path),
+            rows=rows, created=created,
+        )
 
     def _find_ingredients_file(self):
         """Поиск файла с ингредиентами среди возможных путей."""
         possible_paths = [
-            os.path.join(settings.BASE_DIR, '..', 'data', 'ingredients.json'),
-            os.path.join(settings.BASE_DIR, 'data', 'ingredients.json'),
-            '/app/data/ingredients.json',
+            os.path.join(directory, name)
+            for directory in (
+                os.path.join(settings.BASE_DIR, '..', 'data'),
+                os.path.join(settings.BASE_DIR, 'data'),
+                '/app/data',
+            )
+            for name in ('ingredients.json', 'ingredients.csv')
         ]
         for path in possible_paths:
             if os.path.exists(path):
                 return path
-        self.stdout.write(
-            self.style.ERROR(
-                f'ingredients.json не найден. Проверены: {possible_paths}'
-            )
+        raise CommandError(
+            f'Файл с ингредиентами не найден. Проверены: {possible_paths}'
         )
-        return None
 
-    def _load_json_file(self, file_path):
-        """Загрузка данных из JSON-файла."""
-        try:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                return json.load(file)
-        except FileNotFoundError:
-            self.stdout.write(
-                self.style.ERROR(f'Файл не найден: {file_path}')
-            )
-        except json.JSONDecodeError:
-            self.stdout.write(
-                self.style.ERROR(
-                    f'Ошибка декодирования JSON в файле: '
-                    f'{file_path}'
-                )
-            )
-        return None
-
-    def _import_ingredients(self, ingredients_data):
-        """Импорт ингредиентов из данных JSON."""
-        ingredients_to_create = []
-        existing_ingredients = self._get_existing_ingredients()
-        # Подготавливаем список ингредиентов для создания
-        for item in ingredients_data:
-            name = item.get('name')
-            measurement_unit = item.get('measurement_unit')
-            if not name or not measurement_unit:
-                continue
-            key = f"{name}_{measurement_unit}"
-            if key in existing_ingredients:
-                continue
-            ingredients_to_create.append(
-                Ingredient(name=name, measurement_unit=measurement_unit)
+    def _import_file(self, path, file_format, batch_size):
+        """Импорт пачками с выводом прогресса. Возвращает число строк
+        в файле и число добавленных ингредиентов."""
+        rows = created = 0
+        started = time.monotonic()
+        with open(path, encoding='utf-8-sig', newline='') as file:
+            for batch in ingredient_import.iter_batches(
+                ingredient_import.iter_rows(file, file_format), batch_size
+            ):
+                rows += len(batch)
+                created += ingredient_import.import_batch(batch)
+                if self.verbosity >= 2:
+                    self.stdout.write(
+                        f'{rows} строк, добавлено {created}, '
+                        f'{self._rate(rows, started)} строк/с'
+                    )
+        if created:
+            # bulk_create не отправляет сигналы: сбрасываем отметку
+            # справочника, чтобы перестроить индекс и ETag.
+            recipe_cache.touch_catalog('ingredients')
+            catalog_snapshots.refresh_files('ingredients')
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Обработано {rows} строк, добавлено {created} '
+                f'ингредиентов за {time.monotonic() - started:.2f} с '
+                f'({self._rate(rows, started)} строк/с)'
             )
-            existing_ingredients[key] = True
-        self._create_ingredients(ingredients_to_create)
-
-    def _get_existing_ingredients(self):
-        """Получение словаря существующих
-        ингредиентов для проверки дубликатов."""
-        existing_ingredients = {}
-        for ingredient in Ingredient.objects.all():
-            key = f"{ingredient.name}_{ingredient.measurement_unit}"
-            existing_ingredients[key] = True
-        return existing_ingredients
+        )
+        return rows, created
 
-    def _create_ingredients(self, ingredients_to_create):
-        """Сохранение новых ингредиентов в базу данных."""
-        if ingredients_to_create:
-            Ingredient.objects.bulk_create(ingredients_to_create)
-            self.stdout.write(
-                self.style.SUCCESS(
-                    f'Успешно импортировано {len(ingredients_to_create)} '
-                    f'ингредиентов'
-                )
-            )
-        else:
-            self.stdout.write(
-                self.style.WARNING('Нет новых ингредиентов для импорта')
-            )
+    @staticmethod
+    def _rate(rows, started):
+        return int(rows / max(time.monotonic() - started, 1e-6))
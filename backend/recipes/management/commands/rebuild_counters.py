@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes import counters
+
+
+class Command(BaseCommand):
+    """Команда для пересчёта счётчиков популярности."""
+    help = (
+        'Пересчитывает favorites_count, in_carts_count и recipes_count '
+        'по исходным таблицам'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Только проверить счётчики, ничего не исправляя'
+        )
+
+    def handle(self, *args, **options):
+        if options['check']:
+            counters.flush()
+            mismatches = counters.find_mismatches()
+        else:
+            mismatches = counters.rebuild()
+        for counter, object_id, stored, actual in mismatches:
+            self.stdout.write(
+                f'{counter}[{object_id}]: сохранено {stored}, '
+                f'фактически {actual}'
+            )
+        if options['check'] and mismatches:
+            raise CommandError(f'Расхождений: {len(mismatches)}')
+        if options['check']:
+            self.stdout.write(self.style.SUCCESS('Счётчики верны'))
+        else:
+            self.stdout.write(
+                self.style.SUCCESS(f'Исправлено: {len(mismatches)}')
+            )
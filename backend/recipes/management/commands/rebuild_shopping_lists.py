@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes import shopping_list
+
+
+class Command(BaseCommand):
+    """Команда для сверки таблицы списков покупок с корзинами."""
+    help = (
+        'Сверяет строки списков покупок (ShoppingListItem) с суммами по '
+        'рецептам в корзинах и исправляет расхождения'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Только проверить таблицу, ничего не исправляя'
+        )
+
+    def handle(self, *args, **options):
+        if options['check']:
+            mismatches = shopping_list.find_mismatches()
+        else:
+            mismatches = shopping_list.rebuild()
+        for user_id, ingredient_id, stored, actual in sorted(
+            mismatches, key=lambda mismatch: mismatch[:2]
+        ):
+            self.stdout.write(
+                f'user {user_id}, ingredient {ingredient_id}: '
+                f'сохранено {stored}, фактически {actual}'
+            )
+        if options['check'] and mismatches:
+            raise CommandError(f'Расхождений: {len(mismatches)}')
+        if options['check']:
+            self.stdout.write(self.style.SUCCESS('Списки покупок верны'))
+        else:
+            self.stdout.write(
+                self.style.SUCCESS(f'Исправлено: {len(mismatches)}')
+            )
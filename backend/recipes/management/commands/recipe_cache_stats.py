@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from recipes import cache as recipe_cache
+
+
+class Command(BaseCommand):
+    """Команда для просмотра статистики кэша представлений рецептов."""
+    help = 'Показывает попадания и промахи кэша представлений рецептов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reset', action='store_true',
+            help='Обнулить счётчики после вывода',
+        )
+
+    def handle(self, *args, **options):
+        stats = recipe_cache.get_stats()
+        self.stdout.write(
+            f"Попаданий: {stats['hits']}, промахов: {stats['misses']}, "
+            f"доля попаданий: {stats['hit_ratio']:.1%}"
+        )
+        if options['reset']:
+            recipe_cache.reset_stats()
+            self.stdout.write(self.style.SUCCESS('Счётчики обнулены'))
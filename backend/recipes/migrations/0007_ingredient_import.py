@@ -0,0 +1,29 @@
+# Generated by Django 4.2.20 on 2026-10-18 04:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_ingredient_name_trgm'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngredientImport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('checksum', models.CharField(max_length=64, verbose_name='SHA-256 файла')),
+                ('source', models.CharField(max_length=255, verbose_name='Файл')),
+                ('rows', models.PositiveIntegerField(verbose_name='Строк в файле')),
+                ('created', models.PositiveIntegerField(verbose_name='Добавлено ингредиентов')),
+                ('imported_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата импорта')),
+            ],
+            options={
+                'verbose_name': 'Импорт ингредиентов',
+                'verbose_name_plural': 'Импорты ингредиентов',
+                'ordering': ['-imported_at'],
+            },
+        ),
+    ]
@@ -1,6 +1,6 @@
 from django.db import models
 from django.core.validators import MinValueValidator
-from users.models import User
+from users.models import Subscription, User
 
 
 class Ingredient(models.Model):
@@ -56,6 +56,107 @@ class Tag(models.Model):
         return self.name
 
 
+class RecipeQuerySet(models.QuerySet):
+    """Набор запросов для рецептов."""
+
+    # Аннотации флагов и поля RecipeListSerializer, которым они нужны.
+    USER_FLAGS = {
+        'is_favorited': 'is_favorited',
+        'is_in_shopping_cart': 'is_in_shopping_cart',
+        'author_is_subscribed': 'author',
+    }
+    # Столбцы, которые можно не читать, если из ответа исключены все
+    # поля, которые их используют.
+    DEFERRABLE_COLUMNS = {
+        'name': ('name',),
+        'image': ('image', 'image_renditions'),
+        'image_renditions': ('image_renditions',),
+        'text': ('text',),
+        'cooking_time': ('cooking_time',),
+    }
+
+    def with_user_flags(self, user, flags=None):
+        """Аннотирует флаги is_favorited, is_in_shopping_cart
+        и author_is_subscribed (или только перечисленные во flags).
+
+        Флаги вычисляются подзапросами EXISTS в том же запросе, что и
+        сами рецепты, поэтому их стоимость не зависит от размера страницы.
+        """
+        if flags is None:
+            flags = self.USER_FLAGS
+        if user is None or not user.is_authenticated:
+            return self.annotate(
+                **{flag: models.Value(False) for flag in flags}
+            )
+        annotations = {
+            'is_favorited': models.Exists(
+                Favorite.objects.filter(
+                    user=user, recipe=models.OuterRef('pk')
+                )
+            ),
+            'is_in_shopping_cart': models.Exists(
+                ShoppingCart.objects.filter(
+                    user=user, recipe=models.OuterRef('pk')
+                )
+            ),
+            'author_is_subscribed': models.Exists(
+                Subscription.objects.filter(
+                    user=user, author=models.OuterRef('author')
+                )
+            ),
+        }
+        return self.annotate(**{flag: annotations[flag] for flag in flags})
+
+    @staticmethod
+    def related_lookups(fields=None):
+        """Связи, которые читает RecipeListSerializer помимо автора.
+
+        fields — поля ответа; None означает все поля.
+        """
+        lookups = {
+            'tags': 'tags',
+            'ingredients': models.Prefetch(
+                'recipe_ingredients',
+                queryset=RecipeIngredient.objects.select_related(
+                    'ingredient'
+                ).order_by('id'),
+            ),
+        }
+        return tuple(
+            lookup for name, lookup in lookups.items()
+            if fields is None or name in fields
+        )
+
+    def with_related(self):
+        """Загружает автора, теги и ингредиенты фиксированным числом
+        запросов: автор через JOIN, теги и ингредиенты через prefetch.
+        """
+        return self.select_related('author').prefetch_related(
+            *self.related_lookups()
+        )
+
+    def for_representation(self, user, fields=None):
+        """Всё, что читает RecipeListSerializer, для пользователя user.
+
+        Теги и ингредиенты здесь не загружаются: RecipeListSerializer
+        подгружает их одним prefetch только для рецептов, которых нет
+        в кэше представлений (recipes.cache). Если задан fields, автор,
+        флаги и столбцы исключённых полей не загружаются.
+        """
+        if fields is None:
+            return self.select_related('author').with_user_flags(user)
+        queryset = self.defer(*(
+            column for column, used_by in self.DEFERRABLE_COLUMNS.items()
+            if not set(used_by) & set(fields)
+        ))
+        if 'author' in fields:
+            queryset = queryset.select_related('author')
+        return queryset.with_user_flags(user, [
+            flag for flag, field in self.USER_FLAGS.items()
+            if field in fields
+        ])
+
+
 class Recipe(models.Model):
     """Модель для рецептов."""
     author = models.ForeignKey(
@@ -72,6 +173,13 @@ class Recipe(models.Model):
         upload_to='recipes/images/',
         verbose_name='Изображение рецепта',
     )
+    # Уменьшенные версии изображения, см. api.images.
+    image_renditions = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        verbose_name='Версии изображения',
+    )
     text = models.TextField(
         verbose_name='Описание рецепта',
     )
@@ -94,11 +202,38 @@ class Recipe(models.Model):
         auto_now_add=True,
         verbose_name='Дата публикации',
     )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Дата изменения',
+    )
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Добавлений в избранное',
+    )
+    in_carts_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Добавлений в список покупок',
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
-        ordering = ['-pub_date']
+        ordering = ['-pub_date', '-id']
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = [
+            models.Index(
+                fields=['-pub_date', '-id'],
+                name='recipe_pub_date_id_idx',
+            ),
+            # Последние рецепты каждого автора (подписки, фильтр author).
+            models.Index(
+                fields=['author', '-pub_date', '-id'],
+                name='recipe_author_pub_date_idx',
+            ),
+        ]
 
     def __str__(self):
         return self.name
@@ -203,3 +338,101 @@ class ShoppingCart(models.Model):
     def __str__(self):
         return (f'{self.user.username} добавил {self.recipe.name} '
                 f'в список покупок')
+
+
+class ShoppingListItem(models.Model):
+    """Строка списка покупок пользователя: сумма ингредиента по всем
+    рецептам в его корзине (поддерживается recipes.shopping_list)."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list_items',
+        verbose_name='Пользователь',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='shopping_list_items',
+        verbose_name='Ингредиент',
+    )
+    total_amount = models.PositiveIntegerField(
+        verbose_name='Количество',
+    )
+    recipe_count = models.PositiveIntegerField(
+        verbose_name='Рецептов',
+    )
+
+    class Meta:
+        verbose_name = 'Строка списка покупок'
+        verbose_name_plural = 'Строки списков покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_shopping_list_item'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.user_id}: {self.ingredient_id} × {self.total_amount}'
+
+
+class CounterDelta(models.Model):
+    """Приращение денормализованного счётчика, ещё не перенесённое
+    в строку рецепта или пользователя (см. recipes.counters)."""
+    RECIPE_FAVORITES = 'recipe_favorites'
+    RECIPE_IN_CARTS = 'recipe_in_carts'
+    USER_RECIPES = 'user_recipes'
+    COUNTER_CHOICES = (
+        (RECIPE_FAVORITES, 'Рецепт: добавлений в избранное'),
+        (RECIPE_IN_CARTS, 'Рецепт: добавлений в список покупок'),
+        (USER_RECIPES, 'Пользователь: число рецептов'),
+    )
+
+    counter = models.CharField(
+        max_length=32,
+        choices=COUNTER_CHOICES,
+        verbose_name='Счётчик',
+    )
+    object_id = models.PositiveBigIntegerField(
+        verbose_name='Id объекта',
+    )
+    delta = models.SmallIntegerField(
+        verbose_name='Приращение',
+    )
+
+    class Meta:
+        verbose_name = 'Приращение счётчика'
+        verbose_name_plural = 'Приращения счётчиков'
+
+    def __str__(self):
+        return f'{self.counter}[{self.object_id}] {self.delta:+d}'
+
+
+class IngredientImport(models.Model):
+    """Успешный импорт файла ингредиентов (см. import_ingredients)."""
+    checksum = models.CharField(
+        max_length=64,
+        verbose_name='SHA-256 файла',
+    )
+    source = models.CharField(
+        max_length=255,
+        verbose_name='Файл',
+    )
+    rows = models.PositiveIntegerField(
+        verbose_name='Строк в файле',
+    )
+    created = models.PositiveIntegerField(
+        verbose_name='Добавлено ингредиентов',
+    )
+    imported_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Дата импорта',
+    )
+
+    class Meta:
+        ordering = ['-imported_at']
+        verbose_name = 'Импорт ингредиентов'
+        verbose_name_plural = 'Импорты ингредиентов'
+
+    def __str__(self):
+        return f'{self.source} ({self.checksum[:12]})'
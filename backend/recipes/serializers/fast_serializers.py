@@ -0,0 +1,108 @@
+"""Быстрое представление рецептов только для чтения.
+
+Строит те же словари, что RecipeListSerializer и вложенные в него
+TagSerializer, RecipeIngredientSerializer и CustomUserSerializer, но
+напрямую из загруженных моделей, минуя поля DRF. Автор, теги и
+ингредиенты должны быть загружены заранее: через
+RecipeQuerySet.with_related() или prefetch в RecipeListSerializer.
+
+Совпадение с выводом DRF до байта проверяют тесты в recipes/tests.py;
+при изменении полей сериализаторов нужно поменять и этот модуль.
+"""
+from django.utils.encoding import iri_to_uri
+
+from api import images
+
+
+def make_url_builder(request):
+    """Функция, превращающая путь к файлу в ссылку, как это делает DRF.
+
+    Для обычных абсолютных путей повторяет быстрый случай
+    HttpRequest.build_absolute_uri, но вычисляет схему и хост один раз.
+    """
+    if request is None:
+        return str
+    prefix = request.build_absolute_uri('/')[:-1]
+
+    def build_url(url):
+        if (
+            url.startswith('/') and not url.startswith('//')
+            and '/./' not in url and '/../' not in url
+        ):
+            return prefix + iri_to_uri(url)
+        return request.build_absolute_uri(url)
+
+    return build_url
+
+
+def file_url(field_file, build_url):
+    if not field_file:
+        return None
+    return build_url(field_file.url)
+
+
+def tag_to_dict(tag):
+    return {
+        'id': tag.id,
+        'name': str(tag.name),
+        'color': str(tag.color),
+        'slug': str(tag.slug),
+    }
+
+
+def recipe_ingredient_to_dict(item):
+    ingredient = item.ingredient
+    return {
+        'id': ingredient.id,
+        'name': str(ingredient.name),
+        'measurement_unit': str(ingredient.measurement_unit),
+        'amount': item.amount,
+    }
+
+
+def user_to_dict(user, build_url, is_subscribed=False):
+    return {
+        'email': str(user.email),
+        'id': user.id,
+        'username': str(user.username),
+        'first_name': str(user.first_name),
+        'last_name': str(user.last_name),
+        'is_subscribed': is_subscribed,
+        'avatar': file_url(user.avatar, build_url),
+        'avatar_renditions': images.rendition_urls(
+            user.avatar, user.avatar_renditions, build_url
+        ),
+    }
+
+
+RECIPE_FIELDS = (
+    'id', 'author', 'ingredients', 'is_favorited', 'is_in_shopping_cart',
+    'name', 'image', 'image_renditions', 'text', 'cooking_time', 'tags',
+)
+
+
+def recipe_to_dict(recipe, build_url, is_favorited=False,
+                   is_in_shopping_cart=False, is_subscribed=False,
+                   fields=RECIPE_FIELDS):
+    """Представление рецепта; читаются только связи и столбцы из fields."""
+    builders = {
+        'id': lambda: recipe.id,
+        'author': lambda: user_to_dict(
+            recipe.author, build_url, is_subscribed
+        ),
+        'ingredients': lambda: [
+            recipe_ingredient_to_dict(item)
+            for item in recipe.recipe_ingredients.all()
+        ],
+        'is_favorited': lambda: is_favorited,
+        'is_in_shopping_cart': lambda: is_in_shopping_cart,
+        'name': lambda: str(recipe.name),
+        'image': lambda: file_url(recipe.image, build_url),
+        'image_renditions': lambda: images.rendition_urls(
+            recipe.image, recipe.image_renditions, build_url
+        ),
+        'text': lambda: str(recipe.text),
+        'cooking_time': lambda: recipe.cooking_time,
+        'tags': lambda: [tag_to_dict(tag) for tag in recipe.tags.all()],
+    }
+    return {name: builders[name]() for name in fields}
@@ -1,13 +1,22 @@
-from django.db import transaction
-from django.shortcuts import get_object_or_404
+from django.conf import settings
+from django.db import models, transaction
 from rest_framework import serializers
-from drf_extra_fields.fields import Base64ImageField
 
 from recipes.models import (
     Ingredient, Recipe, RecipeIngredient, Tag, Favorite, ShoppingCart
 )
+from recipes import cache as recipe_cache
+from recipes import shopping_list
+from recipes.serializers import fast_serializers
+from api.db import delete_returning
+from api.serializers.base import (
+    ImageRenditionsField, SparseFieldsetMixin, StreamingBase64ImageField
+)
 from users.serializers.user_serializers import CustomUserSerializer
 
+# Наибольшее число рецептов в одном пакетном запросе.
+BATCH_MAX_RECIPES = 100
+
 
 class IngredientSerializer(serializers.ModelSerializer):
     """Сериализатор для ингредиентов."""
@@ -36,8 +45,24 @@ class RecipeIngredientSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'measurement_unit', 'amount')
 
 
-class RecipeListSerializer(serializers.ModelSerializer):
-    """Сериализатор для отображения рецептов."""
+class CachedRecipeListSerializer(serializers.ListSerializer):
+    """Список рецептов, собираемый одним обращением к кэшу представлений."""
+
+    def to_representation(self, data):
+        if isinstance(data, models.manager.BaseManager):
+            data = data.all()
+        return self.child.represent_many(list(data))
+
+
+class RecipeListSerializer(SparseFieldsetMixin,
+                           serializers.ModelSerializer):
+    """Сериализатор для отображения рецептов.
+
+    Общая для всех пользователей часть представления берётся из
+    recipes.cache, флаги текущего пользователя подставляются поверх неё.
+    Поддерживает ?fields= и ?omit=: для исключённых полей не загружаются
+    связи, а в кэше хранится отдельная запись для каждого набора полей.
+    """
     tags = TagSerializer(many=True, read_only=True)
     author = CustomUserSerializer(read_only=True)
     ingredients = RecipeIngredientSerializer(
@@ -45,6 +70,7 @@ class RecipeListSerializer(serializers.ModelSerializer):
     )
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
+    image_renditions = ImageRenditionsField('image')
 
     class Meta:
         model = Recipe
@@ -56,24 +82,123 @@ class RecipeListSerializer(serializers.ModelSerializer):
             'is_in_shopping_cart',
             'name',
             'image',
+            'image_renditions',
             'text',
             'cooking_time',
             'tags',
         )
+        list_serializer_class = CachedRecipeListSerializer
+
+    def to_representation(self, instance):
+        return self.represent_many([instance])[0]
+
+    def represent_many(self, recipes):
+        if recipe_cache.is_enabled():
+            namespace = recipe_cache.get_namespace(
+                self.context.get('request')
+            )
+            fieldset = self.get_sparse_fieldset()
+            if fieldset is not None:
+                namespace = f"{namespace}:{','.join(fieldset)}"
+            shared = recipe_cache.get_many(
+                recipes, self.build_shared, namespace
+            )
+        else:
+            shared = self.build_shared(recipes)
+        return [
+            self.with_user_flags(data, recipe)
+            for data, recipe in zip(shared, recipes)
+        ]
+
+    def build_shared(self, recipes):
+        """Представления рецептов без учёта текущего пользователя."""
+        fields = tuple(self.fields)
+        models.prefetch_related_objects(
+            recipes, *Recipe.objects.related_lookups(fields)
+        )
+        if getattr(settings, 'RECIPE_FAST_SERIALIZER', True):
+            build_url = fast_serializers.make_url_builder(
+                self.context.get('request')
+            )
+            return [
+                fast_serializers.recipe_to_dict(
+                    recipe, build_url, fields=fields
+                )
+                for recipe in recipes
+            ]
+        return self.build_shared_drf(recipes)
+
+    def build_shared_drf(self, recipes):
+        """Те же представления, построенные через поля DRF."""
+        if 'author' in self.fields:
+            for recipe in recipes:
+                recipe.author.is_subscribed = (
+                    self.get_author_is_subscribed(recipe)
+                )
+        return [super(RecipeListSerializer, self).to_representation(recipe)
+                for recipe in recipes]
+
+    def with_user_flags(self, data, recipe):
+        """Копия представления с флагами текущего пользователя."""
+        data = dict(data)
+        if 'is_favorited' in data:
+            data['is_favorited'] = self.get_is_favorited(recipe)
+        if 'is_in_shopping_cart' in data:
+            data['is_in_shopping_cart'] = self.get_is_in_shopping_cart(
+                recipe
+            )
+        if 'author' in data:
+            data['author'] = dict(
+                data['author'],
+                is_subscribed=self.get_author_is_subscribed(recipe)
+            )
+        return data
+
+    def get_author_is_subscribed(self, obj):
+        if hasattr(obj, 'author_is_subscribed'):
+            return obj.author_is_subscribed
+        return self.fields['author'].get_is_subscribed(obj.author)
 
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         user = self.context.get('request').user
         if user.is_anonymous:
             return False
         return Favorite.objects.filter(user=user, recipe=obj).exists()
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         user = self.context.get('request').user
         if user.is_anonymous:
             return False
         return ShoppingCart.objects.filter(user=user, recipe=obj).exists()
 
 
+def sideload_recipes(recipes):
+    """Заменяет авторов и теги в представлениях рецептов ссылками по id.
+
+    Возвращает список рецептов и словарь с картами authors и tags, в
+    которых каждый автор и тег встречается один раз.
+    """
+    authors = {}
+    tags = {}
+    results = []
+    for recipe in recipes:
+        recipe = dict(recipe)
+        if 'author' in recipe:
+            author = recipe['author']
+            authors.setdefault(str(author['id']), author)
+            recipe['author'] = author['id']
+        if 'tags' in recipe:
+            for tag in recipe['tags']:
+                tags.setdefault(str(tag['id']), tag)
+            recipe['tags'] = [tag['id'] for tag in recipe['tags']]
+        results.append(recipe)
+    return results, {'authors': authors, 'tags': tags}
+
+
 class AddIngredientSerializer(serializers.ModelSerializer):
     """Сериализатор для добавления ингредиента при создании рецепта."""
     id = serializers.IntegerField()
@@ -88,10 +213,10 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
     """Сериализатор для создания и обновления рецептов."""
     author = CustomUserSerializer(read_only=True)
     ingredients = AddIngredientSerializer(many=True)
-    tags = serializers.PrimaryKeyRelatedField(
-        queryset=Tag.objects.all(), many=True, required=False
+    tags = serializers.ListField(
+        child=serializers.IntegerField(), required=False
     )
-    image = Base64ImageField(required=True)
+    image = StreamingBase64ImageField(required=True)
 
     class Meta:
         model = Recipe
@@ -106,32 +231,61 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
             'cooking_time',
         )
 
+    @staticmethod
+    def item_errors(value, errors):
+        """Ошибки по позициям списка в формате ListSerializer."""
+        return [errors.get(index, {}) for index in range(len(value))]
+
     def validate_ingredients(self, value):
-        """Валидация ингредиентов."""
+        """Валидация ингредиентов.
+
+        Все id проверяются одним запросом; ошибки возвращаются для
+        каждого неверного элемента списка.
+        """
         if not value:
             raise serializers.ValidationError(
                 'Необходимо добавить хотя бы один ингредиент!'
             )
-        ingredients_list = []
-        for item in value:
-            ingredient = get_object_or_404(Ingredient, id=item['id'])
-            if ingredient in ingredients_list:
-                raise serializers.ValidationError(
-                    'Ингредиенты не должны повторяться!'
-                )
-            if int(item['amount']) < 1:
-                raise serializers.ValidationError(
+        existing = set(
+            Ingredient.objects.filter(
+                id__in={item['id'] for item in value}
+            ).values_list('id', flat=True)
+        )
+        errors = {}
+        seen = set()
+        for index, item in enumerate(value):
+            item_errors = {}
+            if item['id'] not in existing:
+                item_errors['id'] = [
+                    f'Ингредиент с id {item["id"]} не найден.'
+                ]
+            elif item['id'] in seen:
+                item_errors['id'] = ['Ингредиенты не должны повторяться!']
+            if item['amount'] < 1:
+                item_errors['amount'] = [
                     'Количество ингредиента должно быть больше нуля!'
-                )
-            ingredients_list.append(ingredient)
+                ]
+            if item_errors:
+                errors[index] = item_errors
+            seen.add(item['id'])
+        if errors:
+            raise serializers.ValidationError(self.item_errors(value, errors))
         return value
 
     def validate_tags(self, value):
-        """Валидация тегов."""
-        if value and len(value) != len(set(value)):
-            raise serializers.ValidationError(
-                'Теги не должны повторяться!'
-            )
+        """Валидация тегов по справочнику в кэше; к базе — только за
+        тегами, которых в нём нет."""
+        known = set(recipe_cache.get_tag_ids(ids=value).values())
+        errors = {}
+        seen = set()
+        for index, tag_id in enumerate(value):
+            if tag_id not in known:
+                errors[index] = [f'Тег с id {tag_id} не найден.']
+            elif tag_id in seen:
+                errors[index] = ['Теги не должны повторяться!']
+            seen.add(tag_id)
+        if errors:
+            raise serializers.ValidationError(errors)
         return value
 
     def create_update_ingredients(self, ingredients, recipe):
@@ -145,7 +299,59 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
                     amount=item['amount']
                 )
             )
-        RecipeIngredient.objects.bulk_create(ingredient_list)
+        if ingredient_list:
+            RecipeIngredient.objects.bulk_create(ingredient_list)
+
+    def sync_ingredients(self, ingredients, recipe):
+        """Приводит ингредиенты рецепта к списку ingredients.
+
+        Строки не пересоздаются: добавляются новые, у изменившихся
+        обновляется количество, лишние удаляются — не больше одного
+        запроса на каждое действие. Порядок ингредиентов в ответе — порядок
+        id строк, поэтому если в списке изменился порядок оставшихся
+        ингредиентов или новые стоят не в конце, строки пересоздаются.
+        """
+        rows = recipe.recipe_ingredients.order_by('pk').values_list(
+            'pk', 'ingredient_id', 'amount'
+        )
+        current = {
+            ingredient_id: (pk, amount) for pk, ingredient_id, amount in rows
+        }
+        amounts = {item['id']: item['amount'] for item in ingredients}
+        kept = [
+            ingredient_id for ingredient_id in current
+            if ingredient_id in amounts
+        ]
+        if [item['id'] for item in ingredients[:len(kept)]] != kept:
+            delete_returning(RecipeIngredient, recipe_id=recipe.pk)
+            self.create_update_ingredients(ingredients, recipe)
+            shopping_list.refresh_recipe(recipe.pk, {*current, *amounts})
+            return
+        changed = {
+            ingredient_id: RecipeIngredient(
+                pk=pk, amount=amounts[ingredient_id]
+            )
+            for ingredient_id, (pk, amount) in current.items()
+            if ingredient_id in amounts and amounts[ingredient_id] != amount
+        }
+        if changed:
+            RecipeIngredient.objects.bulk_update(
+                changed.values(), ['amount']
+            )
+        removed = {
+            ingredient_id: pk for ingredient_id, (pk, _) in current.items()
+            if ingredient_id not in amounts
+        }
+        if removed:
+            # Без сигналов post_delete: они сдвигали бы updated_at рецепта
+            # по разу на строку, а рецепт и так сохраняется в update().
+            delete_returning(RecipeIngredient, pk__in=removed.values())
+        added = [item for item in ingredients if item['id'] not in current]
+        self.create_update_ingredients(added, recipe)
+        # Сигналов не было: списки покупок пересчитываются явно.
+        shopping_list.refresh_recipe(recipe.pk, [
+            *changed, *removed, *(item['id'] for item in added)
+        ])
 
     @transaction.atomic
     def create(self, validated_data):
@@ -162,9 +368,9 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
     def update(self, instance, validated_data):
         """Обновление рецепта."""
         if 'ingredients' in validated_data:
-            ingredients = validated_data.pop('ingredients')
-            instance.ingredients.clear()
-            self.create_update_ingredients(ingredients, instance)
+            self.sync_ingredients(
+                validated_data.pop('ingredients'), instance
+            )
         if 'tags' in validated_data:
             tags = validated_data.pop('tags')
             instance.tags.set(tags)
@@ -172,6 +378,10 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
 
     def to_representation(self, instance):
         """Представление для возврата после создания/обновления."""
+        user = self.context.get('request').user
+        instance = Recipe.objects.for_representation(user).get(
+            pk=instance.pk
+        )
         return RecipeListSerializer(
             instance, context=self.context
         ).data
@@ -179,12 +389,15 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
 
 class RecipeMinifiedSerializer(serializers.ModelSerializer):
     """Сериализатор для краткого представления рецепта."""
+    image_renditions = ImageRenditionsField('image')
+
     class Meta:
         model = Recipe
         fields = (
             'id',
             'name',
             'image',
+            'image_renditions',
             'cooking_time',
         )
 
@@ -203,3 +416,17 @@ class ShortLinkSerializer(serializers.ModelSerializer):
             domain = request.build_absolute_uri('/').strip('/')
             return f"{domain}/s/{obj.id}"
         return f"/s/{obj.id}"
+
+
+class RecipeIdsSerializer(serializers.Serializer):
+    """Список id рецептов для пакетного добавления в избранное и список
+    покупок и удаления из них."""
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=BATCH_MAX_RECIPES,
+    )
+
+    def validate_recipes(self, value):
+        """Повторы отбрасываются с сохранением порядка."""
+        return list(dict.fromkeys(value))
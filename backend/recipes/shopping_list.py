@@ -0,0 +1,210 @@
+"""Список покупок пользователя.
+
+Суммы ингредиентов по рецептам в корзине хранятся в таблице
+ShoppingListItem (пользователь, ингредиент, количество, число рецептов),
+поэтому выгрузка не соединяет корзину с рецептами и не группирует строки.
+Таблица обновляется в той же транзакции, что и изменение: при добавлении
+и удалении рецепта из корзины и при изменении ингредиентов рецепта
+затронутые пары (пользователь, ингредиент) пересчитываются по исходным
+таблицам (refresh). Расхождения, если они всё же появились, находит и
+исправляет команда rebuild_shopping_lists.
+
+Готовые строки (название, единица измерения, количество) кэшируются для
+каждого пользователя; refresh() сбрасывает записи затронутых
+пользователей. Ключ содержит отметку INGREDIENTS_STAMP, которую сигналы
+сбрасывают при изменении ингредиентов (названия входят в строки).
+Код, меняющий ShoppingCart или RecipeIngredient в обход сигналов
+(bulk_create, сырой SQL), должен вызвать refresh() сам.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from recipes import cache as recipe_cache
+from recipes.models import RecipeIngredient, ShoppingCart, ShoppingListItem
+
+ROWS_KEY = 'shopping-list:{}:{}'
+INGREDIENTS_STAMP = 'shopping-list-ingredients'
+# Пользователей в одной пачке при сверке всей таблицы.
+CHECK_BATCH_SIZE = 500
+
+
+def _key(user_id):
+    token, _ = recipe_cache.get_catalog_stamp(INGREDIENTS_STAMP)
+    return ROWS_KEY.format(token, user_id)
+
+
+def aggregate(user_ids, ingredient_ids=None):
+    """Фактические суммы по корзинам: {(user_id, ingredient_id):
+    (количество, рецептов)}."""
+    rows = RecipeIngredient.objects.filter(
+        recipe__in_shopping_carts__user_id__in=user_ids
+    )
+    if ingredient_ids is not None:
+        rows = rows.filter(ingredient_id__in=ingredient_ids)
+    rows = rows.values_list(
+        'recipe__in_shopping_carts__user_id', 'ingredient_id'
+    ).annotate(
+        total_amount=Sum('amount'), recipe_count=Count('recipe_id')
+    ).order_by()
+    return {
+        (user_id, ingredient_id): (total_amount, recipe_count)
+        for user_id, ingredient_id, total_amount, recipe_count in rows
+    }
+
+
+def stored(user_ids, ingredient_ids=None):
+    """Строки таблицы: {(user_id, ingredient_id): (pk, количество,
+    рецептов)}."""
+    items = ShoppingListItem.objects.filter(user_id__in=user_ids)
+    if ingredient_ids is not None:
+        items = items.filter(ingredient_id__in=ingredient_ids)
+    return {
+        (user_id, ingredient_id): (pk, total_amount, recipe_count)
+        for pk, user_id, ingredient_id, total_amount, recipe_count
+        in items.values_list(
+            'pk', 'user_id', 'ingredient_id', 'total_amount',
+            'recipe_count'
+        )
+    }
+
+
+def sync(user_ids, ingredient_ids=None, check=False):
+    """Сверяет строки пользователей user_ids (и ингредиентов
+    ingredient_ids) с корзинами и, если не check, исправляет таблицу.
+
+    Возвращает расхождения: список (user_id, ingredient_id, сохранено,
+    фактически), где значение — (количество, рецептов) или None, если
+    строки нет.
+    """
+    actual = aggregate(user_ids, ingredient_ids)
+    current = stored(user_ids, ingredient_ids)
+    mismatches = []
+    for key in actual.keys() | current.keys():
+        saved = current[key][1:] if key in current else None
+        if saved != actual.get(key):
+            mismatches.append((*key, saved, actual.get(key)))
+    if check or not mismatches:
+        return mismatches
+    stale = [current[key][0] for key in current.keys() - actual.keys()]
+    if stale:
+        ShoppingListItem.objects.filter(pk__in=stale).delete()
+    ShoppingListItem.objects.bulk_create(
+        [
+            ShoppingListItem(
+                user_id=user_id, ingredient_id=ingredient_id,
+                total_amount=value[0], recipe_count=value[1],
+            )
+            for user_id, ingredient_id, _, value in mismatches
+            if value is not None
+        ],
+        update_conflicts=True,
+        unique_fields=['user', 'ingredient'],
+        update_fields=['total_amount', 'recipe_count'],
+    )
+    return mismatches
+
+
+def refresh(user_ids, ingredient_ids):
+    """Пересчитывает строки пользователей user_ids по ингредиентам
+    ingredient_ids и сбрасывает их кэш после фиксации транзакции."""
+    ingredient_ids = set(ingredient_ids)
+    if not ingredient_ids:
+        return
+    user_ids = set(user_ids)
+    if not user_ids:
+        return
+    # Без точки сохранения: ошибка откатывает и само изменение корзины
+    # или рецепта, таблица не расходится с ними.
+    with transaction.atomic(savepoint=False):
+        sync(user_ids, ingredient_ids)
+    invalidate(user_ids)
+
+
+def refresh_cart(user_id, recipe_ids):
+    """Пересчёт после добавления или удаления рецептов из корзины."""
+    recipe_ids = list(recipe_ids)
+    if not recipe_ids:
+        return
+    refresh(
+        [user_id],
+        RecipeIngredient.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values_list('ingredient_id', flat=True).distinct()
+    )
+
+
+def refresh_recipe(recipe_id, ingredient_ids):
+    """Пересчёт после изменения ингредиентов ingredient_ids рецепта
+    у всех, у кого он в корзине."""
+    refresh(
+        ShoppingCart.objects.filter(recipe_id=recipe_id).values_list(
+            'user_id', flat=True
+        ),
+        ingredient_ids
+    )
+
+
+def _user_batches(batch_size=CHECK_BATCH_SIZE):
+    user_ids = sorted({
+        *ShoppingCart.objects.values_list('user_id', flat=True).distinct(),
+        *ShoppingListItem.objects.values_list(
+            'user_id', flat=True
+        ).distinct(),
+    })
+    for start in range(0, len(user_ids), batch_size):
+        yield user_ids[start:start + batch_size]
+
+
+def find_mismatches():
+    """Расхождения всей таблицы с корзинами (см. sync)."""
+    mismatches = []
+    for user_ids in _user_batches():
+        mismatches.extend(sync(user_ids, check=True))
+    return mismatches
+
+
+def rebuild():
+    """Исправляет расхождения всей таблицы с корзинами, по пачке
+    пользователей в транзакции. Возвращает исправленные расхождения."""
+    mismatches = []
+    for user_ids in _user_batches():
+        with transaction.atomic():
+            fixed = sync(user_ids)
+        invalidate({user_id for user_id, *_ in fixed})
+        mismatches.extend(fixed)
+    return mismatches
+
+
+def get_rows(user):
+    """Строки списка покупок пользователя, по возможности из кэша."""
+    key = _key(user.pk)
+    rows = cache.get(key)
+    if rows is None:
+        rows = list(
+            ShoppingListItem.objects.filter(user=user).values_list(
+                'ingredient__name', 'ingredient__measurement_unit',
+                'total_amount'
+            ).order_by('ingredient__name')
+        )
+        cache.set(
+            key, rows,
+            timeout=getattr(settings, 'RECIPE_CACHE_TIMEOUT', 3600)
+        )
+    return rows
+
+
+def invalidate(user_ids):
+    """Сбрасывает кэш списков пользователей после фиксации транзакции."""
+    user_ids = set(user_ids)
+    if user_ids:
+        transaction.on_commit(
+            lambda: cache.delete_many([_key(pk) for pk in user_ids])
+        )
+
+
+def touch_ingredients():
+    """Сбрасывает кэш списков всех пользователей после изменения
+    ингредиентов."""
+    recipe_cache.touch_catalog(INGREDIENTS_STAMP)
@@ -0,0 +1,192 @@
+from django.db.models.signals import (
+    m2m_changed, post_delete, post_save, pre_delete, pre_save
+)
+from django.dispatch import receiver
+from django.utils import timezone
+
+from api import images
+from recipes import cache as recipe_cache
+from recipes import catalog_snapshots, counters, shopping_list
+from recipes.models import (
+    CounterDelta, Favorite, Ingredient, Recipe, RecipeIngredient,
+    ShoppingCart, Tag
+)
+from users.models import Subscription, User
+
+# Счётчики рецепта, которые меняют строки избранного и списка покупок.
+RECIPE_COUNTERS = {
+    Favorite: CounterDelta.RECIPE_FAVORITES,
+    ShoppingCart: CounterDelta.RECIPE_IN_CARTS,
+}
+
+# Поля пользователя, которые попадают в представление автора рецепта.
+AUTHOR_FIELDS = frozenset((
+    'email', 'username', 'first_name', 'last_name', 'avatar',
+    'avatar_renditions',
+))
+
+
+def touch_recipes(recipe_ids):
+    """Отмечает рецепты изменёнными: сдвигает updated_at и сбрасывает
+    их записи в кэше представлений."""
+    recipe_ids = set(recipe_ids)
+    if not recipe_ids:
+        return
+    Recipe.objects.filter(pk__in=recipe_ids).update(
+        updated_at=timezone.now()
+    )
+    recipe_cache.invalidate(recipe_ids)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_changed(sender, instance, **kwargs):
+    recipe_cache.invalidate([instance.pk])
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    recipe_cache.invalidate([instance.pk])
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_created_count(sender, instance, created, **kwargs):
+    if created:
+        counters.add(CounterDelta.USER_RECIPES, [instance.author_id])
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted_count(sender, instance, **kwargs):
+    counters.add(CounterDelta.USER_RECIPES, [instance.author_id], -1)
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+def recipe_marked(sender, instance, created, **kwargs):
+    if created:
+        counters.add(RECIPE_COUNTERS[sender], [instance.recipe_id])
+        recipe_cache.touch_user_state([instance.user_id])
+
+
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=ShoppingCart)
+def recipe_unmarked(sender, instance, **kwargs):
+    counters.add(RECIPE_COUNTERS[sender], [instance.recipe_id], -1)
+    recipe_cache.touch_user_state([instance.user_id])
+
+
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+def subscription_changed(sender, instance, **kwargs):
+    recipe_cache.touch_user_state([instance.user_id])
+
+
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeIngredient)
+def recipe_ingredient_changed(sender, instance, **kwargs):
+    touch_recipes([instance.recipe_id])
+    shopping_list.refresh_recipe(
+        instance.recipe_id, [instance.ingredient_id]
+    )
+
+
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_delete, sender=ShoppingCart)
+def cart_changed(sender, instance, **kwargs):
+    shopping_list.refresh_cart(instance.user_id, [instance.recipe_id])
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action.startswith('post_'):
+            touch_recipes([instance.pk])
+    elif action == 'pre_clear':
+        touch_recipes(instance.recipes.values_list('id', flat=True))
+    elif action in ('post_add', 'post_remove'):
+        touch_recipes(pk_set)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(pre_delete, sender=Tag)
+def tag_changed(sender, instance, **kwargs):
+    recipe_cache.touch_catalog('tags')
+    catalog_snapshots.refresh_files('tags')
+    touch_recipes(
+        Recipe.objects.filter(tags=instance).values_list('id', flat=True)
+    )
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def ingredient_changed(sender, instance, created=False, **kwargs):
+    recipe_cache.touch_catalog('ingredients')
+    catalog_snapshots.refresh_files('ingredients')
+    if created:
+        return
+    shopping_list.touch_ingredients()
+    touch_recipes(
+        Recipe.objects.filter(
+            ingredients=instance
+        ).values_list('id', flat=True)
+    )
+
+
+def get_author_state(user):
+    return {name: getattr(user, name) for name in AUTHOR_FIELDS}
+
+
+@receiver(pre_save, sender=User)
+def author_saving(sender, instance, update_fields, **kwargs):
+    """Запоминает поля автора перед сохранением без update_fields, чтобы
+    не трогать рецепты, если они не изменились (например, пароль)."""
+    if instance._state.adding or update_fields is not None:
+        return
+    instance._author_state = User.objects.filter(pk=instance.pk).values(
+        *AUTHOR_FIELDS
+    ).first()
+
+
+@receiver(post_save, sender=User)
+def author_changed(sender, instance, created, update_fields, **kwargs):
+    previous = instance.__dict__.pop('_author_state', None)
+    if created:
+        return
+    if update_fields is not None and not AUTHOR_FIELDS & update_fields:
+        return
+    if previous is not None and get_author_state(instance) == previous:
+        return
+    touch_recipes(instance.recipes.values_list('id', flat=True))
+
+
+def build_recipe_image(recipe_id):
+    if images.update_renditions(Recipe, recipe_id, 'image'):
+        touch_recipes([recipe_id])
+
+
+def build_avatar(user_id):
+    if images.update_renditions(User, user_id, 'avatar'):
+        touch_recipes(
+            Recipe.objects.filter(author_id=user_id).values_list(
+                'id', flat=True
+            )
+        )
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_image_saved(sender, instance, update_fields, **kwargs):
+    if update_fields is not None and 'image' not in update_fields:
+        return
+    if instance.image and not images.is_ready(
+        instance.image, instance.image_renditions
+    ):
+        images.schedule(build_recipe_image, instance.pk)
+
+
+@receiver(post_save, sender=User)
+def avatar_saved(sender, instance, update_fields, **kwargs):
+    if update_fields is not None and 'avatar' not in update_fields:
+        return
+    if instance.avatar and not images.is_ready(
+        instance.avatar, instance.avatar_renditions
+    ):
+        images.schedule(build_avatar, instance.pk)
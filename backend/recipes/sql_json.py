@@ -0,0 +1,156 @@
+"""Сборка страниц рецептов в JSON средствами PostgreSQL.
+
+Для страницы id рецептов один запрос с json_build_object/json_agg
+возвращает готовый JSON-массив в том же виде, что RecipeListSerializer,
+включая флаги текущего пользователя. Django передаёт его клиенту без
+разбора и повторной сериализации.
+
+Путь включается настройкой RECIPE_SQL_JSON и работает только на
+PostgreSQL; на остальных базах используется обычный сериализатор.
+Ссылки на файлы собираются конкатенацией MEDIA_URL и имени файла, поэтому
+имена должны быть безопасны для URL (api.storage даёт файлам имена из
+хэша содержимого).
+"""
+from django.conf import settings
+from django.db import connection
+
+from api import images
+from recipes.models import (
+    Favorite, Ingredient, Recipe, RecipeIngredient, ShoppingCart, Tag
+)
+from recipes.serializers.fast_serializers import RECIPE_FIELDS
+from users.models import Subscription, User
+
+
+def is_enabled():
+    return (
+        getattr(settings, 'RECIPE_SQL_JSON', False)
+        and connection.vendor == 'postgresql'
+    )
+
+
+def _file_url(column):
+    return (
+        f"CASE WHEN {column} IS NULL OR {column} = '' THEN NULL "
+        f"ELSE %(media_url)s::text || {column} END"
+    )
+
+
+def _renditions(column):
+    """Ссылки на версии изображения, как api.images.rendition_urls."""
+    renditions = f'{column}_renditions'
+    ready = ', '.join(
+        f"'{name}', %(media_url)s::text || ({renditions} ->> '{name}')"
+        for name in images.RENDITIONS
+    )
+    pending = ', '.join(
+        f"'{name}', %(media_url)s::text || {column}"
+        for name in images.RENDITIONS
+    )
+    return (
+        f"CASE WHEN {column} IS NULL OR {column} = '' THEN NULL "
+        f"WHEN {renditions} ->> 'source' = {column} "
+        f"THEN json_build_object({ready}) "
+        f"ELSE json_build_object({pending}) END"
+    )
+
+
+def _recipe_pairs(tables):
+    """Выражения для ключей представления в порядке полей сериализатора."""
+    return {
+        'id': 'r.id',
+        'author': f'''json_build_object(
+                'email', u.email,
+                'id', u.id,
+                'username', u.username,
+                'first_name', u.first_name,
+                'last_name', u.last_name,
+                'is_subscribed', EXISTS(
+                    SELECT 1 FROM {tables['subscription']} s
+                    WHERE s.author_id = u.id
+                        AND s.user_id = %(user_id)s::bigint
+                ),
+                'avatar', {_file_url('u.avatar')},
+                'avatar_renditions', {_renditions('u.avatar')}
+            )''',
+        'ingredients': f'''COALESCE((
+                SELECT json_agg(json_build_object(
+                    'id', i.id,
+                    'name', i.name,
+                    'measurement_unit', i.measurement_unit,
+                    'amount', ri.amount
+                ) ORDER BY ri.id)
+                FROM {tables['recipe_ingredient']} ri
+                JOIN {tables['ingredient']} i ON i.id = ri.ingredient_id
+                WHERE ri.recipe_id = r.id
+            ), '[]')''',
+        'is_favorited': f'''EXISTS(
+                SELECT 1 FROM {tables['favorite']} f
+                WHERE f.recipe_id = r.id AND f.user_id = %(user_id)s::bigint
+            )''',
+        'is_in_shopping_cart': f'''EXISTS(
+                SELECT 1 FROM {tables['cart']} c
+                WHERE c.recipe_id = r.id AND c.user_id = %(user_id)s::bigint
+            )''',
+        'name': 'r.name',
+        'image': _file_url('r.image'),
+        'image_renditions': _renditions('r.image'),
+        'text': 'r.text',
+        'cooking_time': 'r.cooking_time',
+        'tags': f'''COALESCE((
+                SELECT json_agg(json_build_object(
+                    'id', t.id,
+                    'name', t.name,
+                    'color', t.color,
+                    'slug', t.slug
+                ) ORDER BY t.name)
+                FROM {tables['recipe_tag']} rt
+                JOIN {tables['tag']} t ON t.id = rt.tag_id
+                WHERE rt.recipe_id = r.id
+            ), '[]')''',
+    }
+
+
+def _build_query(fields):
+    tables = {
+        'recipe': Recipe._meta.db_table,
+        'user': User._meta.db_table,
+        'ingredient': Ingredient._meta.db_table,
+        'recipe_ingredient': RecipeIngredient._meta.db_table,
+        'tag': Tag._meta.db_table,
+        'recipe_tag': Recipe.tags.through._meta.db_table,
+        'favorite': Favorite._meta.db_table,
+        'cart': ShoppingCart._meta.db_table,
+        'subscription': Subscription._meta.db_table,
+    }
+    pairs = _recipe_pairs(tables)
+    item = ',\n            '.join(
+        f"'{name}', {pairs[name]}" for name in fields
+    )
+    return f'''
+        SELECT COALESCE(json_agg(item ORDER BY page.position), '[]')::text
+        FROM unnest(%(ids)s::bigint[]) WITH ORDINALITY
+            AS page(id, position)
+        JOIN {tables['recipe']} r ON r.id = page.id
+        JOIN {tables['user']} u ON u.id = r.author_id
+        CROSS JOIN LATERAL (SELECT json_build_object(
+            {item}
+        ) AS item) AS recipe_json
+    '''
+
+
+def render_recipes(recipe_ids, request, fields=RECIPE_FIELDS):
+    """JSON-массив представлений рецептов в порядке recipe_ids.
+
+    fields — ключи представления, как у RecipeListSerializer с учётом
+    ?fields= и ?omit=.
+    """
+    user = request.user
+    params = {
+        'ids': list(recipe_ids),
+        'user_id': user.pk if user.is_authenticated else None,
+        'media_url': request.build_absolute_uri(settings.MEDIA_URL),
+    }
+    with connection.cursor() as cursor:
+        cursor.execute(_build_query(fields), params)
+        return cursor.fetchone()[0]
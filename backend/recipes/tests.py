@@ -0,0 +1,1632 @@
+import csv
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.http import http_date
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api import images
+from recipes import cache as recipe_cache
+from recipes import catalog_snapshots
+from recipes import counters
+from recipes import ingredient_import
+from recipes import shopping_list
+from recipes.serializers.recipe_serializers import (
+    RecipeCreateUpdateSerializer
+)
+from recipes.models import (
+    CounterDelta, Favorite, Ingredient, IngredientImport, Recipe,
+    RecipeIngredient, ShoppingCart, ShoppingListItem, Tag
+)
+from users.models import Subscription, User
+
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, IMAGE_RENDITIONS_ASYNC=False)
+class RecipeAPITestCase(TestCase):
+    """Общие данные для тестов API рецептов."""
+    # Состояние для ETag берётся из кэша, слаги тегов для фильтра tags —
+    # тоже. Ответ: COUNT, рецепты с автором, теги, ингредиенты.
+    LIST_QUERIES = 4
+    # Состояние рецепта для ETag, рецепт с автором, теги, ингредиенты.
+    DETAIL_QUERIES = 4
+    # Поиск токена в TokenAuthentication.
+    AUTH_QUERIES = 1
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com',
+            first_name='Читатель', last_name='Тестовый', password='pass',
+        )
+        cls.token = Token.objects.create(user=cls.user)
+        tags = [
+            Tag.objects.create(
+                name=f'Тег {i}', color=f'#00000{i}', slug=f'tag{i}'
+            )
+            for i in range(3)
+        ]
+        ingredients = [
+            Ingredient.objects.create(name=f'ингредиент {i}',
+                                      measurement_unit='г')
+            for i in range(5)
+        ]
+        for i in range(10):
+            author = User.objects.create_user(
+                username=f'author{i}', email=f'author{i}@example.com',
+                first_name='Автор', last_name=str(i), password='pass',
+                avatar=f'users/avatar{i}.png' if i % 2 else None,
+            )
+            recipe = Recipe.objects.create(
+                author=author, name=f'Рецепт {i}', text='Описание',
+                cooking_time=10 + i, image=f'recipes/images/r{i}.png',
+            )
+            recipe.tags.set(tags)
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(
+                    recipe=recipe, ingredient=ingredient, amount=i + 1
+                )
+                for ingredient in ingredients
+            )
+            if i % 2:
+                Favorite.objects.create(user=cls.user, recipe=recipe)
+                Subscription.objects.create(user=cls.user, author=author)
+            if i % 3:
+                ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+        cls.recipe = recipe
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        self.anon = APIClient()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token}')
+
+
+class RecipeQueryBudgetTests(RecipeAPITestCase):
+    """Число запросов к /api/recipes/ не зависит от размера страницы.
+
+    Бюджет покрывает всё, что читает RecipeListSerializer, и считается
+    при пустом кэше представлений. Если новое поле начнёт загружать
+    данные построчно, тесты упадут.
+    """
+
+    def test_list_query_budget_anonymous(self):
+        for limit in (1, 10):
+            cache.clear()
+            with self.assertNumQueries(self.LIST_QUERIES):
+                response = self.anon.get('/api/recipes/', {'limit': limit})
+            self.assertEqual(len(response.data['results']), limit)
+
+    def test_list_query_budget_authenticated(self):
+        for limit in (1, 10):
+            cache.clear()
+            with self.assertNumQueries(
+                self.LIST_QUERIES + self.AUTH_QUERIES
+            ):
+                response = self.client.get(
+                    '/api/recipes/', {'limit': limit}
+                )
+            self.assertEqual(len(response.data['results']), limit)
+
+    def test_detail_query_budget(self):
+        url = f'/api/recipes/{self.recipe.id}/'
+        with self.assertNumQueries(self.DETAIL_QUERIES):
+            self.anon.get(url)
+        cache.clear()
+        with self.assertNumQueries(self.DETAIL_QUERIES + self.AUTH_QUERIES):
+            self.client.get(url)
+
+    def test_flags_match_user_state(self):
+        response = self.client.get('/api/recipes/', {'limit': 10})
+        for item in response.data['results']:
+            recipe = Recipe.objects.get(id=item['id'])
+            self.assertEqual(
+                item['is_favorited'],
+                Favorite.objects.filter(
+                    user=self.user, recipe=recipe
+                ).exists()
+            )
+            self.assertEqual(
+                item['is_in_shopping_cart'],
+                ShoppingCart.objects.filter(
+                    user=self.user, recipe=recipe
+                ).exists()
+            )
+            self.assertEqual(
+                item['author']['is_subscribed'],
+                Subscription.objects.filter(
+                    user=self.user, author=recipe.author
+                ).exists()
+            )
+            self.assertEqual(len(item['ingredients']), 5)
+            self.assertEqual(len(item['tags']), 3)
+
+    def test_anonymous_flags_are_false(self):
+        response = self.anon.get('/api/recipes/', {'limit': 10})
+        for item in response.data['results']:
+            self.assertFalse(item['is_favorited'])
+            self.assertFalse(item['is_in_shopping_cart'])
+            self.assertFalse(item['author']['is_subscribed'])
+
+
+class RecipeCursorPaginationTests(RecipeAPITestCase):
+    """Курсорный режим ленты рецептов."""
+
+    def test_default_mode_is_page_number(self):
+        response = self.anon.get('/api/recipes/')
+        self.assertEqual(response.data['count'], 10)
+
+    def test_cursor_walk_matches_page_order(self):
+        expected = [
+            item['id'] for item in self.anon.get(
+                '/api/recipes/', {'limit': 10}
+            ).data['results']
+        ]
+        seen = []
+        url = '/api/recipes/?pagination=cursor&limit=3'
+        while url:
+            cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                response = self.anon.get(url)
+            # Без COUNT: рецепты с автором, теги, ингредиенты.
+            self.assertEqual(len(queries), self.LIST_QUERIES - 1)
+            for query in queries:
+                self.assertNotIn('COUNT(', query['sql'])
+                self.assertNotIn('MAX(', query['sql'])
+            self.assertNotIn('count', response.data)
+            seen.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(seen, expected)
+
+    def test_cursor_walk_with_equal_pub_dates(self):
+        Recipe.objects.update(pub_date=self.recipe.pub_date)
+        expected = list(
+            Recipe.objects.order_by('-id').values_list('id', flat=True)
+        )
+        pages = []
+        url = '/api/recipes/?pagination=cursor&limit=3'
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.anon.get(url)
+            for query in queries:
+                self.assertNotIn('OFFSET', query['sql'])
+            pages.append(response.data)
+            url = response.data['next']
+        self.assertEqual(
+            [item['id'] for page in pages for item in page['results']],
+            expected
+        )
+        self.assertEqual(len(pages), 4)
+        response = self.anon.get(pages[-1]['previous'])
+        self.assertEqual(
+            [item['id'] for item in response.data['results']],
+            [item['id'] for item in pages[-2]['results']]
+        )
+        self.assertEqual(
+            self.anon.get('/api/recipes/?cursor=cD0x').status_code, 404
+        )
+
+
+class RecipeRepresentationCacheTests(RecipeAPITestCase):
+    """Кэш общей части представления рецептов."""
+
+    def test_repeated_page_skips_prefetch(self):
+        self.anon.get('/api/recipes/', {'limit': 10})
+        recipe_cache.reset_stats()
+        with self.assertNumQueries(self.LIST_QUERIES - 2):
+            cached = self.anon.get('/api/recipes/', {'limit': 10})
+        stats = recipe_cache.get_stats()
+        self.assertEqual((stats['hits'], stats['misses']), (10, 0))
+        cache.clear()
+        self.assertEqual(
+            cached.data, self.anon.get('/api/recipes/', {'limit': 10}).data
+        )
+
+    def test_user_flags_are_not_shared(self):
+        self.anon.get('/api/recipes/', {'limit': 10})
+        response = self.client.get('/api/recipes/', {'limit': 10})
+        self.assertTrue(
+            any(item['is_favorited'] for item in response.data['results'])
+        )
+        self.assertTrue(any(
+            item['author']['is_subscribed']
+            for item in response.data['results']
+        ))
+        anon_response = self.anon.get('/api/recipes/', {'limit': 10})
+        self.assertFalse(any(
+            item['is_favorited'] or item['author']['is_subscribed']
+            for item in anon_response.data['results']
+        ))
+
+    def test_ingredient_change_invalidates_entry(self):
+        url = f'/api/recipes/{self.recipe.id}/'
+        self.anon.get(url)
+        item = self.recipe.recipe_ingredients.first()
+        item.amount = 999
+        with self.captureOnCommitCallbacks(execute=True):
+            item.save()
+        amounts = [
+            ingredient['amount']
+            for ingredient in self.anon.get(url).data['ingredients']
+        ]
+        self.assertIn(999, amounts)
+
+    def test_author_change_invalidates_entry(self):
+        url = f'/api/recipes/{self.recipe.id}/'
+        self.anon.get(url)
+        author = self.recipe.author
+        author.first_name = 'Переименован'
+        with self.captureOnCommitCallbacks(execute=True):
+            author.save(update_fields=['first_name'])
+        self.assertEqual(
+            self.anon.get(url).data['author']['first_name'], 'Переименован'
+        )
+
+    def test_author_full_save_touches_recipes_on_change_only(self):
+        author = self.recipe.author
+        updated_at = Recipe.objects.get(pk=self.recipe.pk).updated_at
+        author.set_password('новый пароль')
+        with self.captureOnCommitCallbacks(execute=True):
+            author.save()
+        self.assertEqual(
+            Recipe.objects.get(pk=self.recipe.pk).updated_at, updated_at
+        )
+        author.last_name = 'Переименован'
+        with self.captureOnCommitCallbacks(execute=True):
+            author.save()
+        self.assertGreater(
+            Recipe.objects.get(pk=self.recipe.pk).updated_at, updated_at
+        )
+
+    def test_tag_change_invalidates_entry(self):
+        url = f'/api/recipes/{self.recipe.id}/'
+        self.anon.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipe.tags.clear()
+        self.assertEqual(self.anon.get(url).data['tags'], [])
+
+
+class ConditionalGetTests(RecipeAPITestCase):
+    """ETag и Last-Modified для рецептов, тегов и ингредиентов."""
+
+    def assertNotModified(self, client, url, **headers):
+        response = client.get(url, **headers)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_recipe_list_etag(self):
+        url = '/api/recipes/?limit=3'
+        response = self.client.get(url)
+        etag = response['ETag']
+        with self.assertNumQueries(self.AUTH_QUERIES):
+            self.assertNotModified(
+                self.client, url, HTTP_IF_NONE_MATCH=etag
+            )
+        with self.captureOnCommitCallbacks(execute=True):
+            Favorite.objects.filter(user=self.user).first().delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                f'/api/recipes/{self.recipe.id}/shopping_cart/'
+            )
+        self.assertEqual(
+            self.client.get(
+                url, HTTP_IF_NONE_MATCH=response['ETag']
+            ).status_code,
+            200
+        )
+
+    def test_recipe_list_etag_moves_with_recipes(self):
+        url = '/api/recipes/?limit=3'
+        etag = self.anon.get(url)['ETag']
+        self.assertNotModified(self.anon, url, HTTP_IF_NONE_MATCH=etag)
+        recipes = Recipe.objects.filter(name='Рецепт 9')
+        recipes.update(image='')
+        with self.captureOnCommitCallbacks(execute=True):
+            recipes.delete()
+        response = self.anon.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipe.save()
+        self.assertEqual(
+            self.anon.get(
+                url, HTTP_IF_NONE_MATCH=response['ETag']
+            ).status_code,
+            200
+        )
+
+    def test_recipe_list_etag_depends_on_user_and_query(self):
+        etag = self.client.get('/api/recipes/')['ETag']
+        self.assertNotEqual(etag, self.anon.get('/api/recipes/')['ETag'])
+        self.assertNotEqual(
+            etag, self.client.get('/api/recipes/?limit=3')['ETag']
+        )
+
+    def test_filtered_list_without_last_modified(self):
+        tag = self.recipe.tags.first()
+        url = f'/api/recipes/?tags={tag.slug}'
+        self.assertIn('Last-Modified', self.anon.get('/api/recipes/'))
+        response = self.anon.get(url)
+        self.assertNotIn('Last-Modified', response)
+        count = response.json()['count']
+        self.recipe.tags.remove(tag)
+        response = self.anon.get(
+            url, HTTP_IF_MODIFIED_SINCE=http_date(time.time())
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], count - 1)
+
+    def test_recipe_detail_moves_with_ingredients(self):
+        url = f'/api/recipes/{self.recipe.id}/'
+        response = self.anon.get(url)
+        self.assertIn('Last-Modified', response)
+        self.assertNotModified(
+            self.anon, url, HTTP_IF_NONE_MATCH=response['ETag']
+        )
+        self.assertNotModified(
+            self.anon, url,
+            HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+        )
+        updated_at = Recipe.objects.get(pk=self.recipe.pk).updated_at
+        item = self.recipe.recipe_ingredients.first()
+        item.amount += 1
+        item.save()
+        self.assertGreater(
+            Recipe.objects.get(pk=self.recipe.pk).updated_at, updated_at
+        )
+        self.assertEqual(
+            self.anon.get(
+                url, HTTP_IF_NONE_MATCH=response['ETag']
+            ).status_code,
+            200
+        )
+
+    def test_recipe_detail_without_last_modified_for_users(self):
+        response = self.client.get(f'/api/recipes/{self.recipe.id}/')
+        self.assertIn('ETag', response)
+        self.assertNotIn('Last-Modified', response)
+
+    def test_missing_recipe_is_404(self):
+        self.assertEqual(self.anon.get('/api/recipes/0/').status_code, 404)
+        self.assertEqual(
+            self.anon.get('/api/recipes/abc/').status_code, 404
+        )
+
+    def test_catalog_etag(self):
+        for url in ('/api/tags/', '/api/ingredients/?name=ингр'):
+            response = self.anon.get(url)
+            with self.assertNumQueries(0):
+                self.assertNotModified(
+                    self.anon, url, HTTP_IF_NONE_MATCH=response['ETag']
+                )
+        etag = self.anon.get('/api/tags/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Tag.objects.create(name='Новый', color='#FFFFFF', slug='new')
+        self.assertNotEqual(etag, self.anon.get('/api/tags/')['ETag'])
+
+
+@override_settings(RECIPE_CACHE_ENABLED=False)
+class FastSerializerParityTests(RecipeAPITestCase):
+    """Быстрый сериализатор выдаёт те же байты, что и сериализаторы DRF."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        author = User.objects.create_user(
+            username='edge', email='edge@example.com',
+            first_name='Ёлка "Ель"', last_name='<b>', password='pass',
+            avatar='users/аватар с пробелом.png',
+        )
+        Recipe.objects.create(
+            author=author, name='Без тегов и ингредиентов',
+            text='Строка\nс переводом и "кавычками" \u2014 ✓',
+            cooking_time=1, image='recipes/images/имя файла%.png',
+        )
+
+    def assertSameContent(self, client, url):
+        fast = client.get(url)
+        with override_settings(RECIPE_FAST_SERIALIZER=False):
+            drf = client.get(url)
+        self.assertEqual(fast.status_code, 200)
+        self.assertEqual(fast.content, drf.content)
+
+    def test_list_parity(self):
+        for client in (self.anon, self.client):
+            self.assertSameContent(client, '/api/recipes/?limit=20')
+
+    def test_detail_parity(self):
+        for recipe in Recipe.objects.all():
+            for client in (self.anon, self.client):
+                self.assertSameContent(client, f'/api/recipes/{recipe.id}/')
+
+    def test_create_response_parity(self):
+        ingredient = Ingredient.objects.first()
+        payload = {
+            'ingredients': [{'id': ingredient.id, 'amount': 5}],
+            'tags': list(Tag.objects.values_list('id', flat=True)),
+            'image': (
+                'data:image/gif;base64,R0lGODlhAQABAIAAAP///wAAACH5BAEAAAAA'
+                'LAAAAAABAAEAAAIBRAA7'
+            ),
+            'name': 'Новый', 'text': 'Текст', 'cooking_time': 3,
+        }
+        fast = self.client.post('/api/recipes/', payload, format='json')
+        self.assertEqual(fast.status_code, 201)
+        recipe = Recipe.objects.get(pk=fast.data['id'])
+        with override_settings(RECIPE_FAST_SERIALIZER=False):
+            drf = self.client.get(f'/api/recipes/{recipe.id}/')
+        self.assertEqual(fast.data, drf.data)
+
+
+@override_settings(RECIPE_CACHE_ENABLED=False)
+class SqlJsonListTests(RecipeAPITestCase):
+    """Страницы, собранные в PostgreSQL, совпадают с ответом DRF."""
+
+    def get_pairs(self, client, url):
+        response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content, object_pairs_hook=list)
+
+    def assertSamePage(self, url):
+        for client in (self.anon, self.client):
+            with override_settings(RECIPE_SQL_JSON=True):
+                sql = self.get_pairs(client, url)
+            self.assertEqual(sql, self.get_pairs(client, url))
+
+    @unittest.skipUnless(
+        connection.vendor == 'postgresql', 'нужен PostgreSQL'
+    )
+    def test_page_parity(self):
+        self.assertSamePage('/api/recipes/?limit=4&page=2')
+        self.assertSamePage('/api/recipes/?limit=3&pagination=cursor')
+        self.assertSamePage('/api/recipes/?tags=tag1&is_favorited=true')
+
+    @unittest.skipUnless(
+        connection.vendor == 'postgresql', 'нужен PostgreSQL'
+    )
+    def test_page_query_budget(self):
+        with override_settings(RECIPE_SQL_JSON=True):
+            for limit in (1, 10):
+                # COUNT, id страницы, JSON страницы.
+                with self.assertNumQueries(3):
+                    self.anon.get('/api/recipes/', {'limit': limit})
+
+    def test_other_databases_use_serializer(self):
+        self.assertSamePage('/api/recipes/?limit=4&page=2')
+
+
+class SparseFieldsetTests(RecipeAPITestCase):
+    """?fields= и ?omit= сужают ответ и не загружают лишние связи."""
+
+    CARD_FIELDS = [
+        'id', 'is_favorited', 'is_in_shopping_cart', 'name', 'image',
+        'cooking_time',
+    ]
+
+    def test_fields_keep_declared_order(self):
+        response = self.client.get(
+            '/api/recipes/', {'fields': 'cooking_time,image,name,id,'
+                              'is_favorited,is_in_shopping_cart,unknown'}
+        )
+        for item in response.data['results']:
+            self.assertEqual(list(item), self.CARD_FIELDS)
+
+    def test_omit(self):
+        response = self.anon.get(
+            f'/api/recipes/{self.recipe.id}/', {'omit': 'text,ingredients'}
+        )
+        self.assertNotIn('text', response.data)
+        self.assertNotIn('ingredients', response.data)
+        self.assertEqual(len(response.data['tags']), 3)
+
+    def test_omitted_relations_are_not_loaded(self):
+        for limit in (1, 10):
+            cache.clear()
+            # Без тегов, ингредиентов и автора: минус два prefetch.
+            with self.assertNumQueries(self.LIST_QUERIES - 2):
+                self.anon.get('/api/recipes/', {
+                    'limit': limit, 'fields': ','.join(self.CARD_FIELDS)
+                })
+
+    def test_cache_entries_per_fieldset(self):
+        full = self.client.get('/api/recipes/').data['results']
+        card = self.client.get(
+            '/api/recipes/', {'fields': ','.join(self.CARD_FIELDS)}
+        ).data['results']
+        self.assertEqual(
+            card,
+            [{name: item[name] for name in self.CARD_FIELDS}
+             for item in full]
+        )
+        self.assertEqual(self.client.get('/api/recipes/').data['results'],
+                         full)
+
+    @override_settings(RECIPE_CACHE_ENABLED=False)
+    def test_fast_serializer_parity(self):
+        params = {'omit': 'text,author', 'limit': 20}
+        fast = self.client.get('/api/recipes/', params)
+        with override_settings(RECIPE_FAST_SERIALIZER=False):
+            drf = self.client.get('/api/recipes/', params)
+        self.assertEqual(fast.content, drf.content)
+
+    def test_write_requests_ignore_fieldset(self):
+        self.client.force_authenticate(self.recipe.author)
+        response = self.client.patch(
+            f'/api/recipes/{self.recipe.id}/?fields=id',
+            {'cooking_time': 7}, format='json'
+        )
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertIn('ingredients', response.data)
+
+
+class SideloadTests(RecipeAPITestCase):
+    """Нормализованный формат списка рецептов (?sideload=true)."""
+
+    def test_single_author_page(self):
+        author = self.recipe.author
+        response = self.client.get(
+            '/api/recipes/', {'author': author.id, 'sideload': 'true'}
+        )
+        self.assertEqual(list(response.data['authors']), [str(author.id)])
+        self.assertEqual(len(response.data['tags']), 3)
+        self.assertEqual(response.data['results'][0]['author'], author.id)
+
+    def test_denormalizes_to_regular_response(self):
+        params = {'limit': 10}
+        regular = self.client.get('/api/recipes/', params)
+        sideloaded = self.client.get(
+            '/api/recipes/', dict(params, sideload='true')
+        )
+        authors = sideloaded.data['authors']
+        tags = sideloaded.data['tags']
+        restored = [
+            dict(
+                item, author=authors[str(item['author'])],
+                tags=[tags[str(pk)] for pk in item['tags']]
+            )
+            for item in sideloaded.data['results']
+        ]
+        self.assertEqual(restored, regular.data['results'])
+        self.assertEqual(sideloaded.data['count'], regular.data['count'])
+        self.assertLess(len(sideloaded.content), len(regular.content))
+
+
+class PopularityCounterTests(RecipeAPITestCase):
+    """Счётчики избранного, списка покупок и рецептов автора."""
+
+    def setUp(self):
+        super().setUp()
+        counters.flush()
+
+    def test_counters_after_flush(self):
+        self.recipe.refresh_from_db()
+        # Последний рецепт фикстуры в избранном, но не в списке покупок.
+        self.assertEqual(self.recipe.favorites_count, 1)
+        self.assertEqual(self.recipe.in_carts_count, 0)
+        self.recipe.author.refresh_from_db()
+        self.assertEqual(self.recipe.author.recipes_count, 1)
+        self.assertEqual(counters.find_mismatches(), [])
+
+    def test_changes_are_buffered_until_flush(self):
+        recipe = Recipe.objects.get(name='Рецепт 0')
+        for i in range(3):
+            user = User.objects.create_user(
+                username=f'fan{i}', email=f'fan{i}@example.com',
+                password='pass',
+            )
+            self.client.force_authenticate(user)
+            response = self.client.post(f'/api/recipes/{recipe.id}/favorite/')
+            self.assertEqual(response.status_code, 201)
+        self.client.delete(f'/api/recipes/{recipe.id}/favorite/')
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 0)
+        self.assertEqual(CounterDelta.objects.count(), 4)
+        # Четыре приращения одного рецепта — один UPDATE; вокруг
+        # SELECT, UPDATE и DELETE — точка сохранения транзакции.
+        with self.assertNumQueries(5):
+            self.assertEqual(counters.flush(), 4)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 2)
+        self.assertFalse(CounterDelta.objects.exists())
+
+    def test_recipe_delete_decrements_author(self):
+        author = self.recipe.author
+        self.recipe.delete()
+        counters.flush()
+        author.refresh_from_db()
+        self.assertEqual(author.recipes_count, 0)
+
+    def test_rebuild(self):
+        Recipe.objects.filter(pk=self.recipe.pk).update(favorites_count=42)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_counters', '--check', stdout=io.StringIO())
+        call_command('rebuild_counters', stdout=io.StringIO())
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 1)
+        call_command('rebuild_counters', '--check', stdout=io.StringIO())
+
+    def test_negative_delta_does_not_block_flush(self):
+        recipe = Recipe.objects.get(name='Рецепт 0')
+        self.assertEqual(recipe.favorites_count, 0)
+        counters.add(CounterDelta.RECIPE_FAVORITES, [recipe.pk], -1)
+        counters.add(CounterDelta.RECIPE_IN_CARTS, [recipe.pk])
+        self.assertEqual(counters.flush(), 2)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 0)
+        self.assertEqual(recipe.in_carts_count, 1)
+        self.assertFalse(CounterDelta.objects.exists())
+
+    def test_rebuild_consumes_pending_deltas(self):
+        Favorite.objects.create(user=self.user, recipe=Recipe.objects.get(
+            name='Рецепт 0'
+        ))
+        self.assertTrue(CounterDelta.objects.exists())
+        counters.rebuild()
+        self.assertFalse(CounterDelta.objects.exists())
+        self.assertEqual(counters.find_mismatches(), [])
+
+
+class RecipeFilterTests(RecipeAPITestCase):
+    """Фильтры списка рецептов: EXISTS вместо JOIN и DISTINCT."""
+
+    def get_ids(self, client, params):
+        response = client.get('/api/recipes/', dict(params, limit=50))
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(
+            response.data['count'], len(response.data['results'])
+        )
+        return {item['id'] for item in response.data['results']}
+
+    def test_several_tags_do_not_duplicate_recipes(self):
+        Recipe.objects.get(name='Рецепт 0').tags.set(
+            Tag.objects.filter(slug='tag0')
+        )
+        ids = self.get_ids(self.anon, {'tags': ['tag0', 'tag1', 'tag2']})
+        self.assertEqual(len(ids), 10)
+        self.assertEqual(len(self.get_ids(self.anon, {'tags': 'tag1'})), 9)
+
+    def test_combined_filters(self):
+        author = self.recipe.author
+        ids = self.get_ids(self.client, {
+            'tags': ['tag0', 'tag1'], 'author': author.id,
+            'is_favorited': 'true', 'is_in_shopping_cart': 'false',
+        })
+        self.assertEqual(ids, {self.recipe.id})
+        self.assertEqual(
+            self.get_ids(self.client, {'is_in_shopping_cart': 'true'}),
+            set(ShoppingCart.objects.filter(
+                user=self.user
+            ).values_list('recipe_id', flat=True))
+        )
+
+    def test_filtered_page_is_one_query(self):
+        params = {'tags': ['tag0', 'tag2'], 'is_favorited': 'true'}
+        self.client.get('/api/recipes/', params)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/recipes/', params)
+        recipe_queries = [
+            query['sql'] for query in queries
+            if query['sql'].startswith('SELECT')
+            and 'FROM "recipes_recipe"' in query['sql']
+        ]
+        self.assertTrue(recipe_queries)
+        for sql in recipe_queries:
+            self.assertNotIn('DISTINCT', sql)
+            self.assertNotIn('JOIN "recipes_tag"', sql)
+
+    def test_unknown_tag_and_tag_changes(self):
+        response = self.anon.get('/api/recipes/', {'tags': 'new'})
+        self.assertEqual(response.status_code, 400)
+        with self.captureOnCommitCallbacks(execute=True):
+            tag = Tag.objects.create(
+                name='Новый', color='#FFFFFF', slug='new'
+            )
+        self.recipe.tags.add(tag)
+        self.assertEqual(
+            self.get_ids(self.anon, {'tags': 'new'}), {self.recipe.id}
+        )
+
+    def test_tag_from_other_process(self):
+        self.get_ids(self.anon, {'tags': 'tag0'})
+        # Отметку сбросил бы кэш другого процесса, здесь она прежняя.
+        tag = Tag.objects.create(name='Новый', color='#FFFFFF', slug='new')
+        self.recipe.tags.add(tag)
+        self.assertEqual(
+            self.get_ids(self.anon, {'tags': ['new', 'tag0']}),
+            self.get_ids(self.anon, {'tags': 'tag0'}) | {self.recipe.id}
+        )
+        with self.assertNumQueries(0):
+            recipe_cache.get_tag_ids(slugs=['new'])
+
+
+class IngredientIndexTests(RecipeAPITestCase):
+    """Автодополнение ингредиентов из индекса в памяти."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        Ingredient.objects.bulk_create(
+            Ingredient(name=name, measurement_unit='г')
+            for name in ('Мука пшеничная', 'мускатный орех', 'Мёд',
+                         'МУКА ржаная', 'Ёжевика', 'apple', 'Apricot')
+        )
+
+    def expected(self, prefix):
+        return [
+            {'id': item.id, 'name': item.name,
+             'measurement_unit': item.measurement_unit}
+            for item in Ingredient.objects.all()
+            if item.name.casefold().startswith(prefix.casefold())
+        ]
+
+    def test_prefix_search(self):
+        for prefix in ('му', 'МУК', 'мука р', 'ё', 'Ap', 'ингредиент 3',
+                       'нет такого', ''):
+            response = self.anon.get('/api/ingredients/', {'name': prefix})
+            self.assertEqual(response.json(), self.expected(prefix), prefix)
+
+    def test_repeated_search_without_queries(self):
+        self.anon.get('/api/ingredients/', {'name': 'му'})
+        with self.assertNumQueries(0):
+            response = self.anon.get('/api/ingredients/', {'name': 'мё'})
+        self.assertEqual([item['name'] for item in response.data], ['Мёд'])
+
+    def test_rebuilt_after_changes(self):
+        self.anon.get('/api/ingredients/', {'name': 'му'})
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.create(name='Мускус', measurement_unit='г')
+        response = self.anon.get('/api/ingredients/', {'name': 'мус'})
+        self.assertEqual(response.json(), self.expected('мус'))
+        self.assertEqual(len(response.data), 2)
+
+    def test_rebuilt_after_changes_in_other_process(self):
+        url = '/api/ingredients/?name=мус'
+        etag = self.anon.get(url)['ETag']
+        full_etag = self.anon.get('/api/ingredients/')['ETag']
+        # Другой процесс сбрасывает отметку в своём кэше, не в нашем.
+        Ingredient.objects.bulk_create(
+            [Ingredient(name='Мускус', measurement_unit='г')]
+        )
+        self.assertEqual(len(self.anon.get(url).data), 1)
+        with override_settings(INGREDIENT_INDEX_CHECK_INTERVAL=0):
+            response = self.anon.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertNotEqual(
+                self.anon.get('/api/ingredients/')['ETag'], full_etag
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), self.expected('мус'))
+        self.assertEqual(len(response.data), 2)
+
+
+class IngredientSearchTests(RecipeAPITestCase):
+    """Поиск ингредиентов по части названия и с опечатками."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        Ingredient.objects.bulk_create(
+            Ingredient(name=name, measurement_unit='г')
+            for name in ('абрикосовое варенье', 'Варенье вишнёвое',
+                         'варёная сгущёнка', 'вареники с картошкой',
+                         'клубничное варенье', 'ваниль')
+        )
+
+    def search(self, query, **params):
+        response = self.anon.get(
+            '/api/ingredients/', dict(params, search=query)
+        )
+        self.assertEqual(response.status_code, 200)
+        return [item['name'] for item in response.data]
+
+    def test_prefix_then_substring(self):
+        self.assertEqual(self.search('ВАРЕНЬЕ'), self.search('варенье'))
+        self.assertEqual(
+            self.search('варенье'),
+            ['Варенье вишнёвое', 'абрикосовое варенье',
+             'клубничное варенье']
+        )
+
+    def test_typo(self):
+        names = self.search('варене')
+        self.assertEqual(names[0], 'Варенье вишнёвое')
+        self.assertIn('абрикосовое варенье', names)
+
+    @override_settings(INGREDIENT_SEARCH_LIMIT=2)
+    def test_results_are_capped(self):
+        self.assertEqual(len(self.search('а')), 2)
+        self.assertEqual(self.search(' '), [])
+
+    @unittest.skipUnless(
+        connection.vendor == 'postgresql', 'нужен PostgreSQL'
+    )
+    def test_trigram_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT 1 FROM pg_indexes WHERE indexname = %s',
+                ['ingredient_name_trgm_idx']
+            )
+            self.assertIsNotNone(cursor.fetchone())
+
+
+class CatalogSnapshotTests(RecipeAPITestCase):
+    """Готовые снимки полных справочников."""
+
+    def test_body_matches_serializer(self):
+        response = self.anon.get('/api/ingredients/')
+        self.assertEqual(
+            response.json(),
+            list(Ingredient.objects.values('id', 'name', 'measurement_unit'))
+        )
+        tags = self.anon.get('/api/tags/').json()
+        self.assertEqual(
+            [tag['slug'] for tag in tags],
+            list(Tag.objects.values_list('slug', flat=True))
+        )
+
+    def test_gzip(self):
+        plain = self.anon.get('/api/ingredients/')
+        compressed = self.anon.get(
+            '/api/ingredients/', HTTP_ACCEPT_ENCODING='gzip, deflate'
+        )
+        self.assertEqual(compressed['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', compressed['Vary'])
+        self.assertEqual(
+            gzip.decompress(compressed.content), plain.content
+        )
+        self.assertNotEqual(compressed['ETag'], plain['ETag'])
+
+    def test_repeated_request_without_queries(self):
+        etag = self.anon.get('/api/tags/')['ETag']
+        with self.assertNumQueries(0):
+            response = self.anon.get('/api/tags/')
+        self.assertEqual(response['ETag'], etag)
+        with self.assertNumQueries(0):
+            response = self.anon.get('/api/tags/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_rebuilt_after_changes(self):
+        etag = self.anon.get('/api/ingredients/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.create(name='Шафран', measurement_unit='г')
+        response = self.anon.get('/api/ingredients/')
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertIn('Шафран', [item['name'] for item in response.json()])
+
+    def test_filtered_list_not_from_snapshot(self):
+        response = self.anon.get('/api/ingredients/', {'name': 'ингр'})
+        self.assertNotIn('Content-Encoding', response)
+        self.assertEqual(len(response.json()), Ingredient.objects.count())
+
+    def test_command_writes_files(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        call_command(
+            'build_catalog_snapshots', output=root, stdout=io.StringIO()
+        )
+        for name in catalog_snapshots.CATALOGS:
+            path = os.path.join(root, f'{name}.json')
+            with open(path, 'rb') as file:
+                body = file.read()
+            with open(f'{path}.gz', 'rb') as file:
+                self.assertEqual(gzip.decompress(file.read()), body)
+            self.assertEqual(
+                body, self.anon.get(f'/api/{name}/').content
+            )
+
+    @override_settings(CATALOG_SNAPSHOT_ROOT=None)
+    def test_command_requires_root(self):
+        with self.assertRaises(CommandError):
+            call_command('build_catalog_snapshots', stdout=io.StringIO())
+
+
+class ImportIngredientsTests(TestCase):
+    """Потоковый импорт ингредиентов."""
+
+    ROWS = [
+        {'name': 'соль', 'measurement_unit': 'г'},
+        {'name': 'сахар', 'measurement_unit': 'г'},
+        {'name': 'молоко', 'measurement_unit': 'мл'},
+        {'name': 'молоко', 'measurement_unit': 'г'},
+        {'name': 'соль', 'measurement_unit': 'г'},
+        {'name': '', 'measurement_unit': 'г'},
+    ]
+
+    def write(self, extension, content):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        path = os.path.join(directory, f'ingredients.{extension}')
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(content)
+        return path
+
+    def run_import(self, path, *args):
+        out = io.StringIO()
+        call_command('import_ingredients', path, *args, stdout=out)
+        return out.getvalue()
+
+    def imported(self):
+        return set(
+            Ingredient.objects.values_list('name', 'measurement_unit')
+        )
+
+    def test_formats(self):
+        expected = {
+            ('соль', 'г'), ('сахар', 'г'), ('молоко', 'мл'), ('молоко', 'г')
+        }
+        contents = {
+            'json': json.dumps(self.ROWS, ensure_ascii=False, indent=2),
+            'jsonl': '\n'.join(
+                json.dumps(row, ensure_ascii=False) for row in self.ROWS
+            ),
+            'csv': 'name,measurement_unit\n' + ''.join(
+                f'{row["name"]},{row["measurement_unit"]}\n'
+                for row in self.ROWS
+            ),
+        }
+        for extension, content in contents.items():
+            with self.subTest(extension):
+                Ingredient.objects.all().delete()
+                self.run_import(self.write(extension, content))
+                self.assertEqual(self.imported(), expected)
+
+    def test_json_array_read_in_chunks(self):
+        content = json.dumps(self.ROWS, ensure_ascii=False)
+        self.assertEqual(
+            list(ingredient_import.iter_json_array(
+                io.StringIO(content), read_size=7
+            )),
+            self.ROWS
+        )
+        with self.assertRaises(ingredient_import.ImportFormatError):
+            list(ingredient_import.iter_json_array(
+                io.StringIO(content[:-20]), read_size=7
+            ))
+
+    def test_batches_skip_existing(self):
+        Ingredient.objects.create(name='соль', measurement_unit='г')
+        path = self.write(
+            'json', json.dumps(self.ROWS, ensure_ascii=False)
+        )
+        # Пачки по 2 строки: выборка существующих и вставка на пачку,
+        # у последней пачки вставлять нечего; затем проверка и запись
+        # контрольной суммы.
+        with self.assertNumQueries(2 + 2 + 1 + 2):
+            output = self.run_import(path, '--batch-size=2')
+        self.assertIn('Обработано 5 строк, добавлено 3', output)
+        self.assertEqual(len(self.imported()), 4)
+
+    def test_same_file_skipped(self):
+        path = self.write('csv', 'соль,г\nсахар,г\n')
+        self.run_import(path)
+        Ingredient.objects.all().delete()
+        with self.assertNumQueries(1):
+            output = self.run_import(path)
+        self.assertIn('уже импортирован', output)
+        self.assertFalse(Ingredient.objects.exists())
+        self.run_import(path, '--force')
+        self.assertEqual(len(self.imported()), 2)
+        self.assertEqual(IngredientImport.objects.count(), 2)
+
+    def test_invalid_file(self):
+        with self.assertRaises(CommandError):
+            self.run_import(self.write('json', '{"name": "соль"}'))
+        self.assertFalse(IngredientImport.objects.exists())
+
+
+class RecipeWriteValidationTests(RecipeAPITestCase):
+    """Проверка ингредиентов и тегов рецепта пачкой."""
+    IMAGE = (
+        'data:image/gif;base64,R0lGODlhAQABAIAAAP///wAAACH5BAEAAAAA'
+        'LAAAAAABAAEAAAIBRAA7'
+    )
+
+    def payload(self, ingredients, tags=()):
+        return {
+            'ingredients': [
+                {'id': ingredient_id, 'amount': amount}
+                for ingredient_id, amount in ingredients
+            ],
+            'tags': list(tags),
+            'image': self.IMAGE,
+            'name': 'Новый', 'text': 'Текст', 'cooking_time': 3,
+        }
+
+    def test_one_query_for_many_ingredients(self):
+        ingredient_ids = [
+            ingredient.id for ingredient in Ingredient.objects.bulk_create(
+                Ingredient(name=f'добавка {i}', measurement_unit='г')
+                for i in range(30)
+            )
+        ]
+        tag_ids = list(Tag.objects.values_list('id', flat=True))
+        recipe_cache.get_tag_ids()
+        serializer = RecipeCreateUpdateSerializer(data=self.payload(
+            [(ingredient_id, 2) for ingredient_id in ingredient_ids], tag_ids
+        ))
+        with self.assertNumQueries(1):
+            self.assertTrue(serializer.is_valid(), serializer.errors)
+        self.client.force_authenticate(self.user)
+        response = self.client.post(
+            '/api/recipes/', serializer.initial_data, format='json'
+        )
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(len(response.data['ingredients']), 30)
+        self.assertEqual(
+            sorted(tag['id'] for tag in response.data['tags']), sorted(tag_ids)
+        )
+
+    def test_errors_per_item(self):
+        first, second = Ingredient.objects.values_list('id', flat=True)[:2]
+        tag_id = Tag.objects.values_list('id', flat=True).first()
+        response = self.client.post('/api/recipes/', self.payload(
+            [(first, 1), (999999, 1), (first, 2), (second, 0)],
+            [tag_id, 999999, tag_id],
+        ), format='json')
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()
+        self.assertEqual(errors['ingredients'][0], {})
+        self.assertIn('999999', errors['ingredients'][1]['id'][0])
+        self.assertEqual(
+            errors['ingredients'][2],
+            {'id': ['Ингредиенты не должны повторяться!']}
+        )
+        self.assertEqual(
+            errors['ingredients'][3],
+            {'amount': ['Количество ингредиента должно быть больше нуля!']}
+        )
+        self.assertEqual(set(errors['tags']), {'1', '2'})
+        self.assertEqual(errors['tags']['2'], ['Теги не должны повторяться!'])
+
+    def test_tag_from_other_process(self):
+        recipe_cache.get_tag_ids()
+        tag = Tag.objects.create(name='Новый', color='#FFFFFF', slug='new')
+        serializer = RecipeCreateUpdateSerializer(data=self.payload(
+            [(Ingredient.objects.values_list('id', flat=True)[0], 1)],
+            [tag.id]
+        ))
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+
+
+class RecipeIngredientSyncTests(RecipeAPITestCase):
+    """Обновление ингредиентов рецепта по разнице со старыми строками."""
+    # Корзины с рецептом для пересчёта списков покупок (их нет).
+    CART_QUERIES = 1
+
+    def setUp(self):
+        super().setUp()
+        self.serializer = RecipeCreateUpdateSerializer()
+        self.rows = dict(
+            self.recipe.recipe_ingredients.values_list('ingredient_id', 'pk')
+        )
+        self.items = [
+            {'id': ingredient_id, 'amount': amount}
+            for ingredient_id, amount in self.recipe.recipe_ingredients
+            .order_by('pk').values_list('ingredient_id', 'amount')
+        ]
+
+    def sync(self, items, queries):
+        with self.assertNumQueries(queries):
+            self.serializer.sync_ingredients(items, self.recipe)
+        return dict(
+            self.recipe.recipe_ingredients.values_list(
+                'ingredient_id', 'amount'
+            )
+        )
+
+    def test_unchanged(self):
+        amounts = self.sync(self.items, 1)
+        self.assertEqual(
+            amounts, {item['id']: item['amount'] for item in self.items}
+        )
+        self.assertEqual(
+            dict(self.recipe.recipe_ingredients.values_list(
+                'ingredient_id', 'pk'
+            )),
+            self.rows
+        )
+
+    def test_single_amount_changed(self):
+        self.items[2]['amount'] += 5
+        amounts = self.sync(self.items, 2 + self.CART_QUERIES)
+        self.assertEqual(amounts[self.items[2]['id']], self.items[2]['amount'])
+        self.assertEqual(
+            dict(self.recipe.recipe_ingredients.values_list(
+                'ingredient_id', 'pk'
+            )),
+            self.rows
+        )
+
+    def test_mixed_changes(self):
+        new = Ingredient.objects.create(name='перец', measurement_unit='г')
+        items = self.items[1:] + [{'id': new.id, 'amount': 3}]
+        items[0]['amount'] += 1
+        # Выборка, bulk_update, удаление, вставка.
+        amounts = self.sync(items, 4 + self.CART_QUERIES)
+        self.assertEqual(
+            amounts, {item['id']: item['amount'] for item in items}
+        )
+
+    def test_full_replace(self):
+        new = Ingredient.objects.bulk_create(
+            Ingredient(name=f'замена {i}', measurement_unit='г')
+            for i in range(3)
+        )
+        items = [{'id': ingredient.id, 'amount': 2} for ingredient in new]
+        amounts = self.sync(items, 3 + self.CART_QUERIES)
+        self.assertEqual(amounts, {ingredient.id: 2 for ingredient in new})
+
+    def test_patch_response(self):
+        self.client.force_authenticate(self.recipe.author)
+        self.items[0]['amount'] = 42
+        response = self.client.patch(
+            f'/api/recipes/{self.recipe.id}/',
+            {'ingredients': self.items[1:] + self.items[:1]}, format='json'
+        )
+        self.assertEqual(response.status_code, 200, response.data)
+        amounts = {
+            item['id']: item['amount']
+            for item in response.data['ingredients']
+        }
+        self.assertEqual(amounts[self.items[0]['id']], 42)
+        self.assertEqual(
+            list(amounts), [item['id'] for item in self.items[1:]]
+            + [self.items[0]['id']]
+        )
+
+    def test_reorder_keeps_submitted_order(self):
+        items = self.items[::-1]
+        # Выборка, удаление, вставка.
+        amounts = self.sync(items, 3 + self.CART_QUERIES)
+        self.assertEqual(
+            amounts, {item['id']: item['amount'] for item in items}
+        )
+        self.assertEqual(
+            list(self.recipe.recipe_ingredients.order_by('pk').values_list(
+                'ingredient_id', flat=True
+            )),
+            [item['id'] for item in items]
+        )
+        response = self.anon.get(f'/api/recipes/{self.recipe.id}/')
+        self.assertEqual(
+            [item['id'] for item in response.data['ingredients']],
+            [item['id'] for item in items]
+        )
+
+
+class ImageRenditionsTests(RecipeAPITestCase):
+    """Уменьшенные версии изображений рецептов и аватаров."""
+
+    def save_image(self, instance, field, size=(2000, 1000)):
+        buffer = io.BytesIO()
+        Image.new('RGB', size, 'orange').save(buffer, 'PNG')
+        name = default_storage.save(
+            f'tests/{field}.png', ContentFile(buffer.getvalue())
+        )
+        setattr(instance, field, name)
+        with self.captureOnCommitCallbacks(execute=True):
+            instance.save()
+        instance.refresh_from_db()
+        return name
+
+    def test_recipe_renditions(self):
+        response = self.anon.get(f'/api/recipes/{self.recipe.id}/')
+        original = response.data['image']
+        self.assertEqual(
+            set(response.data['image_renditions'].values()), {original}
+        )
+        name = self.save_image(self.recipe, 'image')
+        renditions = self.recipe.image_renditions
+        self.assertEqual(renditions['source'], name)
+        for rendition, bounds in images.RENDITIONS.items():
+            with default_storage.open(renditions[rendition]) as file:
+                with Image.open(file) as image:
+                    self.assertEqual(image.format, images.get_format()[0])
+                    self.assertLessEqual(image.width, bounds[0])
+                    self.assertLessEqual(image.height, bounds[1])
+                    self.assertEqual(image.width, 2 * image.height)
+        data = self.anon.get(f'/api/recipes/{self.recipe.id}/').data
+        self.assertTrue(
+            data['image_renditions']['card'].endswith(renditions['card'])
+        )
+        with override_settings(RECIPE_FAST_SERIALIZER=False):
+            cache.clear()
+            self.assertEqual(
+                self.anon.get(f'/api/recipes/{self.recipe.id}/').data, data
+            )
+
+    def test_replaced_image_falls_back_to_original(self):
+        self.save_image(self.recipe, 'image')
+        Recipe.objects.filter(pk=self.recipe.pk).update(
+            image='recipes/images/new.png'
+        )
+        cache.clear()
+        data = self.anon.get(f'/api/recipes/{self.recipe.id}/').data
+        self.assertEqual(
+            set(data['image_renditions'].values()), {data['image']}
+        )
+
+    def test_avatar_renditions(self):
+        author = self.recipe.author
+        self.save_image(author, 'avatar', size=(300, 300))
+        thumbnail = author.avatar_renditions['thumbnail']
+        data = self.anon.get(f'/api/recipes/{self.recipe.id}/').data
+        self.assertTrue(
+            data['author']['avatar_renditions']['thumbnail']
+            .endswith(thumbnail)
+        )
+        data = self.client.get(f'/api/users/{author.id}/').data
+        self.assertTrue(
+            data['avatar_renditions']['thumbnail'].endswith(thumbnail)
+        )
+
+    def test_command_builds_pending(self):
+        self.save_image(self.recipe, 'image')
+        Recipe.objects.filter(pk=self.recipe.pk).update(image_renditions={})
+        # У остальных рецептов и авторов файлов нет: они пропускаются.
+        with self.assertLogs('api.images', 'WARNING'):
+            call_command('build_image_renditions', stdout=io.StringIO())
+        self.recipe.refresh_from_db()
+        self.assertEqual(
+            self.recipe.image_renditions['source'], self.recipe.image.name
+        )
+
+
+class ShoppingListDownloadTests(RecipeAPITestCase):
+    """Выгрузка списка покупок в разных форматах и кэш строк."""
+    URL = '/api/recipes/download_shopping_cart/'
+    # Рецепты 1, 2, 4, 5, 7, 8 в корзине, количество — номер + 1.
+    TOTAL = 2 + 3 + 5 + 6 + 8 + 9
+
+    def download(self, suffix=''):
+        response = self.client.get(self.URL + suffix)
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_text(self):
+        response, content = self.download()
+        self.assertEqual(response['Content-Type'], 'text/plain; charset=utf-8')
+        self.assertIn('shopping_list.txt', response['Content-Disposition'])
+        lines = content.splitlines()
+        self.assertEqual(lines[:2], ['Список покупок:', ''])
+        self.assertEqual(lines[2], f'1. ингредиент 0 (г) — {self.TOTAL}')
+        self.assertEqual(len(lines), 2 + 5)
+
+    def test_csv(self):
+        response, content = self.download('?format=csv')
+        self.assertIn('shopping_list.csv', response['Content-Disposition'])
+        rows = list(csv.reader(io.StringIO(content)))
+        self.assertEqual(rows[0], ['name', 'measurement_unit', 'amount'])
+        self.assertEqual(rows[1], ['ингредиент 0', 'г', str(self.TOTAL)])
+        self.assertEqual(len(rows), 1 + 5)
+
+    def test_json(self):
+        response, content = self.download('?format=json')
+        self.assertIn('shopping_list.json', response['Content-Disposition'])
+        items = json.loads(content)
+        self.assertEqual(len(items), 5)
+        self.assertEqual(items[0], {
+            'name': 'ингредиент 0', 'measurement_unit': 'г',
+            'amount': self.TOTAL,
+        })
+
+    def test_format_ignores_accept_header(self):
+        response = self.client.get(self.URL, HTTP_ACCEPT='application/json')
+        self.assertEqual(response['Content-Type'], 'text/plain; charset=utf-8')
+        response = self.client.get(
+            self.URL + '?format=csv', HTTP_ACCEPT='application/json'
+        )
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertEqual(
+            self.client.get(self.URL + '?format=xml').status_code, 404
+        )
+
+    def test_anonymous(self):
+        response = self.anon.get(self.URL)
+        self.assertEqual(response.status_code, 401)
+
+    def test_repeated_download_cached(self):
+        self.download()
+        with self.assertNumQueries(self.AUTH_QUERIES):
+            self.download('?format=csv')
+
+    def first_amount(self):
+        return json.loads(self.download('?format=json')[1])[0]['amount']
+
+    def test_cart_change_invalidates(self):
+        self.assertEqual(self.first_amount(), self.TOTAL)
+        with self.captureOnCommitCallbacks(execute=True):
+            ShoppingCart.objects.create(user=self.user, recipe=self.recipe)
+        self.assertEqual(self.first_amount(), self.TOTAL + 10)
+        with self.captureOnCommitCallbacks(execute=True):
+            ShoppingCart.objects.filter(
+                user=self.user, recipe=self.recipe
+            ).delete()
+        self.assertEqual(self.first_amount(), self.TOTAL)
+
+    def test_recipe_change_invalidates(self):
+        self.assertEqual(self.first_amount(), self.TOTAL)
+        recipe = Recipe.objects.get(name='Рецепт 1')
+        self.client.force_authenticate(recipe.author)
+        ingredients = [
+            {'id': ingredient_id, 'amount': 100}
+            for ingredient_id in recipe.recipe_ingredients.values_list(
+                'ingredient_id', flat=True
+            )
+        ]
+        # Файла изображения в тестовых данных нет: версии не строятся.
+        with self.assertLogs('api.images', 'WARNING'), \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(
+                f'/api/recipes/{recipe.id}/',
+                {'ingredients': ingredients}, format='json'
+            )
+        self.assertEqual(response.status_code, 200, response.data)
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.first_amount(), self.TOTAL - 2 + 100)
+
+
+class ShoppingListTableTests(RecipeAPITestCase):
+    """Таблица списков покупок обновляется вместе с корзиной и рецептами."""
+
+    def assertConsistent(self):
+        self.assertEqual(shopping_list.find_mismatches(), [])
+
+    def amounts(self):
+        return dict(
+            ShoppingListItem.objects.filter(user=self.user).values_list(
+                'ingredient__name', 'total_amount'
+            )
+        )
+
+    def test_filled_from_cart(self):
+        self.assertEqual(
+            ShoppingListItem.objects.filter(user=self.user).count(), 5
+        )
+        self.assertEqual(
+            set(ShoppingListItem.objects.values_list(
+                'total_amount', 'recipe_count'
+            )),
+            {(ShoppingListDownloadTests.TOTAL, 6)}
+        )
+        self.assertConsistent()
+
+    def test_cart_add_and_remove(self):
+        recipe = Recipe.objects.get(name='Рецепт 0')
+        response = self.client.post(
+            f'/api/recipes/{recipe.id}/shopping_cart/'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            set(self.amounts().values()),
+            {ShoppingListDownloadTests.TOTAL + 1}
+        )
+        self.assertConsistent()
+        cart = self.user.shopping_cart.values_list('recipe', flat=True)
+        for recipe_id in list(cart):
+            self.client.delete(f'/api/recipes/{recipe_id}/shopping_cart/')
+        self.assertEqual(self.amounts(), {})
+        self.assertConsistent()
+
+    def test_recipe_ingredients_edit(self):
+        recipe = Recipe.objects.get(name='Рецепт 1')
+        self.client.force_authenticate(recipe.author)
+        extra = Ingredient.objects.create(name='соль', measurement_unit='г')
+        ingredients = [
+            {'id': ingredient_id, 'amount': 10}
+            for ingredient_id in recipe.recipe_ingredients.order_by(
+                'ingredient__name'
+            ).values_list('ingredient_id', flat=True)[1:]
+        ] + [{'id': extra.id, 'amount': 7}]
+        response = self.client.patch(
+            f'/api/recipes/{recipe.id}/',
+            {'ingredients': ingredients}, format='json'
+        )
+        self.assertEqual(response.status_code, 200, response.data)
+        amounts = self.amounts()
+        total = ShoppingListDownloadTests.TOTAL
+        self.assertEqual(amounts['ингредиент 0'], total - 2)
+        self.assertEqual(amounts['ингредиент 1'], total - 2 + 10)
+        self.assertEqual(amounts['соль'], 7)
+        self.assertConsistent()
+
+    def test_ingredient_row_signals(self):
+        recipe = Recipe.objects.get(name='Рецепт 2')
+        extra = Ingredient.objects.create(name='соль', measurement_unit='г')
+        row = RecipeIngredient.objects.create(
+            recipe=recipe, ingredient=extra, amount=4
+        )
+        self.assertEqual(self.amounts()['соль'], 4)
+        row.delete()
+        self.assertNotIn('соль', self.amounts())
+        recipe.delete()
+        self.assertEqual(
+            set(self.amounts().values()),
+            {ShoppingListDownloadTests.TOTAL - 3}
+        )
+        self.assertConsistent()
+
+    def test_download_reads_table(self):
+        # Аутентификация и строки таблицы с названиями ингредиентов.
+        with self.assertNumQueries(self.AUTH_QUERIES + 1):
+            response = self.client.get(
+                '/api/recipes/download_shopping_cart/'
+            )
+            b''.join(response.streaming_content)
+
+    def test_rebuild_command(self):
+        ShoppingListItem.objects.filter(
+            user=self.user, ingredient__name='ингредиент 0'
+        ).update(total_amount=1)
+        ShoppingListItem.objects.filter(
+            user=self.user, ingredient__name='ингредиент 1'
+        ).delete()
+        stranger = ShoppingListItem.objects.create(
+            user=self.recipe.author,
+            ingredient=self.recipe.ingredients.first(),
+            total_amount=3, recipe_count=1
+        )
+        out = io.StringIO()
+        with self.assertRaisesMessage(CommandError, 'Расхождений: 3'):
+            call_command('rebuild_shopping_lists', '--check', stdout=out)
+        self.assertIn(f'user {stranger.user_id}', out.getvalue())
+        call_command('rebuild_shopping_lists', stdout=io.StringIO())
+        self.assertFalse(
+            ShoppingListItem.objects.filter(pk=stranger.pk).exists()
+        )
+        call_command(
+            'rebuild_shopping_lists', '--check', stdout=io.StringIO()
+        )
+        self.assertEqual(
+            set(self.amounts().values()), {ShoppingListDownloadTests.TOTAL}
+        )
+
+
+class BatchMarkTests(RecipeAPITestCase):
+    """Пакетное добавление и удаление рецептов в избранное и корзину."""
+
+    def setUp(self):
+        super().setUp()
+        self.ids = {
+            int(name.split()[1]): pk
+            for pk, name in Recipe.objects.values_list('pk', 'name')
+        }
+
+    def send(self, method, url, recipe_ids):
+        response = getattr(self.client, method)(
+            f'/api/recipes/{url}/', {'recipes': recipe_ids}, format='json'
+        )
+        self.assertEqual(response.status_code, 200, response.data)
+        return {
+            item['id']: item['status'] for item in response.data['results']
+        }
+
+    def assertCountersValid(self):
+        counters.flush()
+        self.assertEqual(counters.find_mismatches(), [])
+
+    def test_cart_add_and_remove(self):
+        missing = max(self.ids.values()) + 100
+        statuses = self.send('post', 'shopping_cart', [
+            self.ids[0], self.ids[1], missing, self.ids[3], self.ids[0]
+        ])
+        self.assertEqual(statuses, {
+            self.ids[0]: 'added', self.ids[1]: 'already_added',
+            missing: 'not_found', self.ids[3]: 'added',
+        })
+        self.assertEqual(
+            set(self.user.shopping_cart.values_list('recipe', flat=True)),
+            {self.ids[i] for i in (0, 1, 2, 3, 4, 5, 7, 8)}
+        )
+        self.assertEqual(shopping_list.find_mismatches(), [])
+        self.assertCountersValid()
+        statuses = self.send(
+            'delete', 'shopping_cart', [self.ids[0], self.ids[6], missing]
+        )
+        self.assertEqual(statuses, {
+            self.ids[0]: 'removed', self.ids[6]: 'not_added',
+            missing: 'not_found',
+        })
+        self.assertFalse(
+            self.user.shopping_cart.filter(recipe=self.ids[0]).exists()
+        )
+        self.assertEqual(shopping_list.find_mismatches(), [])
+        self.assertCountersValid()
+
+    def test_favorites(self):
+        statuses = self.send('post', 'favorite', [self.ids[0], self.ids[1]])
+        self.assertEqual(statuses, {
+            self.ids[0]: 'added', self.ids[1]: 'already_added'
+        })
+        statuses = self.send('delete', 'favorite', list(self.ids.values()))
+        self.assertEqual(list(statuses.values()).count('removed'), 6)
+        self.assertFalse(self.user.favorites.exists())
+        self.assertCountersValid()
+
+    def test_fixed_round_trips(self):
+        queries = []
+        for method in ('post', 'delete'):
+            for recipe_ids in (
+                [self.ids[0]], [self.ids[i] for i in (0, 3, 6, 9)]
+            ):
+                with CaptureQueriesContext(connection) as context:
+                    self.send(method, 'shopping_cart', recipe_ids)
+                queries.append(len(context))
+        self.assertEqual(queries[0], queries[1])
+        self.assertEqual(queries[2], queries[3])
+
+    def test_invalid_payload(self):
+        for payload in ({}, {'recipes': []}, {'recipes': ['x']},
+                        {'recipes': list(range(1, 102))}):
+            response = self.client.post(
+                '/api/recipes/favorite/', payload, format='json'
+            )
+            self.assertEqual(response.status_code, 400, payload)
+        response = self.anon.post(
+            '/api/recipes/favorite/', {'recipes': [1]}, format='json'
+        )
+        self.assertEqual(response.status_code, 401)
+
+
+class ToggleTests(RecipeAPITestCase):
+    """Добавление и удаление одного рецепта: коды ответов и счётчики."""
+
+    def setUp(self):
+        super().setUp()
+        self.target = Recipe.objects.get(name='Рецепт 0')
+        self.missing = Recipe.objects.order_by('-pk').first().pk + 1
+
+    def assertToggles(self, url):
+        recipe_url = f'/api/recipes/{self.target.id}/{url}/'
+        response = self.client.post(recipe_url)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['id'], self.target.id)
+        self.assertEqual(self.client.post(recipe_url).status_code, 400)
+        self.assertEqual(self.client.delete(recipe_url).status_code, 204)
+        self.assertEqual(self.client.delete(recipe_url).status_code, 400)
+        for method in ('post', 'delete'):
+            response = getattr(self.client, method)(
+                f'/api/recipes/{self.missing}/{url}/'
+            )
+            self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.anon.post(recipe_url).status_code, 401)
+        counters.flush()
+        self.assertEqual(counters.find_mismatches(), [])
+
+    def test_favorite(self):
+        self.assertToggles('favorite')
+
+    def test_shopping_cart(self):
+        self.client.post(f'/api/recipes/{self.target.id}/shopping_cart/')
+        self.assertEqual(
+            ShoppingListItem.objects.get(
+                user=self.user, ingredient__name='ингредиент 0'
+            ).recipe_count,
+            7
+        )
+        self.client.delete(f'/api/recipes/{self.target.id}/shopping_cart/')
+        self.assertEqual(shopping_list.find_mismatches(), [])
+        self.assertToggles('shopping_cart')
+        self.assertEqual(shopping_list.find_mismatches(), [])
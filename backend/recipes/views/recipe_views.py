@@ -1,47 +1,222 @@
-from django.db.models import Sum
-from django.http import HttpResponse
+import json
+
+from django.db import transaction
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from rest_framework import permissions, status, viewsets
+from django.utils.cache import patch_vary_headers
+from rest_framework import mixins, permissions, status, viewsets
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
 
+from recipes import cache as recipe_cache
+from recipes import (
+    catalog_snapshots, counters, ingredient_index, ingredient_search,
+    shopping_list, sql_json
+)
 from recipes.models import (
-    Ingredient, Recipe, RecipeIngredient, Tag, Favorite, ShoppingCart
+    CounterDelta, Ingredient, Recipe, Tag, Favorite, ShoppingCart
 )
 from recipes.serializers.recipe_serializers import (
     IngredientSerializer, RecipeListSerializer,
-    RecipeCreateUpdateSerializer, RecipeMinifiedSerializer,
-    TagSerializer, ShortLinkSerializer
+    RecipeCreateUpdateSerializer, RecipeIdsSerializer,
+    RecipeMinifiedSerializer, TagSerializer, ShortLinkSerializer,
+    sideload_recipes
 )
-from api.filters import IngredientFilter, RecipeFilter
-from api.pagination import CustomPagination
+from api.db import delete_returning, insert_ignore, insert_ignore_many
+from api.filters.filters import RecipeFilter
+from api.mixins import ConditionalGetMixin
+from api.pagination import RecipePagination
+from api.renderers import FormatParamNegotiation, SHOPPING_LIST_RENDERERS
 from api.permissions import IsAdminOrAuthorOrReadOnly
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+def accepts_gzip(request):
+    return 'gzip' in request.headers.get('Accept-Encoding', '')
+
+
+class CatalogViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
+    """Базовый вьюсет справочников с условными GET-запросами.
+
+    ETag и Last-Modified берутся из отметки справочника, которую
+    сбрасывают сигналы при изменении его записей. Список без параметров
+    отдаётся готовым снимком (recipes.catalog_snapshots), сжатым, если
+    клиент принимает gzip; ETag тогда — хэш содержимого.
+    """
+    catalog_name = None
+    pagination_class = None
+
+    def is_full_list(self):
+        return self.action == 'list' and not self.request.query_params
+
+    def get_conditional_state(self, request, *args, **kwargs):
+        token, modified = recipe_cache.get_catalog_stamp(self.catalog_name)
+        if self.is_full_list():
+            snapshot = catalog_snapshots.get_snapshot(self.catalog_name)
+            return (snapshot.etag, accepts_gzip(request)), modified
+        return (token,), modified
+
+    def list(self, request, *args, **kwargs):
+        respond = (
+            self.snapshot_list if self.is_full_list() else self.filtered_list
+        )
+        return self.conditional_response(respond, request, *args, **kwargs)
+
+    def snapshot_list(self, request, *args, **kwargs):
+        snapshot = catalog_snapshots.get_snapshot(self.catalog_name)
+        if accepts_gzip(request):
+            response = HttpResponse(
+                snapshot.gzipped, content_type='application/json'
+            )
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = HttpResponse(
+                snapshot.body, content_type='application/json'
+            )
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+
+    def filtered_list(self, request, *args, **kwargs):
+        return mixins.ListModelMixin.list(self, request, *args, **kwargs)
+
+
+class IngredientViewSet(CatalogViewSet):
     """Вьюсет для ингредиентов."""
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
-    filter_backends = (DjangoFilterBackend,)
-    filterset_class = IngredientFilter
-    pagination_class = None
+    catalog_name = 'ingredients'
+
+    def get_conditional_state(self, request, *args, **kwargs):
+        # Сверка индекса с базой сбрасывает отметку справочника, если его
+        # изменил другой процесс; ETag и снимок берутся уже по новой.
+        ingredient_index.get_index()
+        return super().get_conditional_state(request, *args, **kwargs)
 
+    def filtered_list(self, request, *args, **kwargs):
+        """Список из индекса в памяти (recipes.ingredient_index).
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+        С ?search= — ранжированный поиск по части названия и с
+        опечатками, не больше INGREDIENT_SEARCH_LIMIT результатов.
+        """
+        query = request.query_params.get('search')
+        if query is not None:
+            return Response(ingredient_search.search(query))
+        return Response(
+            ingredient_index.search(request.query_params.get('name'))
+        )
+
+
+class TagViewSet(CatalogViewSet):
     """Вьюсет для тегов."""
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
-    pagination_class = None
+    catalog_name = 'tags'
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     """Вьюсет для рецептов."""
     queryset = Recipe.objects.all()
-    pagination_class = CustomPagination
+    pagination_class = RecipePagination
     permission_classes = [IsAdminOrAuthorOrReadOnly]
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
+    conditional_vary = ('Authorization',)
+    sideload_query_param = 'sideload'
+
+    def get_queryset(self):
+        if self.action in ('list', 'retrieve'):
+            return Recipe.objects.for_representation(
+                self.request.user,
+                self.get_serializer().get_sparse_fieldset()
+            )
+        return Recipe.objects.all()
+
+    def get_conditional_state(self, request, *args, **kwargs):
+        """Состояние ответа без выборки страницы и сериализации.
+
+        Состояние списка — отметки списка рецептов и избранного, корзины
+        и подписок пользователя в кэше (recipes.cache): без запросов к
+        базе, в том числе без COUNT в режиме курсора.
+
+        Last-Modified отдаётся только анонимным пользователям: удаление
+        из избранного, корзины или подписок не оставляет отметки времени.
+        Для отфильтрованного списка его тоже нет: HTTP-дата точна до
+        секунды, и рецепт, выпавший из выборки в ту же секунду, оставил
+        бы у клиента прежний ответ (ETag его различает).
+        """
+        user = request.user
+        if self.action == 'retrieve':
+            try:
+                state = Recipe.objects.with_user_flags(user).filter(
+                    pk=kwargs['pk']
+                ).values_list(
+                    'updated_at', 'is_favorited', 'is_in_shopping_cart',
+                    'author_is_subscribed'
+                ).first()
+            except (TypeError, ValueError):
+                return None
+            if state is None:
+                return None
+            return state, None if user.is_authenticated else state[0]
+        token, modified = recipe_cache.get_catalog_stamp(
+            recipe_cache.RECIPES_STAMP
+        )
+        parts = (token, recipe_cache.get_user_state(user))
+        filtered = not RecipeFilter.base_filters.keys().isdisjoint(
+            request.query_params
+        )
+        if user.is_authenticated or filtered:
+            return parts, None
+        return parts, modified
+
+    def is_sideloaded(self):
+        """Запрошен ли нормализованный формат списка (?sideload=true)."""
+        value = self.request.query_params.get(self.sideload_query_param)
+        return value in ('1', 'true', 'True')
+
+    def get_paginated_response(self, data):
+        """Со ?sideload=true рецепты ссылаются на авторов и теги по id,
+        а сами авторы и теги отдаются один раз в картах authors и tags.
+        """
+        if not self.is_sideloaded():
+            return super().get_paginated_response(data)
+        results, included = sideload_recipes(data)
+        response = super().get_paginated_response(results)
+        response.data.update(included)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        if sql_json.is_enabled() and not self.is_sideloaded():
+            return self.conditional_response(
+                self.sql_json_list, request, *args, **kwargs
+            )
+        return super().list(request, *args, **kwargs)
+
+    def sql_json_list(self, request, *args, **kwargs):
+        """Страница списка, собранная в JSON на стороне PostgreSQL."""
+        queryset = self.filter_queryset(Recipe.objects.all())
+        fields = tuple(self.get_serializer().fields)
+        page = self.paginate_queryset(queryset.only('id', 'pub_date'))
+        if page is None:
+            return HttpResponse(
+                sql_json.render_recipes(
+                    queryset.values_list('id', flat=True), request, fields
+                ),
+                content_type='application/json'
+            )
+        results = sql_json.render_recipes(
+            [recipe.id for recipe in page], request, fields
+        )
+        # Обёртка пагинатора сериализуется отдельно, а готовый массив
+        # вставляется последним ключом, как в обычном ответе.
+        envelope = dict(self.get_paginated_response([]).data)
+        envelope.pop('results')
+        head = json.dumps(envelope, ensure_ascii=False, separators=(',', ':'))
+        separator = ',' if envelope else ''
+        return HttpResponse(
+            f'{head[:-1]}{separator}"results":{results}}}',
+            content_type='application/json'
+        )
 
     def get_serializer_class(self):
         if self.action in ('create', 'update', 'partial_update'):
@@ -66,87 +241,157 @@ class RecipeViewSet(viewsets.ModelViewSet):
         methods=['post', 'delete'],
         permission_classes=[permissions.IsAuthenticated]
     )
+    @transaction.atomic
     def favorite(self, request, pk=None):
         """Добавление и удаление рецепта из избранного."""
-        recipe = get_object_or_404(Recipe, id=pk)
-        if request.method == 'POST':
-            if Favorite.objects.filter(
-                user=request.user, recipe=recipe
-            ).exists():
-                return Response(
-                    {'detail': 'Рецепт уже в избранном!'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            Favorite.objects.create(user=request.user, recipe=recipe)
-            serializer = RecipeMinifiedSerializer(recipe)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-        favorite = Favorite.objects.filter(
-            user=request.user, recipe=recipe
+        _, response = self.mark_one(
+            request, pk, Favorite, CounterDelta.RECIPE_FAVORITES,
+            ('Рецепт уже в избранном!', 'Рецепта нет в избранном!')
         )
-        if not favorite.exists():
-            return Response(
-                {'detail': 'Рецепта нет в избранном!'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        favorite.delete()
-        return Response(status=status.HTTP_204_NO_CONTENT)
+        return response
 
     @action(
         detail=True,
         methods=['post', 'delete'],
         permission_classes=[permissions.IsAuthenticated]
     )
+    @transaction.atomic
     def shopping_cart(self, request, pk=None):
         """Добавление и удаление рецепта из списка покупок."""
-        recipe = get_object_or_404(Recipe, id=pk)
+        changed, response = self.mark_one(
+            request, pk, ShoppingCart, CounterDelta.RECIPE_IN_CARTS,
+            ('Рецепт уже в списке покупок!', 'Рецепта нет в списке покупок!')
+        )
+        if changed:
+            shopping_list.refresh_cart(request.user.pk, [changed])
+        return response
+
+    def mark_one(self, request, pk, model, counter, errors):
+        """Добавление (POST) или удаление (DELETE) одного рецепта.
+
+        Проверку и изменение делает один запрос: INSERT ... ON CONFLICT
+        DO NOTHING или DELETE ... RETURNING, поэтому параллельные
+        запросы не падают на уникальном ограничении. Сигналов нет, счётчик
+        и отметка пользователя обновляются здесь. Возвращает id
+        изменённого рецепта (или None) и ответ.
+        """
+        already_added, not_added = errors
         if request.method == 'POST':
-            if ShoppingCart.objects.filter(
-                user=request.user, recipe=recipe
-            ).exists():
-                return Response(
-                    {'detail': 'Рецепт уже в списке покупок!'},
+            recipe = get_object_or_404(Recipe, id=pk)
+            if insert_ignore(model, user=request.user, recipe=recipe) is None:
+                return None, Response(
+                    {'detail': already_added},
                     status=status.HTTP_400_BAD_REQUEST
                 )
-            ShoppingCart.objects.create(user=request.user, recipe=recipe)
+            counters.add(counter, [recipe.pk])
+            recipe_cache.touch_user_state([request.user.pk])
             serializer = RecipeMinifiedSerializer(recipe)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-        cart = ShoppingCart.objects.filter(
-            user=request.user, recipe=recipe
-        )
-        if not cart.exists():
-            return Response(
-                {'detail': 'Рецепта нет в списке покупок!'},
-                status=status.HTTP_400_BAD_REQUEST
+            return recipe.pk, Response(
+                serializer.data, status=status.HTTP_201_CREATED
+            )
+        if not delete_returning(model, user=request.user, recipe_id=pk):
+            get_object_or_404(Recipe, id=pk)
+            return None, Response(
+                {'detail': not_added}, status=status.HTTP_400_BAD_REQUEST
             )
-        cart.delete()
-        return Response(status=status.HTTP_204_NO_CONTENT)
+        counters.add(counter, [int(pk)], -1)
+        recipe_cache.touch_user_state([request.user.pk])
+        return int(pk), Response(status=status.HTTP_204_NO_CONTENT)
+
+    def mark_many(self, request, model, counter):
+        """Пакетное добавление (POST) или удаление (DELETE) рецептов.
+
+        Число запросов не зависит от числа id: рецепты выбираются одним
+        запросом, строки вставляются одним INSERT ... ON CONFLICT DO
+        NOTHING и удаляются одним DELETE, оба с RETURNING. Изменёнными
+        считаются только возвращённые строки, поэтому параллельные
+        пакеты не учитывают один рецепт дважды. Сигналов нет, счётчик
+        и отметка пользователя обновляются здесь. Возвращает id
+        изменённых рецептов и ответ с итогом по каждому id.
+        """
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        recipe_ids = serializer.validated_data['recipes']
+        found = set(
+            Recipe.objects.filter(pk__in=recipe_ids).values_list(
+                'pk', flat=True
+            )
+        )
+        if request.method == 'POST':
+            changed = set(insert_ignore_many(
+                model,
+                [{'user': request.user, 'recipe_id': pk} for pk in found],
+                returning='recipe_id'
+            ))
+            counters.add(counter, changed)
+            done, skipped = 'added', 'already_added'
+        else:
+            changed = set(delete_returning(
+                model, returning='recipe_id', user=request.user,
+                recipe_id__in=found
+            ))
+            counters.add(counter, changed, -1)
+            done, skipped = 'removed', 'not_added'
+        if changed:
+            recipe_cache.touch_user_state([request.user.pk])
+        results = [
+            {
+                'id': pk,
+                'status': (
+                    done if pk in changed
+                    else skipped if pk in found else 'not_found'
+                ),
+            }
+            for pk in recipe_ids
+        ]
+        return changed, Response({'results': results})
 
     @action(
         detail=False,
-        methods=['get'],
+        methods=['post', 'delete'],
+        url_path='favorite',
+        url_name='favorite-batch',
         permission_classes=[permissions.IsAuthenticated]
     )
+    @transaction.atomic
+    def favorite_batch(self, request):
+        """Пакетное добавление и удаление рецептов из избранного."""
+        _, response = self.mark_many(
+            request, Favorite, CounterDelta.RECIPE_FAVORITES
+        )
+        return response
+
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        url_path='shopping_cart',
+        url_name='shopping-cart-batch',
+        permission_classes=[permissions.IsAuthenticated]
+    )
+    @transaction.atomic
+    def shopping_cart_batch(self, request):
+        """Пакетное добавление и удаление рецептов из списка покупок."""
+        changed, response = self.mark_many(
+            request, ShoppingCart, CounterDelta.RECIPE_IN_CARTS
+        )
+        shopping_list.refresh_cart(request.user.pk, changed)
+        return response
+
+    @action(
+        detail=False,
+        methods=['get'],
+        permission_classes=[permissions.IsAuthenticated],
+        renderer_classes=SHOPPING_LIST_RENDERERS,
+        content_negotiation_class=FormatParamNegotiation
+    )
     def download_shopping_cart(self, request):
-        """Скачивание списка покупок."""
-        ingredients = RecipeIngredient.objects.filter(
-            recipe__in_shopping_carts__user=request.user
-        ).values(
-            'ingredient__name', 'ingredient__measurement_unit'
-        ).annotate(
-            total_amount=Sum('amount')
-        ).order_by('ingredient__name')
-        shopping_list = "Список покупок:\n\n"
-        for i, item in enumerate(ingredients, 1):
-            shopping_list += (
-                f"{i}. {item['ingredient__name']} "
-                f"({item['ingredient__measurement_unit']}) — "
-                f"{item['total_amount']}\n"
-            )
-        response = HttpResponse(
-            shopping_list,
-            content_type='text/plain; charset=utf-8'
+        """Скачивание списка покупок (?format=txt|csv|json)."""
+        renderer = request.accepted_renderer
+        response = StreamingHttpResponse(
+            renderer.stream(shopping_list.get_rows(request.user)),
+            content_type=f'{renderer.media_type}; charset=utf-8'
         )
         response['Content-Disposition'] = (
-            'attachment; filename=shopping_list.txt'
+            f'attachment; filename=shopping_list.{renderer.format}'
         )
         return response
@@ -8,7 +8,8 @@ from users.models import User, Subscription
 class CustomUserAdmin(UserAdmin):
     """Админка для пользователей."""
     list_display = (
-        'id', 'username', 'email', 'first_name', 'last_name', 'is_staff'
+        'id', 'username', 'email', 'first_name', 'last_name',
+        'recipes_count', 'is_staff'
     )
     list_filter = ('is_staff', 'is_superuser', 'is_active')
     search_fields = ('username', 'email', 'first_name', 'last_name')
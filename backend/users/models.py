@@ -28,6 +28,18 @@ class User(AbstractUser):
         null=True,
         verbose_name='Аватар',
     )
+    # Уменьшенные версии аватара, см. api.images.
+    avatar_renditions = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        verbose_name='Версии аватара',
+    )
+    recipes_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Число рецептов',
+    )
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username', 'first_name', 'last_name']
@@ -1,10 +1,13 @@
 from django.contrib.auth import get_user_model
+from django.db.models import Prefetch
 from djoser.serializers import UserCreateSerializer, UserSerializer
 from rest_framework import serializers
-from drf_extra_fields.fields import Base64ImageField
 
 from users.models import Subscription
 from recipes.models import Recipe
+from api.serializers.base import (
+    ImageRenditionsField, SparseFieldsetMixin, StreamingBase64ImageField
+)
 
 User = get_user_model()
 
@@ -29,22 +32,54 @@ class CustomUserCreateSerializer(UserCreateSerializer):
         )
 
 
+def get_recipes_limit(request):
+    """Значение ?recipes_limit= или None, если оно не задано или неверно."""
+    try:
+        recipes_limit = int(request.query_params['recipes_limit'])
+    except (KeyError, ValueError):
+        return None
+    return recipes_limit if recipes_limit >= 0 else None
+
+
+def latest_recipes_prefetch(request):
+    """Последние рецепты авторов (не больше ?recipes_limit=) для всех
+    авторов страницы одним запросом в obj.latest_recipes.
+
+    Срез в Prefetch Django выполняет через ROW_NUMBER() OVER (PARTITION
+    BY author_id), поэтому число запросов не зависит от числа авторов.
+    """
+    recipes = Recipe.objects.order_by('-pub_date', '-id').only(
+        *RecipeMinifiedSerializer.Meta.fields, 'author'
+    )
+    recipes_limit = get_recipes_limit(request)
+    if recipes_limit is not None:
+        recipes = recipes[:recipes_limit]
+    return Prefetch('recipes', queryset=recipes, to_attr='latest_recipes')
+
+
 class RecipeMinifiedSerializer(serializers.ModelSerializer):
     """Сериализатор для краткого представления рецепта в подписках."""
+    image_renditions = ImageRenditionsField('image')
+
     class Meta:
         model = Recipe
         fields = (
             'id',
             'name',
             'image',
+            'image_renditions',
             'cooking_time',
         )
 
 
-class CustomUserSerializer(UserSerializer):
-    """Сериализатор для представления пользователя."""
+class CustomUserSerializer(SparseFieldsetMixin, UserSerializer):
+    """Сериализатор для представления пользователя.
+
+    Поддерживает ?fields= и ?omit= в ответах на GET.
+    """
     is_subscribed = serializers.SerializerMethodField()
     avatar = serializers.SerializerMethodField()
+    avatar_renditions = ImageRenditionsField('avatar')
 
     class Meta:
         model = User
@@ -56,9 +91,12 @@ class CustomUserSerializer(UserSerializer):
             'last_name',
             'is_subscribed',
             'avatar',
+            'avatar_renditions',
         )
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         request = self.context.get('request')
         if request and request.user.is_authenticated:
             return Subscription.objects.filter(
@@ -77,7 +115,7 @@ class CustomUserSerializer(UserSerializer):
 
 class SetAvatarSerializer(serializers.ModelSerializer):
     """Сериализатор для добавления аватара пользователю."""
-    avatar = Base64ImageField()
+    avatar = StreamingBase64ImageField()
 
     class Meta:
         model = User
@@ -101,24 +139,30 @@ class UserWithRecipesSerializer(CustomUserSerializer):
             'recipes',
             'recipes_count',
             'avatar',
+            'avatar_renditions',
         )
 
+    def get_recipes_count(self, obj):
+        """Точное число рецептов: из аннотации actual_recipes_count
+        (см. subscriptions) или запросом COUNT. Хранимый recipes_count
+        отстаёт на ещё не перенесённые приращения (recipes.counters)."""
+        if hasattr(obj, 'actual_recipes_count'):
+            return obj.actual_recipes_count
+        return obj.recipes.count()
+
     def get_recipes(self, obj):
         request = self.context.get('request')
-        recipes_limit = request.query_params.get('recipes_limit')
-        recipes = obj.recipes.all()
-        if recipes_limit:
-            try:
-                recipes = recipes[:int(recipes_limit)]
-            except ValueError:
-                pass
+        if hasattr(obj, 'latest_recipes'):
+            recipes = obj.latest_recipes
+        else:
+            recipes = obj.recipes.all()
+            recipes_limit = get_recipes_limit(request)
+            if recipes_limit is not None:
+                recipes = recipes[:recipes_limit]
         return RecipeMinifiedSerializer(
             recipes, many=True, context={'request': request}
         ).data
 
-    def get_recipes_count(self, obj):
-        return obj.recipes.count()
-
 
 class PasswordChangeSerializer(serializers.Serializer):
     """Сериализатор для изменения пароля."""
@@ -0,0 +1,205 @@
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from recipes import counters
+from recipes.models import CounterDelta, Recipe
+from users.models import Subscription, User
+
+
+class SparseUserFieldsTests(TestCase):
+    """?fields= и ?omit= для пользователей и подписок."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com',
+            first_name='Читатель', last_name='Тестовый', password='pass',
+        )
+        for i in range(5):
+            author = User.objects.create_user(
+                username=f'author{i}', email=f'author{i}@example.com',
+                first_name='Автор', last_name=str(i), password='pass',
+            )
+            Subscription.objects.create(user=cls.user, author=author)
+            for j in range(3):
+                Recipe.objects.create(
+                    author=author, name=f'Рецепт {i}.{j}', text='Описание',
+                    cooking_time=5, image=f'recipes/images/{i}_{j}.png',
+                )
+        counters.flush()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_user_list_fields(self):
+        response = self.client.get(
+            '/api/users/', {'fields': 'username,id', 'limit': 10}
+        )
+        for item in response.data['results']:
+            self.assertEqual(list(item), ['id', 'username'])
+
+    def test_user_list_subscription_flag_is_annotated(self):
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/users/', {'limit': 10})
+        flags = {
+            item['username']: item['is_subscribed']
+            for item in response.data['results']
+        }
+        self.assertFalse(flags.pop('reader'))
+        self.assertTrue(all(flags.values()))
+
+    def test_subscriptions_without_recipes(self):
+        # COUNT и страница авторов.
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                '/api/users/subscriptions/', {'omit': 'recipes'}
+            )
+        self.assertEqual(
+            [item['recipes_count'] for item in response.data['results']],
+            [3] * 5
+        )
+        self.assertNotIn('recipes', response.data['results'][0])
+
+    def test_subscriptions_full_response(self):
+        response = self.client.get(
+            '/api/users/subscriptions/', {'recipes_limit': 2}
+        )
+        item = response.data['results'][0]
+        self.assertTrue(item['is_subscribed'])
+        self.assertEqual(len(item['recipes']), 2)
+        self.assertEqual(item['recipes_count'], 3)
+
+
+class SubscribeTests(TestCase):
+    """Подписка и отписка: коды ответов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pass'
+        )
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com', password='pass'
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_subscribe_and_unsubscribe(self):
+        url = f'/api/users/{self.author.id}/subscribe/'
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['id'], self.author.id)
+        self.assertEqual(self.client.post(url).status_code, 400)
+        self.assertEqual(Subscription.objects.count(), 1)
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertEqual(self.client.delete(url).status_code, 400)
+        self.assertFalse(Subscription.objects.exists())
+
+    def test_errors(self):
+        own = f'/api/users/{self.user.id}/subscribe/'
+        self.assertEqual(self.client.post(own).status_code, 400)
+        missing = f'/api/users/{self.author.id + 100}/subscribe/'
+        for method in ('post', 'delete'):
+            response = getattr(self.client, method)(missing)
+            self.assertEqual(response.status_code, 404)
+
+
+class SubscriptionsTests(TestCase):
+    """Подписки с последними рецептами авторов без запросов на автора."""
+    # COUNT, страница авторов, рецепты всех авторов страницы.
+    QUERIES = 3
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pass'
+        )
+        for i in range(6):
+            author = User.objects.create_user(
+                username=f'author{i}', email=f'author{i}@example.com',
+                password='pass',
+            )
+            Subscription.objects.create(user=cls.user, author=author)
+            for j in range(i):
+                Recipe.objects.create(
+                    author=author, name=f'Рецепт {i}.{j}', text='Описание',
+                    cooking_time=5, image=f'recipes/images/{i}_{j}.png',
+                )
+        counters.flush()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get(self, queries=QUERIES, **params):
+        with self.assertNumQueries(queries):
+            response = self.client.get(
+                '/api/users/subscriptions/', {'limit': 6, **params}
+            )
+        self.assertEqual(response.status_code, 200)
+        return {
+            item['username']: item for item in response.data['results']
+        }
+
+    def test_recipes_limit(self):
+        authors = self.get(recipes_limit=2)
+        self.assertEqual(len(authors), 6)
+        for i in range(6):
+            item = authors[f'author{i}']
+            self.assertEqual(item['recipes_count'], i)
+            self.assertEqual(
+                [recipe['name'] for recipe in item['recipes']],
+                [f'Рецепт {i}.{j}' for j in reversed(range(i))][:2]
+            )
+            self.assertTrue(item['is_subscribed'])
+
+    def test_without_limit(self):
+        for params in ({}, {'recipes_limit': 'x'}, {'recipes_limit': -1}):
+            authors = self.get(**params)
+            self.assertEqual(len(authors['author5']['recipes']), 5)
+        # Пустой срез Django не запрашивает.
+        authors = self.get(self.QUERIES - 1, recipes_limit=0)
+        self.assertEqual(authors['author5']['recipes'], [])
+
+
+@override_settings(COUNTER_FLUSH_INTERVAL=3600)
+class RecipesCountTests(TestCase):
+    """recipes_count в API точен, пока приращения ещё не перенесены."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pass'
+        )
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com', password='pass'
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        # Три рецепта в одном интервале: переносит только первая фиксация.
+        for i in range(3):
+            with self.captureOnCommitCallbacks(execute=True):
+                Recipe.objects.create(
+                    author=self.author, name=f'Рецепт {i}', text='Описание',
+                    cooking_time=5,
+                )
+        self.assertTrue(CounterDelta.objects.exists())
+
+    def test_subscribe_response(self):
+        response = self.client.post(
+            f'/api/users/{self.author.id}/subscribe/'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['recipes_count'], 3)
+
+    def test_subscriptions(self):
+        Subscription.objects.create(user=self.user, author=self.author)
+        response = self.client.get('/api/users/subscriptions/')
+        self.assertEqual(response.data['results'][0]['recipes_count'], 3)
@@ -1,4 +1,5 @@
 from django.contrib.auth import get_user_model
+from django.db.models import Exists, OuterRef, Value
 from django.shortcuts import get_object_or_404
 from rest_framework import status, permissions
 from rest_framework.decorators import action
@@ -8,9 +9,13 @@ from djoser.views import UserViewSet
 from users.models import Subscription
 from users.serializers.user_serializers import (
     CustomUserSerializer, UserWithRecipesSerializer,
-    SetAvatarSerializer, PasswordChangeSerializer
+    SetAvatarSerializer, PasswordChangeSerializer, latest_recipes_prefetch
 )
-from api.pagination import CustomPagination
+from api.db import delete_returning, insert_ignore
+from api.pagination import UserPagination
+from recipes import cache as recipe_cache
+from recipes import counters
+from recipes.models import Recipe
 
 User = get_user_model()
 
@@ -19,9 +24,28 @@ class CustomUserViewSet(UserViewSet):
     """Вьюсет для работы с пользователями."""
     queryset = User.objects.all()
     serializer_class = CustomUserSerializer
-    pagination_class = CustomPagination
+    pagination_class = UserPagination
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if (
+            self.action in ('list', 'retrieve')
+            and 'is_subscribed' in self.get_serializer().fields
+        ):
+            queryset = queryset.annotate(
+                is_subscribed=self.get_is_subscribed_expression()
+            )
+        return queryset
+
+    def get_is_subscribed_expression(self):
+        user = self.request.user
+        if not user.is_authenticated:
+            return Value(False)
+        return Exists(
+            Subscription.objects.filter(user=user, author=OuterRef('pk'))
+        )
+
     @action(
         detail=False,
         methods=['get'],
@@ -29,12 +53,25 @@ class CustomUserViewSet(UserViewSet):
     )
     def subscriptions(self, request):
         """Получение списка подписок."""
+        context = {'request': request}
+        fields = UserWithRecipesSerializer(context=context).fields
         queryset = User.objects.filter(
             subscribers__user=request.user
         )
+        if 'is_subscribed' in fields:
+            queryset = queryset.annotate(is_subscribed=Value(True))
+        if 'recipes_count' in fields:
+            # Хранимый счётчик отстаёт на непереносенные приращения.
+            queryset = queryset.annotate(
+                actual_recipes_count=counters.count_of(Recipe, 'author')
+            )
+        if 'recipes' in fields:
+            queryset = queryset.prefetch_related(
+                latest_recipes_prefetch(request)
+            )
         page = self.paginate_queryset(queryset)
         serializer = UserWithRecipesSerializer(
-            page, many=True, context={'request': request}
+            page, many=True, context=context
         )
         return self.get_paginated_response(serializer.data)
 
@@ -45,34 +82,36 @@ class CustomUserViewSet(UserViewSet):
     )
     def subscribe(self, request, id=None):
         """Подписка и отписка от пользователя."""
-        author = get_object_or_404(User, id=id)
         if request.method == 'POST':
+            author = get_object_or_404(User, id=id)
             if request.user == author:
                 return Response(
                     {'detail': 'Нельзя подписаться на самого себя!'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
-            if Subscription.objects.filter(
-                user=request.user, author=author
-            ).exists():
+            # Проверку и вставку делает один запрос: параллельная
+            # повторная подписка не падает на уникальном ограничении.
+            if insert_ignore(
+                Subscription, user=request.user, author=author
+            ) is None:
                 return Response(
                     {'detail': 'Вы уже подписаны на этого автора!'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
-            Subscription.objects.create(user=request.user, author=author)
+            recipe_cache.touch_user_state([request.user.pk])
             serializer = UserWithRecipesSerializer(
                 author, context={'request': request}
             )
             return Response(serializer.data, status=status.HTTP_201_CREATED)
-        subscription = Subscription.objects.filter(
-            user=request.user, author=author
-        )
-        if not subscription.exists():
+        if not delete_returning(
+            Subscription, user=request.user, author_id=id
+        ):
+            get_object_or_404(User, id=id)
             return Response(
                 {'detail': 'Вы не подписаны на этого автора!'},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        subscription.delete()
+        recipe_cache.touch_user_state([request.user.pk])
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(
@@ -136,7 +175,7 @@ class CustomUserViewSet(UserViewSet):
             request.user.set_password(
                 serializer.validated_data['new_password']
             )
-            request.user.save()
+            request.user.save(update_fields=['password'])
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response(
             serializer.errors, status=status.HTTP_400_BAD_REQUEST